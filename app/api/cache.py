@@ -0,0 +1,264 @@
+"""In-process response cache for the read endpoints.
+
+Books and changes only move when a crawl runs, so a rendered response
+stays good until the next one. The crawler's Mongo pipeline bumps a
+counter in `meta` (`crawl_epoch`) when a spider closes; this process reads
+it at most every QTS_CACHE_EPOCH_SECS and drops every entry when it moves.
+Entries are the serialized JSON bodies, keyed on the endpoint and its
+validated query parameters (defaults filled in, so `?page=1` and no page
+share an entry), held in LRU order up to QTS_CACHE_MAX_MB and for at most
+QTS_CACHE_TTL_SECS (0: until the epoch moves). Concurrent misses on one
+key wait for a single query instead of each running it.
+
+Every response carries validators for conditional GETs: list responses an
+ETag made from the crawl epoch and the cache key (and the time the epoch
+last moved as Last-Modified), `versioned` endpoints the ones they return. A request whose If-None-Match (or, without one, If-Modified-Since)
+still holds gets a 304, and the body is never serialized for it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.db.mongo import get_db
+
+META = "meta"
+EPOCH_ID = "crawl_epoch"
+
+CACHE_ENABLED = os.getenv("QTS_CACHE", "true").lower() in {"1", "true", "yes", "on"}
+CACHE_MAX_BYTES = int(float(os.getenv("QTS_CACHE_MAX_MB", "64")) * 1024 * 1024)
+CACHE_TTL_SECS = float(os.getenv("QTS_CACHE_TTL_SECS", "300"))
+EPOCH_CHECK_SECS = float(os.getenv("QTS_CACHE_EPOCH_SECS", "5"))
+# `since_hours` windows start on a multiple of this, so "the last 24 hours" is one entry per bucket
+SINCE_BUCKET_SECS = int(os.getenv("QTS_CACHE_SINCE_BUCKET_SECS", "60"))
+# clients may keep a response but must revalidate it; API-key data is never for shared caches
+CACHE_CONTROL = os.getenv("QTS_HTTP_CACHE_CONTROL", "private, no-cache")
+
+def since_window(hours: int, now: Optional[datetime] = None) -> datetime:
+    """Start of a `since_hours` window, rounded down to SINCE_BUCKET_SECS."""
+    start = (now or datetime.now(timezone.utc)).timestamp() - hours * 3600
+    if SINCE_BUCKET_SECS > 1:
+        start -= start % SINCE_BUCKET_SECS
+    return datetime.fromtimestamp(start, timezone.utc)
+
+def _key(endpoint: str, params: dict) -> str:
+    return endpoint + "?" + json.dumps(jsonable_encoder(params), sort_keys=True, separators=(",", ":"))
+
+def _utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+class Versioned(NamedTuple):
+    """The result of a `versioned` endpoint: its payload and validators."""
+    payload: Any
+    etag: str
+    last_modified: Optional[datetime] = None
+
+def strong_etag(*parts: Any) -> str:
+    return '"' + hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest() + '"'
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Whether the request's validators still hold (RFC 9110: If-Modified-Since only without If-None-Match)."""
+    tags = request.headers.get("if-none-match")
+    if tags is not None:
+        return tags.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in tags.split(","))
+    since = request.headers.get("if-modified-since")
+    if not since or last_modified is None:
+        return False
+    try:
+        since_dt = parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+    if since_dt.tzinfo is None:
+        since_dt = since_dt.replace(tzinfo=timezone.utc)
+    # HTTP dates have whole seconds
+    return _utc(last_modified).replace(microsecond=0) <= since_dt
+
+def _headers(etag: str, last_modified: Optional[datetime], state: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "X-Cache": state}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(_utc(last_modified).astimezone(timezone.utc), usegmt=True)
+    return headers
+
+def _response(request: Request, body: Optional[bytes], etag: str, last_modified: Optional[datetime],
+              state: str) -> Response:
+    headers = _headers(etag, last_modified, state)
+    if not_modified(request, etag, last_modified):
+        response_cache.stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def _encode(payload: Any) -> bytes:
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL_SECS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (body, stored at, etag, last modified)
+        self._entries: OrderedDict[str, tuple[bytes, float, str, Optional[datetime]]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.bytes = 0
+        self.epoch = None
+        self.epoch_at: Optional[datetime] = None
+        self._epoch_checked = 0.0
+        self.stats = dict.fromkeys(
+            ("hits", "misses", "coalesced", "evictions", "expired", "invalidations", "too_large", "not_modified"), 0
+        )
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+        self.epoch = None
+        self.epoch_at = None
+        self._epoch_checked = 0.0
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            "enabled": CACHE_ENABLED,
+            "epoch": self.epoch,
+            "epoch_at": self.epoch_at,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_secs": self.ttl,
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else None,
+            **self.stats,
+        }
+
+    async def _check_epoch(self):
+        now = time.monotonic()
+        if now - self._epoch_checked < EPOCH_CHECK_SECS:
+            return
+        self._epoch_checked = now  # requests arriving meanwhile go on with the epoch we have
+        doc = await get_db()[META].find_one({"_id": EPOCH_ID})
+        epoch = (doc or {}).get("epoch", 0)
+        self.epoch_at = (doc or {}).get("updated_at")
+        if epoch != self.epoch:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self.bytes = 0
+            self.epoch = epoch
+
+    def _get(self, key: str) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl and time.monotonic() - entry[1] > self.ttl:
+            self._drop(key)
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, body: bytes, etag: str, last_modified: Optional[datetime]):
+        if len(body) > self.max_bytes // 8:
+            self.stats["too_large"] += 1
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (body, time.monotonic(), etag, last_modified)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        body = self._entries.pop(key)[0]
+        self.bytes -= len(body)
+
+    async def get(self, endpoint: str, params: dict, load: Callable[[], Awaitable[Any]],
+                  request: Request, versioned: bool = False) -> Response:
+        """The JSON response for `endpoint` with `params` (or a 304), running `load` on a miss.
+
+        With `versioned`, `load` returns a `Versioned`; otherwise the validators are the epoch's.
+        """
+        await self._check_epoch()
+        query = _key(endpoint, params)
+        key = f"{self.epoch}:{query}"
+        # a list's version is the epoch's, so a revalidation needs neither the cache nor Mongo
+        epoch_tag = strong_etag(self.epoch, query)
+        if not versioned and not_modified(request, epoch_tag, self.epoch_at):
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=_headers(epoch_tag, self.epoch_at, "HIT"))
+
+        if not CACHE_ENABLED:
+            result = await load()
+            payload, etag, modified = result if versioned else (result, epoch_tag, self.epoch_at)
+            if not_modified(request, etag, modified):
+                self.stats["not_modified"] += 1
+                return Response(status_code=304, headers=_headers(etag, modified, "MISS"))
+            return _response(request, _encode(payload), etag, modified, "MISS")
+
+        entry = self._get(key)
+        if entry is not None:
+            self.stats["hits"] += 1
+            body, _, etag, modified = entry
+            return _response(request, body, etag, modified, "HIT")
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            body, etag, modified = await asyncio.shield(pending)
+            return _response(request, body, etag, modified, "HIT")
+
+        self.stats["misses"] += 1
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await load()
+            payload, etag, modified = result if versioned else (result, epoch_tag, self.epoch_at)
+            # serialized even for a 304: the entry serves the requests after this one
+            body = _encode(payload)
+            pending.set_result((body, etag, modified))
+        except Exception as e:  # errors (a 400, Mongo down) go to every waiter and are not cached
+            pending.set_exception(e)
+            pending.exception()  # retrieved: nobody may be waiting on it
+            raise
+        finally:
+            del self._inflight[key]
+            if not pending.done():  # cancelled: the waiters are too
+                pending.cancel()
+        if key.startswith(f"{self.epoch}:"):  # not if the epoch moved while loading
+            self._put(key, body, etag, modified)
+        return _response(request, body, etag, modified, "MISS")
+
+response_cache = ResponseCache()
+
+def cached(endpoint: str, normalize: Optional[Callable[[dict], dict]] = None, versioned: bool = False):
+    """Serve a JSON endpoint through `response_cache`, keyed on its arguments.
+
+    `normalize` may rewrite the arguments (the endpoint then runs with the
+    rewritten ones), e.g. to round a time window so that it can be shared.
+    With `versioned`, the endpoint returns a `Versioned` with its own ETag/Last-Modified.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(request: Request, **kwargs):
+            params = normalize(dict(kwargs)) if normalize else kwargs
+            return await response_cache.get(endpoint, params, lambda: fn(**params), request, versioned)
+        # resolved here: FastAPI would read the endpoint's string annotations in this module's namespace
+        sig = inspect.signature(fn, eval_str=True)
+        if "request" in sig.parameters:
+            raise TypeError(f"{fn.__name__}: a cached endpoint gets no `request` of its own")
+        wrapper.__signature__ = sig.replace(parameters=[
+            *sig.parameters.values(),
+            inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+        ])
+        return wrapper
+    return decorate
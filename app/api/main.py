@@ -5,6 +5,7 @@ from app.api.routes_books import router as books_router
 from app.api.routes_changes import router as changes_router
 from app.api.routes_reports import router as reports_router
 from app.api.routes_dashboard import router as dashboard_router
+from app.api.routes_images import router as images_router
 
 app = FastAPI(
     title="QTS Book API",
@@ -22,6 +23,7 @@ app.include_router(books_router)
 app.include_router(changes_router)
 app.include_router(reports_router)
 app.include_router(dashboard_router)
+app.include_router(images_router)
 
 @app.get("/", tags=["health"])
 async def health():
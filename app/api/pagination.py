@@ -0,0 +1,99 @@
+"""Keyset (cursor) pagination and cheap totals for the list endpoints.
+
+A cursor is an opaque, URL-safe token holding the sort key and `_id` of
+the last (or, going back, the first) document of a page, plus the sort it
+was made for. The next page is "everything strictly after that key" in
+(sort field, `_id`) order, so every page costs the same index walk no
+matter how deep it is. Documents missing the sort field (null) sort first,
+as Mongo does.
+
+Totals are the expensive part of a page, so they are opt-in: an exact
+`count_documents` with include_total, otherwise an estimate from the
+collection metadata when no filter applies, otherwise none.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+from datetime import timezone
+from typing import Any, Optional
+
+from bson import json_util
+from bson.json_util import JSONMode, JSONOptions
+from fastapi import HTTPException
+
+_JSON = JSONOptions(json_mode=JSONMode.CANONICAL, tz_aware=True, tzinfo=timezone.utc)
+
+def encode_cursor(sort_field: str, direction: int, doc: dict, backwards: bool = False) -> str:
+    raw = json_util.dumps(
+        {"s": sort_field, "d": direction, "v": doc.get(sort_field), "id": doc["_id"], "b": backwards},
+        json_options=_JSON,
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, sort_field: str, direction: int) -> tuple[Any, Any, bool]:
+    """(sort value, _id, backwards) of a cursor made for this sort; 400 otherwise."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        c = json_util.loads(raw, json_options=_JSON)
+        key = (c["s"], c["d"], c["v"], c["id"], bool(c["b"]))
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if key[:2] != (sort_field, direction):
+        raise HTTPException(status_code=400, detail="Cursor was made for a different sort order")
+    return key[2], key[3], key[4]
+
+def after(sort_field: str, value, oid, direction: int) -> dict:
+    """Filter for the documents strictly after (value, oid) in (sort_field, _id) `direction` order."""
+    op = "$gt" if direction == 1 else "$lt"
+    tie = {sort_field: value, "_id": {op: oid}}
+    if value is None:
+        # nulls sort first: ascending, every non-null value follows; descending, nothing does
+        return {"$or": [tie, {sort_field: {"$ne": None}}]} if direction == 1 else tie
+    branches = [{sort_field: {op: value}}, tie]
+    if direction == -1:
+        branches.append({sort_field: None})
+    return {"$or": branches}
+
+async def keyset_page(coll, query: dict, sort_field: str, direction: int, page_size: int,
+                      cursor: Optional[str], projection: Optional[dict] = None) -> dict:
+    """One page in (sort_field, _id) order from `cursor` ("" or None: the first page).
+
+    Returns the raw documents (in display order) with `next_cursor` /
+    `prev_cursor` (None at either end) and `has_next` / `has_prev`.
+    """
+    backwards = False
+    q = query
+    if cursor:
+        value, oid, backwards = decode_cursor(cursor, sort_field, direction)
+        walk = -direction if backwards else direction
+        cond = after(sort_field, value, oid, walk)
+        q = {"$and": [query, cond]} if query else cond
+    walk = -direction if backwards else direction
+
+    found = coll.find(q, projection).sort([(sort_field, walk), ("_id", walk)]).limit(page_size + 1)
+    docs = [d async for d in found]
+    more = len(docs) > page_size
+    docs = docs[:page_size]
+    if backwards:
+        docs.reverse()
+
+    # walking forward from a cursor there is a page behind; walking back there is one ahead
+    has_next = (more if not backwards else True) and bool(docs)
+    has_prev = (more if backwards else bool(cursor)) and bool(docs)
+    return {
+        "docs": docs,
+        "has_next": has_next,
+        "has_prev": has_prev,
+        "next_cursor": encode_cursor(sort_field, direction, docs[-1]) if has_next else None,
+        "prev_cursor": encode_cursor(sort_field, direction, docs[0], backwards=True) if has_prev else None,
+    }
+
+async def page_total(coll, query: dict, filtered: bool, include_total: bool) -> tuple[Optional[int], bool]:
+    """(total, is_estimate): exact when asked for, estimated when unfiltered, else (None, False)."""
+    if include_total:
+        return await coll.count_documents(query), False
+    if not filtered:
+        return await coll.estimated_document_count(), True
+    return None, False
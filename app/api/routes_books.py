@@ -1,11 +1,15 @@
 from __future__ import annotations
 from bson import ObjectId
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Literal
 from fastapi import APIRouter, Query, Depends, HTTPException
 from app.db.mongo import get_db
-from app.models.book import Book
+from app.models.book import Book, BookSummary, HistoryPoint
 from app.api.deps import require_api_key
 from app.api.limit import rate_limit
+from app.api.pagination import keyset_page, page_total
+from app.api.cache import Versioned, cached, response_cache, strong_etag
+from app.api import search
 import math
 
 router = APIRouter(
@@ -14,26 +18,115 @@ router = APIRouter(
     dependencies=[Depends(require_api_key), Depends(rate_limit)],
 )
 
-SortField = Literal["price", "rating", "reviews", "name", "crawled_at"]
+SortField = Literal["price", "rating", "reviews", "name", "crawled_at", "relevance"]
 SortOrder = Literal["asc", "desc"]
+Bucket = Literal["auto", "raw", "hour", "day", "week", "month"]
+View = Literal["full", "summary"]
+
+HISTORY = "book_history"
+BUCKET_SECS = {"hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400}
+MAX_BUCKETS = 200
+RAW_LIMIT = 5000
+
+def _utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _projection(model) -> dict:
+    """Only the stored fields `model` reads; raw_html_gz and the crawl bookkeeping stay in Mongo."""
+    return {(f.alias or name): 1 for name, f in model.model_fields.items()}
+
+BOOK_FIELDS = _projection(Book)
+SUMMARY_FIELDS = _projection(BookSummary)
+
+def _sparse(fields: Optional[str]) -> Optional[list[str]]:
+    """`fields=name,rating` -> the stored names to return ("id" is `_id`); 400 on unknown fields."""
+    if fields is None:
+        return None
+    names = [("_id" if f.strip() == "id" else f.strip()) for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in BOOK_FIELDS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown) or '(none given)'}; "
+                   f"choose from id, {', '.join(k for k in BOOK_FIELDS if k != '_id')}",
+        )
+    return list(dict.fromkeys(["_id", *names]))
+
+def _render(doc: dict, sparse: Optional[list[str]], view: str) -> dict:
+    doc["_id"] = str(doc["_id"])
+    if sparse is not None:
+        return {k: doc[k] for k in sparse if k in doc}
+    model = BookSummary if view == "summary" else Book
+    return model(**doc).model_dump(by_alias=True)
+
+async def _relevance_page(coll, query: dict, scores: dict, truncated: bool, projection: dict, sparse,
+                          view: str, page: int, page_size: int) -> dict:
+    """A page of search matches, best first: ranked on the ids, then only the page's books are read."""
+    if search.SEARCH_BACKEND == "text":
+        score = {"score": {"$meta": "textScore"}}
+        ranked = coll.find(query, {"_id": 1, **score}).sort([("score", score["score"])]).limit(search.MAX_HITS + 1)
+        ids = [d["_id"] async for d in ranked]
+        truncated = len(ids) > search.MAX_HITS
+        del ids[search.MAX_HITS:]
+    else:
+        matching = {d["_id"] async for d in coll.find(query, {"_id": 1})}  # the hits the other filters keep
+        ids = [i for i in scores if i in matching]
+    total = len(ids)
+    total_pages = math.ceil(total / page_size) if total else 0
+    page = max(1, min(page, max(total_pages, 1)))
+    page_ids = ids[(page - 1) * page_size: page * page_size]
+    docs = {d["_id"]: d async for d in coll.find({"_id": {"$in": page_ids}}, projection)}
+    return {
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": total_pages,
+        "has_prev": page > 1,
+        "has_next": page < total_pages,
+        "prev_page": page - 1 if page > 1 else None,
+        "next_page": page + 1 if page < total_pages else None,
+        "truncated": truncated,
+        "items": [_render(docs[i], sparse, view) for i in page_ids if i in docs],
+    }
+
+def _auto_bucket(span: timedelta) -> str:
+    """Finest unit that keeps the series within MAX_BUCKETS."""
+    for unit, secs in BUCKET_SECS.items():
+        if span.total_seconds() / secs <= MAX_BUCKETS:
+            return unit
+    return "month"
 
 @router.get(
     "",
     summary="List books with filters, sorting, and pagination",
-    description="Filter by category/price/rating, search by name, sort (price/rating/reviews/name/time), and paginate.",
+    description=(
+        "Filter by category/price/rating, search name, category and description with `q` (prefix and typo "
+        "tolerant; sort_by=relevance ranks the matches; `truncated` is set when only the best of them are "
+        "used), sort (price/rating/reviews/name/time), and paginate. "
+        "Page-based by default; pass `cursor=` (empty for the first page, then `next_cursor`/`prev_cursor`) "
+        "for keyset pagination, which costs the same at any depth. In cursor mode `total` is only counted "
+        "with include_total=true, or estimated when no filter is set."
+    ),
 )
+@cached("books")
 async def list_books(
     category: Optional[str] = Query(None, description="Exact category match"),
     min_price: Optional[float] = Query(None, description="price_incl_tax >= min_price"),
     max_price: Optional[float] = Query(None, description="price_incl_tax <= max_price"),
     min_rating: Optional[int] = Query(None, ge=0, le=5, description="Minimum rating (0-5)"),
-    q: Optional[str] = Query(None, description="Case-insensitive substring match on name"),
+    q: Optional[str] = Query(None, description="Search words, matched in name, category and description"),
     sort_by: SortField = "crawled_at",
     order: SortOrder = "desc",
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Keyset pagination: empty for the first page, then a returned cursor"),
+    include_total: bool = Query(False, description="Exact total in cursor mode (costs a count)"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,price_incl_tax"),
+    view: View = Query("full", description="summary: the fields a list or grid needs"),
 ):
     db = get_db()
+    sparse = _sparse(fields)
+    projection = dict.fromkeys(sparse, 1) if sparse else SUMMARY_FIELDS if view == "summary" else BOOK_FIELDS
 
     query: dict = {}
     if category:
@@ -49,8 +142,24 @@ async def list_books(
     if price_cond:
         query["price_incl_tax_num"] = price_cond
 
+    if sort_by == "relevance":
+        if not q:
+            raise HTTPException(status_code=400, detail="sort_by=relevance needs q")
+        if cursor is not None:
+            raise HTTPException(status_code=400, detail="sort_by=relevance pages with page=, not cursor=")
+    scores: dict = {}
+    truncated = False
     if q:
-        query["name"] = {"$regex": q, "$options": "i"}
+        if search.SEARCH_BACKEND == "text":
+            query["$text"] = {"$search": q}
+        else:
+            # the epoch was just read by @cached; the index is rebuilt when it moves.
+            # The best MAX_HITS bound the $in for every sort; `truncated` says the query matched more
+            hits, truncated = await search.search_hits(q, response_cache.epoch, search.MAX_HITS)
+            scores = dict(hits)
+            query["_id"] = {"$in": list(scores)}
+    if sort_by == "relevance":
+        return await _relevance_page(db["books"], query, scores, truncated, projection, sparse, view, page, page_size)
 
     sort_map = {
         "price": ("price_incl_tax_num", -1 if order == "desc" else 1),
@@ -61,22 +170,38 @@ async def list_books(
     }
     sort_field, sort_dir = sort_map[sort_by]
 
-    total = await db["books"].count_documents(query)
+    if cursor is not None:
+        # the cursor is made from the sort key, so it is read even when not returned
+        pg = await keyset_page(db["books"], query, sort_field, sort_dir, page_size, cursor,
+                               {**projection, sort_field: 1})
+        total, estimated = await page_total(db["books"], query, bool(query), include_total)
+        return {
+            "total": total,
+            "total_estimated": estimated,
+            "page_size": page_size,
+            "has_prev": pg["has_prev"],
+            "has_next": pg["has_next"],
+            "prev_cursor": pg["prev_cursor"],
+            "next_cursor": pg["next_cursor"],
+            "truncated": truncated,
+            "items": [_render(d, sparse, view) for d in pg["docs"]],
+        }
+
+    # page mode needs a total for total_pages; unfiltered, the collection estimate will do
+    total, _ = await page_total(db["books"], query, bool(query), include_total=bool(query))
     total_pages = math.ceil(total / page_size) if total else 0
     page = max(1, min(page, max(total_pages, 1)))
     skip = (page - 1) * page_size
 
     cursor = (
         db["books"]
-        .find(query)
+        .find(query, projection)
         .sort(sort_field, sort_dir)
         .skip(skip)
         .limit(page_size)
     )
     docs = [doc async for doc in cursor]
-    for d in docs:
-        d["_id"] = str(d["_id"])
-    items = [Book(**d).model_dump(by_alias=True) for d in docs]
+    items = [_render(d, sparse, view) for d in docs]
 
     return {
         "total": total,
@@ -87,18 +212,102 @@ async def list_books(
         "has_next": page < total_pages,
         "prev_page": page - 1 if page > 1 else None,
         "next_page": page + 1 if page < total_pages else None,
+        "truncated": truncated,
         "items": items,
     }
 
-@router.get("/{book_id}", response_model=Book)
-async def get_book(book_id: str):
+# what a book's ETag is made of, read even when `fields` leaves them out
+VERSION_FIELDS = {"content_hash": 1, "crawled_at": 1, "image_digest": 1}
+
+@router.get("/{book_id}", responses={200: {"model": Book}, 304: {"description": "Not modified"}})
+@cached("book", versioned=True)
+async def get_book(
+    book_id: str,
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,name,description"),
+):
     db = get_db()
+    sparse = _sparse(fields)
     try:
         oid = ObjectId(book_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid book id")
-    doc = await db["books"].find_one({"_id": oid})
+    projection = {**dict.fromkeys(sparse, 1), **VERSION_FIELDS} if sparse else BOOK_FIELDS
+    doc = await db["books"].find_one({"_id": oid}, projection)
     if not doc:
         raise HTTPException(status_code=404, detail="Not found")
-    doc["_id"] = str(doc["_id"])
-    return Book(**doc)
+    # content_hash covers the scraped fields; a touch moves crawled_at and the cover pipeline sets image_digest
+    etag = strong_etag(doc.get("content_hash"), doc.get("crawled_at"), doc.get("image_digest"), sparse)
+    return Versioned(_render(doc, sparse, "full"), etag, doc.get("crawled_at"))
+
+@router.get(
+    "/{book_id}/history",
+    summary="Price, stock and rating history of a book",
+    description=(
+        "One point per crawl, from the book_history time-series collection. "
+        "Defaults to the last 365 days; bucket=auto downsamples server-side to at most "
+        f"{MAX_BUCKETS} buckets (min/max/last per bucket), bucket=raw returns the points as stored."
+    ),
+)
+async def get_book_history(
+    book_id: str,
+    since: Optional[datetime] = Query(None, description="ISO datetime start (UTC, default until-365d)"),
+    until: Optional[datetime] = Query(None, description="ISO datetime end (UTC, default now)"),
+    bucket: Bucket = Query("auto", description="Bucket size; raw disables downsampling"),
+):
+    db = get_db()
+    try:
+        oid = ObjectId(book_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid book id")
+    doc = await db["books"].find_one({"_id": oid}, {"url": 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Not found")
+
+    until_dt = _utc(until) if until is not None else datetime.now(timezone.utc)
+    since_dt = _utc(since) if since is not None else until_dt - timedelta(days=365)
+    if since_dt > until_dt:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    if bucket == "auto":
+        bucket = _auto_bucket(until_dt - since_dt)
+
+    match = {"book": doc["url"], "ts": {"$gte": since_dt, "$lte": until_dt}}
+    if bucket == "raw":
+        cursor = db[HISTORY].find(match).sort("ts", 1).limit(RAW_LIMIT)
+        points = [
+            HistoryPoint(
+                ts=d["ts"], price_min=d.get("price"), price_max=d.get("price"), price_last=d.get("price"),
+                in_stock_last=d.get("in_stock"), stock_min=d.get("stock"), stock_last=d.get("stock"),
+                rating_last=d.get("rating"),
+            )
+            async for d in cursor
+        ]
+    else:
+        trunc = {"date": "$ts", "unit": bucket}
+        if bucket == "week":
+            trunc["startOfWeek"] = "monday"
+        pipeline = [
+            {"$match": match},
+            {"$sort": {"ts": 1}},  # makes $last the latest point of each bucket
+            {"$group": {
+                "_id": {"$dateTrunc": trunc},
+                "price_min": {"$min": "$price"},
+                "price_max": {"$max": "$price"},
+                "price_last": {"$last": "$price"},
+                "in_stock_last": {"$last": "$in_stock"},
+                "stock_min": {"$min": "$stock"},
+                "stock_last": {"$last": "$stock"},
+                "rating_last": {"$last": "$rating"},
+                "points": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]
+        points = [HistoryPoint(ts=row.pop("_id"), **row) async for row in db[HISTORY].aggregate(pipeline)]
+
+    return {
+        "book_id": book_id,
+        "url": doc["url"],
+        "since": since_dt,
+        "until": until_dt,
+        "bucket": bucket,
+        "points": [p.model_dump() for p in points],
+    }
@@ -9,6 +9,8 @@ from app.db.mongo import get_db
 from app.models.book import Change
 from app.api.deps import require_api_key
 from app.api.limit import rate_limit
+from app.api.pagination import keyset_page, page_total
+from app.api.cache import cached, since_window
 
 router = APIRouter(
     prefix="/changes",
@@ -16,17 +18,26 @@ router = APIRouter(
     dependencies=[Depends(require_api_key), Depends(rate_limit)],
 )
 
+def _window(params: dict) -> dict:
+    # since_hours=24 is a new window every request; rounded, it is one per cache bucket
+    if params["since_hours"] is not None:
+        params["since"], params["since_hours"] = since_window(params["since_hours"]), None
+    return params
+
 @router.get(
     "",
     summary="List change log entries",
     description=(
-        "View recent updates (new items and field changes). "
-        "Filter by kind (new/update), significance, time window, or URL. "
-        "Pagination is page-based (page/page_size)."
+        "View recent updates (new items, field changes and removed items). "
+        "Filter by kind (new/update/removed), significance, time window, or URL. "
+        "Pagination is page-based (page/page_size), or keyset-based with `cursor=` (empty for the first "
+        "page, then `next_cursor`/`prev_cursor`); in cursor mode `total` needs include_total=true, or is "
+        "estimated when no filter is set."
     ),
 )
+@cached("changes", normalize=_window)
 async def list_changes(
-    kind: Optional[Literal["new", "update"]] = Query(None, description="Filter by change_kind"),
+    kind: Optional[Literal["new", "update", "removed"]] = Query(None, description="Filter by change_kind"),
     significant: Optional[bool] = Query(None, description="Only significant changes if true"),
     url: Optional[str] = Query(None, description="Exact URL filter"),
     since_hours: Optional[int] = Query(None, ge=1, description="If set, uses now-<hours> as start"),
@@ -34,6 +45,8 @@ async def list_changes(
     until: Optional[datetime] = Query(None, description="ISO datetime end (UTC, default now)"),
     page: int = Query(1, ge=1, description="Page number"),
     page_size: int = Query(20, ge=1, le=100, description="Items per page"),
+    cursor: Optional[str] = Query(None, description="Keyset pagination: empty for the first page, then a returned cursor"),
+    include_total: bool = Query(False, description="Exact total in cursor mode (costs a count)"),
 ):
     db = get_db()
 
@@ -61,6 +74,24 @@ async def list_changes(
         q["significant"] = significant
     if url:
         q["url"] = url
+    # the default window (everything up to now) is no filter at all
+    filtered = any(v is not None for v in (kind, significant, url or None, since_dt, until))
+
+    if cursor is not None:
+        pg = await keyset_page(db["changes"], q, "changed_at", -1, page_size, cursor)
+        total, estimated = await page_total(db["changes"], q, filtered, include_total)
+        for d in pg["docs"]:
+            d["_id"] = str(d["_id"])
+        return {
+            "total": total,
+            "total_estimated": estimated,
+            "page_size": page_size,
+            "has_prev": pg["has_prev"],
+            "has_next": pg["has_next"],
+            "prev_cursor": pg["prev_cursor"],
+            "next_cursor": pg["next_cursor"],
+            "items": [Change(**d).model_dump(by_alias=True) for d in pg["docs"]],
+        }
 
     total = await db["changes"].count_documents(q)
     total_pages = math.ceil(total / page_size) if total else 0
@@ -4,9 +4,8 @@ import os
 import subprocess
 import asyncio
 from collections import deque
-from typing import Optional
-from pathlib import Path
-from datetime import datetime, timezone
+from typing import Literal, Optional
+from datetime import datetime, timedelta, timezone
 
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import HTMLResponse, RedirectResponse, Response, PlainTextResponse
@@ -14,13 +13,23 @@ from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from secrets import compare_digest
 
+from app.db.mongo import get_db
+from app.api.cache import response_cache
+
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 templates = Jinja2Templates(directory="app/templates")
 basic = HTTPBasic()
 
 _CRAWL_PROC: Optional[subprocess.Popen] = None
-_CRAWL_LOGS: deque[str] = deque(maxlen=1000)
+# dashboard actions and process exits only; the crawl itself reports through crawl_events
+_CRAWL_LOGS: deque[str] = deque(maxlen=200)
 _CRAWL_PUMP_TASK: Optional[asyncio.Task] = None
+# the crawler's own stdout/stderr go here, never through this process
+CRAWL_LOG_FILE = os.getenv("QTS_CRAWL_LOG_FILE", "logs/crawl.log")
+CRAWL_LOG_TAIL = 20  # lines of it shown when a crawl process fails
+
+EVENTS = "crawl_events"
+EVENT_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
 
 def _auth(creds: HTTPBasicCredentials = Depends(basic)) -> str:
     user_env = os.getenv("QTS_ADMIN_USER")
@@ -40,20 +49,78 @@ def _log(line: str):
     ts = datetime.now(timezone.utc).strftime("%H:%M:%S")
     _CRAWL_LOGS.append(f"[{ts}] {line.rstrip()}")
 
-async def _pump_proc_output(proc: subprocess.Popen):
-    assert proc.stdout is not None
-    for line in iter(proc.stdout.readline, ""):
-        if not line:
-            break
-        _log(line)
-    code = proc.wait()
+def _log_tail(path: str, lines: int) -> list[str]:
+    try:
+        with open(path, "rb") as fh:
+            fh.seek(0, os.SEEK_END)
+            fh.seek(max(0, fh.tell() - 16 * 1024))
+            return fh.read().decode("utf-8", "replace").splitlines()[-lines:]
+    except OSError:
+        return []
+
+async def _watch_proc(proc: subprocess.Popen, log_path: str):
+    code = await asyncio.to_thread(proc.wait)
     _log(f"Process exited with code {code}")
+    if code:
+        for line in _log_tail(log_path, CRAWL_LOG_TAIL):
+            _log(f"  {line}")
+
+async def _crawl_events(run: Optional[str] = None, level: str = "info", type: Optional[str] = None,
+                        limit: int = 200) -> tuple[Optional[str], list[dict]]:
+    """Events of `run` (default: the newest run) at `level` or above, oldest first."""
+    coll = get_db()[EVENTS]
+    if not run:
+        newest = [d async for d in coll.find({}).sort("ts", -1).limit(1)]
+        run = newest[0]["run"] if newest else None
+    if not run:
+        return None, []
+    q: dict = {"run": run, "severity": {"$gte": EVENT_LEVELS.get(level, 20)}}
+    if type:
+        q["type"] = type
+    docs = [d async for d in coll.find(q).sort("ts", -1).limit(max(1, min(limit, 2000)))]
+    docs.reverse()
+    return run, [
+        {"ts": _aware(d["ts"]).isoformat(), "type": d["type"], "level": d["level"], "msg": d.get("msg", ""),
+         "data": d.get("data", {})}
+        for d in docs
+    ]
+
+async def _recent_runs(limit: int = 10) -> list[dict]:
+    started = get_db()[EVENTS].find({"type": "crawl.started"}).sort("ts", -1).limit(limit)
+    return [{"run": d["run"], "spider": d.get("spider"), "ts": _aware(d["ts"]).isoformat()} async for d in started]
+
+# a running job whose checkpoints have not been flushed for this long has probably died
+STALLED_AFTER = timedelta(seconds=60)
 
-def _jobdir_path() -> Path:
-    return Path(os.getcwd()) / "app" / ".job" / "books"
+def _aware(dt: Optional[datetime]) -> Optional[datetime]:
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
 
-def _has_resume_state(jobdir: Path) -> bool:
-    return jobdir.exists() and any(jobdir.iterdir())
+async def _latest_job(mode: Optional[str] = None) -> Optional[dict]:
+    # crawl_jobs is written by the spider's category checkpoints (qtsbook/checkpoints.py)
+    q = {"mode": mode} if mode else {}
+    jobs = [d async for d in get_db()["crawl_jobs"].find(q).sort("started_at", -1).limit(1)]
+    return jobs[0] if jobs else None
+
+def _job_progress(job: Optional[dict]) -> Optional[dict]:
+    if not job:
+        return None
+    now = datetime.now(timezone.utc)
+    updated = _aware(job.get("updated_at"))
+    eta_at = _aware(job.get("eta_at"))
+    status = job.get("status")
+    return {
+        "job": job["_id"],
+        "mode": job.get("mode"),
+        "status": status,
+        "sessions": job.get("sessions", 1),
+        "percent": job.get("percent", 0.0),
+        "items": job.get("items", 0),
+        "categories_complete": job.get("categories_complete", 0),
+        "categories_total": job.get("categories_total"),
+        "eta_secs": max(0, round((eta_at - now).total_seconds())) if eta_at and status == "running" else None,
+        "updated_at": updated.isoformat() if updated else None,
+        "stalled": status == "running" and updated is not None and now - updated > STALLED_AFTER,
+    }
 
 @router.get("", response_class=HTMLResponse)
 async def dashboard_home(request: Request, _user: str = Depends(_auth)):
@@ -64,22 +131,56 @@ async def dashboard_home(request: Request, _user: str = Depends(_auth)):
             "request": request,
             "mongo_ui": _mongo_ui_url(),
             "crawl_running": running,
+            "progress": _job_progress(await _latest_job()),
         },
     )
 
+@router.get("/progress.json")
+async def dashboard_progress(_user: str = Depends(_auth)):
+    running = _CRAWL_PROC is not None and _CRAWL_PROC.poll() is None
+    return {"crawl_running": running, "progress": _job_progress(await _latest_job())}
+
+@router.get("/cache.json")
+async def dashboard_cache(_user: str = Depends(_auth)):
+    return response_cache.snapshot()
+
+@router.post("/cache/clear")
+async def dashboard_cache_clear(_user: str = Depends(_auth)):
+    response_cache.clear()
+    return response_cache.snapshot()
+
 @router.get("/docs", response_class=HTMLResponse)
 async def dashboard_docs(request: Request, _user: str = Depends(_auth)):
     return templates.TemplateResponse("docs.html", {"request": request, "mongo_ui": _mongo_ui_url()})
 
+EventLevel = Literal["debug", "info", "warning", "error"]
+
 @router.get("/logs", response_class=HTMLResponse)
-async def dashboard_logs(request: Request, _user: str = Depends(_auth)):
-    return templates.TemplateResponse("logs.html", {"request": request, "logs": "\n".join(_CRAWL_LOGS)})
+async def dashboard_logs(request: Request, run: Optional[str] = None, level: EventLevel = "info",
+                         type: Optional[str] = None, limit: int = 200, _user: str = Depends(_auth)):
+    run, events = await _crawl_events(run, level, type, limit)
+    return templates.TemplateResponse("logs.html", {
+        "request": request, "logs": "\n".join(_CRAWL_LOGS), "events": events, "run": run,
+        "runs": await _recent_runs(), "level": level, "type": type or "", "limit": limit,
+    })
+
+@router.get("/events.json")
+async def dashboard_events(run: Optional[str] = None, level: EventLevel = "info", type: Optional[str] = None,
+                           limit: int = 200, _user: str = Depends(_auth)):
+    run, events = await _crawl_events(run, level, type, limit)
+    return {"run": run, "events": events}
 
 @router.get("/logs.txt", response_class=PlainTextResponse)
-async def dashboard_logs_txt(_user: str = Depends(_auth)):
-    return PlainTextResponse("\n".join(_CRAWL_LOGS) + "\n")
+async def dashboard_logs_txt(run: Optional[str] = None, level: EventLevel = "info", type: Optional[str] = None,
+                             limit: int = 1000, _user: str = Depends(_auth)):
+    run, events = await _crawl_events(run, level, type, limit)
+    lines = list(_CRAWL_LOGS)
+    if run:
+        lines.append(f"--- run {run}")
+    lines += [f"[{e['ts'][11:19]}] {e['level'].upper():<7} {e['type']:<14} {e['msg']}" for e in events]
+    return PlainTextResponse("\n".join(lines) + "\n")
 
-def _spawn_crawl(env_overrides: dict[str, str]) -> None:
+def _spawn_crawl(env_overrides: dict[str, str], args: tuple[str, ...] = ("-m", "scheduler.run_crawl")) -> None:
     global _CRAWL_PROC, _CRAWL_PUMP_TASK
     if _CRAWL_PROC and _CRAWL_PROC.poll() is None:
         return
@@ -88,35 +189,43 @@ def _spawn_crawl(env_overrides: dict[str, str]) -> None:
     env = os.environ.copy()
     env.update(env_overrides)
 
-    _CRAWL_PROC = subprocess.Popen(
-        ["python", "-m", "scheduler.run_crawl"],
-        cwd=os.path.join(os.getcwd()),
-        env=env,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-    )
+    log_path = os.path.abspath(CRAWL_LOG_FILE)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "wb") as log_fh:
+        _CRAWL_PROC = subprocess.Popen(
+            ["python", *args],
+            cwd=os.path.join(os.getcwd()),
+            env=env,
+            stdout=log_fh,
+            stderr=subprocess.STDOUT,
+        )
     loop = asyncio.get_running_loop()
-    _CRAWL_PUMP_TASK = loop.create_task(_pump_proc_output(_CRAWL_PROC))
+    _CRAWL_PUMP_TASK = loop.create_task(_watch_proc(_CRAWL_PROC, log_path))
 
 @router.post("/crawl/start", response_class=RedirectResponse, status_code=303)
 async def crawl_start(_user: str = Depends(_auth)):
     # ALWAYS fresh crawl (no resume)
     _log("Starting fresh crawl…")
-    _spawn_crawl({"QTS_SCRAPY_RESUME": "false"})
+    _spawn_crawl({"QTS_SCRAPY_RESUME": "false", "QTS_CRAWL_MODE": "full"})
+    return RedirectResponse("/dashboard/logs", status_code=303)
+
+@router.post("/crawl/start-fast", response_class=RedirectResponse, status_code=303)
+async def crawl_start_fast(_user: str = Depends(_auth)):
+    # Listing-only refresh: detail pages only for new books or changed listings
+    _log("Starting fast refresh crawl…")
+    _spawn_crawl({"QTS_SCRAPY_RESUME": "false", "QTS_CRAWL_MODE": "fast"})
     return RedirectResponse("/dashboard/logs", status_code=303)
 
 @router.post("/crawl/start-resume", response_class=RedirectResponse, status_code=303)
 async def crawl_start_resume(_user: str = Depends(_auth)):
-    # Resume if there is state; otherwise fall back to fresh
-    jobdir = _jobdir_path()
-    if _has_resume_state(jobdir):
-        _log(f"Starting crawl with resume (JOBDIR={jobdir})…")
-        _spawn_crawl({"QTS_SCRAPY_RESUME": "true"})
+    # Resume if the last full crawl did not finish; otherwise fall back to fresh
+    job = await _latest_job("full")
+    if job and job.get("status") != "finished":
+        _log(f"Resuming crawl job {job['_id']} ({job.get('percent', 0.0):.1f}% done)…")
+        _spawn_crawl({"QTS_SCRAPY_RESUME": "true", "QTS_CRAWL_MODE": "full"})
     else:
         _log("No resume state found. Starting fresh crawl…")
-        _spawn_crawl({"QTS_SCRAPY_RESUME": "false"})
+        _spawn_crawl({"QTS_SCRAPY_RESUME": "false", "QTS_CRAWL_MODE": "full"})
     return RedirectResponse("/dashboard/logs", status_code=303)
 
 @router.post("/crawl/stop", response_class=RedirectResponse, status_code=303)
@@ -153,6 +262,33 @@ async def schedule_run_now(_user: str = Depends(_auth)):
     asyncio.create_task(_run())
     return RedirectResponse("/dashboard/logs", status_code=303)
 
+@router.get("/recrawl", response_class=HTMLResponse)
+async def dashboard_recrawl(request: Request, sort: str = "due", kind: Optional[str] = None, limit: int = 200,
+                            _user: str = Depends(_auth)):
+    # estimates written by the adaptive scheduler (scheduler/schedule_adaptive.py)
+    db = get_db()
+    now = datetime.now(timezone.utc)
+    q = {"kind": kind} if kind in ("book", "category") else {}
+    sort_field, sort_dir = ("rate_per_day", -1) if sort == "rate" else ("next_due", 1)
+    units = [d async for d in db["recrawl_plan"].find(q).sort(sort_field, sort_dir).limit(max(1, min(limit, 1000)))]
+    summary = {
+        "units": await db["recrawl_plan"].count_documents({}),
+        "due": await db["recrawl_plan"].count_documents({"next_due": {"$lte": now}}),
+        "in_batch": await db["recrawl_plan"].count_documents({"batch": {"$exists": True}}),
+    }
+    running = _CRAWL_PROC is not None and _CRAWL_PROC.poll() is None
+    return templates.TemplateResponse(
+        "recrawl.html",
+        {"request": request, "units": units, "summary": summary, "now": now, "sort": sort, "kind": kind,
+         "crawl_running": running},
+    )
+
+@router.post("/recrawl/run-now", response_class=RedirectResponse, status_code=303)
+async def recrawl_run_now(_user: str = Depends(_auth)):
+    _log("Running adaptive recrawl tick…")
+    _spawn_crawl({}, ("-m", "scheduler.schedule_adaptive", "--once"))
+    return RedirectResponse("/dashboard/logs", status_code=303)
+
 @router.get("/logout")
 def logout():
     return Response(status_code=401, headers={"WWW-Authenticate": "Basic"})
@@ -0,0 +1,44 @@
+from __future__ import annotations
+from typing import Literal, Optional
+from fastapi import APIRouter, Header, HTTPException, Path, Response
+from app.db.mongo import get_db
+
+# No API key: the images are immutable, addressed by the digests the book
+# endpoints hand out, and meant for <img src> (which can't send headers).
+router = APIRouter(prefix="/images", tags=["images"])
+
+IMAGES = "images"
+# a digest always names the same bytes, so any cache may keep them for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+@router.get(
+    "/{digest}",
+    summary="Stored cover image by digest",
+    description="Serves a cover stored by the crawler under the SHA-256 in a book's `image_digest`. "
+                "`size=thumb` returns the fixed-size JPEG thumbnail.",
+    responses={200: {"content": {"image/*": {}}}, 304: {"description": "Not modified"}},
+)
+async def get_image(
+    digest: str = Path(..., pattern="^[0-9a-f]{64}$", description="SHA-256 of the image (book.image_digest)"),
+    size: Literal["full", "thumb"] = "full",
+    if_none_match: Optional[str] = Header(None),
+):
+    etag = f'"{digest}"' if size == "full" else f'"{digest}-thumb"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+
+    db = get_db()
+    fields = {"data": 1, "content_type": 1} if size == "full" else {"thumb": 1}
+    doc = await db[IMAGES].find_one({"_id": digest}, fields)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if size == "thumb":
+        doc = doc.get("thumb")
+        if not doc:
+            raise HTTPException(status_code=404, detail="No thumbnail for this image")
+    return Response(
+        content=bytes(doc["data"]),
+        media_type=doc.get("content_type") or "application/octet-stream",
+        headers=headers,
+    )
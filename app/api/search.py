@@ -0,0 +1,241 @@
+"""Book search for the `q` filter of /books.
+
+Two backends, picked with QTS_SEARCH_BACKEND:
+
+- `memory` (default): an inverted index over name, category and description,
+  held in this process and rebuilt in a worker thread when the crawl epoch
+  moves (app/api/cache.py). Searches wait for the rebuild rather than answer
+  from the old index, whose results would be cached under the new epoch.
+  Text is folded to lowercase ASCII and split into words. Every query word
+  must match a book, exactly, as a prefix (the last word only, so results
+  follow typing) or within one edit (two for words of 8+ letters; the first
+  letter has to be right). Books are ranked by tf-idf with field boosts and
+  length norms; prefix and typo matches count for less than exact ones.
+  Only the best QTS_SEARCH_MAX_HITS books of a query are kept, for every
+  sort; /books says `truncated` when a query matched more.
+- `text`: Mongo's `$text` over the `books_text` index the crawler creates
+  when this backend is configured. Stemmed words only: no prefixes, no typos.
+
+`python benchmarks/bench_search.py` compares both with the old `$regex` scan.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import math
+import os
+import re
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Any, Iterable, Optional
+
+from app.db.mongo import get_db
+from app.utils.logging import logger
+
+SEARCH_BACKEND = os.getenv("QTS_SEARCH_BACKEND", "memory")
+MAX_HITS = int(os.getenv("QTS_SEARCH_MAX_HITS", "1000"))
+# matches in the name count three times a description match
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+SEARCH_FIELDS = {f: 1 for f in FIELD_WEIGHTS}
+PREFIX_FACTOR = 0.7
+FUZZY_FACTOR = 0.5  # per edit
+MAX_EXPANSIONS = 50  # vocabulary terms one query word may stand for
+# a one-word query only reads this many postings per term, best first
+TOP_POSTINGS = MAX_HITS
+MIN_PREFIX = 2
+MIN_FUZZY = 4
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: Optional[str]) -> list[str]:
+    """Lowercase ASCII words of `text` ("Les Misérables" -> ["les", "miserables"])."""
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return _WORD.findall(folded)
+
+def _max_edits(term: str) -> int:
+    return 0 if len(term) < MIN_FUZZY else 1 if len(term) < 8 else 2
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (a transposition is one edit), or limit + 1 beyond `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2: list[int] = []
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+class SearchIndex:
+    """Postings per term: book ordinals and their precomputed field-weighted tf."""
+
+    def __init__(self):
+        self.ids: list[Any] = []
+        self._postings: dict[str, tuple[array, array]] = {}  # in book order
+        self._top: dict[str, tuple[array, array]] = {}  # each term's best TOP_POSTINGS, best first
+        self._terms: list[str] = []  # sorted, for prefixes
+        self._shapes: dict[tuple[str, int], list[str]] = {}  # (first letter, length) -> terms, for typos
+        self.epoch = None
+        self.build_secs = 0.0
+
+    @classmethod
+    def build(cls, docs: Iterable[dict], epoch=None) -> "SearchIndex":
+        t0 = time.perf_counter()
+        index = cls()
+        postings = index._postings
+        for doc in docs:
+            n = len(index.ids)
+            index.ids.append(doc["_id"])
+            weights: dict[str, float] = {}
+            for field, boost in FIELD_WEIGHTS.items():
+                words = tokenize(doc.get(field))
+                if not words:
+                    continue
+                tf: dict[str, int] = {}
+                for w in words:
+                    tf[w] = tf.get(w, 0) + 1
+                norm = boost / math.sqrt(len(words))
+                for w, c in tf.items():
+                    weights[w] = weights.get(w, 0.0) + math.sqrt(c) * norm
+            for w, weight in weights.items():
+                p = postings.get(w)
+                if p is None:
+                    p = postings[w] = (array("I"), array("f"))
+                p[0].append(n)
+                p[1].append(weight)
+        for w, (ids, weights) in postings.items():
+            if len(ids) > 1:
+                order = heapq.nlargest(TOP_POSTINGS, range(len(ids)), key=weights.__getitem__)
+                index._top[w] = (array("I", map(ids.__getitem__, order)), array("f", map(weights.__getitem__, order)))
+        index._terms = sorted(postings)
+        for term in index._terms:
+            index._shapes.setdefault((term[0], len(term)), []).append(term)
+        index.epoch = epoch
+        index.build_secs = time.perf_counter() - t0
+        return index
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def terms(self) -> int:
+        return len(self._terms)
+
+    def _expand(self, word: str, last: bool) -> list[tuple[str, float]]:
+        """Vocabulary terms standing for `word`, with how much a match on each counts."""
+        found = {word: 1.0} if word in self._postings else {}
+        if last and len(word) >= MIN_PREFIX:
+            i = bisect_left(self._terms, word)
+            while i < len(self._terms) and self._terms[i].startswith(word):
+                found.setdefault(self._terms[i], PREFIX_FACTOR)
+                i += 1
+        if not found and (limit := _max_edits(word)):
+            for length in range(len(word) - limit, len(word) + limit + 1):
+                for term in self._shapes.get((word[0], length), ()):
+                    d = edit_distance(word, term, limit)
+                    if d <= limit:
+                        found[term] = FUZZY_FACTOR ** d
+        if len(found) > MAX_EXPANSIONS:  # the most common terms of a short prefix
+            keep = heapq.nlargest(MAX_EXPANSIONS, found, key=lambda t: (found[t], len(self._postings[t][0])))
+            found = {t: found[t] for t in keep}
+        return list(found.items())
+
+    def search(self, q: str, limit: int = MAX_HITS) -> tuple[list[tuple[Any, float]], bool]:
+        """The best `limit` (_id, score) pairs of the books matching every word of `q`, and whether more matched."""
+        words = list(dict.fromkeys(tokenize(q)))
+        if not words or not self.ids:
+            return [], False
+        n = len(self.ids)
+        per_word = []
+        for i, word in enumerate(words):
+            expansions = self._expand(word, last=i == len(words) - 1)
+            if not expansions:
+                return [], False
+            per_word.append(expansions)
+        # the rarest word first: it bounds the candidates the others are summed over
+        per_word.sort(key=lambda ex: sum(len(self._postings[t][0]) for t, _ in ex))
+
+        # a book's score for one word is that of its best term; for the whole query, the sum over words
+        single = len(per_word) == 1 and limit <= TOP_POSTINGS
+        scores: Optional[dict[int, float]] = None
+        truncated = False
+        for expansions in per_word:
+            best: dict[int, float] = {}
+            for term, factor in expansions:
+                ids, weights = self._postings[term]
+                f = factor * math.log(1 + n / len(ids))
+                if single:  # the best `limit` books of a word are among the best `limit` of each term
+                    truncated = truncated or len(ids) > limit
+                    ids, weights = self._top.get(term, (ids, weights))
+                if scores is None and len(expansions) == 1:  # no best term to pick: one C-level pass
+                    best = dict(zip(ids, map(f.__mul__, weights)))
+                    continue
+                if scores is not None and len(scores) * 16 < len(ids):
+                    # few candidates left: look them up in the (book-ordered) postings
+                    for d in scores:
+                        i = bisect_left(ids, d)
+                        if i < len(ids) and ids[i] == d:
+                            s = f * weights[i]
+                            if s > best.get(d, 0.0):
+                                best[d] = s
+                    continue
+                for d, w in zip(ids, weights):
+                    if scores is None or d in scores:
+                        s = f * w
+                        if s > best.get(d, 0.0):
+                            best[d] = s
+            scores = best if scores is None else {d: s + scores[d] for d, s in best.items()}
+            if not scores:
+                return [], False
+        top = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+        return [(self.ids[d], s) for d, s in top], truncated or len(scores) > limit
+
+class _Indexer:
+    """The current index and its rebuilds, one at a time."""
+
+    def __init__(self):
+        self.index: Optional[SearchIndex] = None
+        self._building: Optional[asyncio.Task] = None
+
+    async def _build(self, epoch) -> SearchIndex:
+        docs = [d async for d in get_db()["books"].find({}, SEARCH_FIELDS)]
+        index = await asyncio.to_thread(SearchIndex.build, docs, epoch)
+        self.index = index
+        return index
+
+    async def current(self, epoch) -> SearchIndex:
+        if self.index is not None and self.index.epoch == epoch:
+            return self.index
+        if self._building is None or self._building.done():
+            self._building = asyncio.create_task(self._build(epoch))
+            self._building.add_done_callback(_log_failure)
+        # not the last index meanwhile: its results would be cached as the new epoch's
+        return await asyncio.shield(self._building)
+
+    def clear(self):
+        self.index = None
+        self._building = None
+
+def _log_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.opt(exception=task.exception()).error("Search index build failed")
+
+indexer = _Indexer()
+
+async def search_hits(q: str, epoch, limit: int = MAX_HITS) -> tuple[list[tuple[Any, float]], bool]:
+    """(_id, score) of the best books for `q`, best first, from the in-process index; and whether more matched."""
+    index = await indexer.current(epoch)
+    return index.search(q, limit)
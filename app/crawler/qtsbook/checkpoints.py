@@ -0,0 +1,196 @@
+"""Per-category crawl checkpoints in Mongo.
+
+A crawl job (`crawl_jobs`) keeps one `crawl_checkpoints` doc per category:
+listing pages seen, items processed, the listing page to resume from and
+a state (partial → complete). A category's resume page only moves past a
+listing page once every detail request from that page has been answered,
+failed or dropped. A category is complete when its last listing page has
+been reached that way.
+
+A resumed job skips complete categories and restarts partial ones from
+their resume page, so at most one listing page's details are fetched
+twice. The job doc also carries the live progress the dashboard shows:
+percent complete (per-category item counts against the "N results" of
+their listings) and an ETA from this session's rate.
+"""
+
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, UpdateOne
+
+JOBS = "crawl_jobs"
+CHECKPOINTS = "crawl_checkpoints"
+
+class CategoryProgress:
+    def __init__(self, url: str, name: str | None = None, doc: dict | None = None):
+        doc = doc or {}
+        self.url = url
+        self.name = doc.get("name") or name
+        self.pages_seen = doc.get("pages_seen", 0)
+        self.items = doc.get("items", 0)
+        self.books_total = doc.get("books_total")
+        self.resume_url = doc.get("resume_url") or url
+        self.state = doc.get("state", "partial")
+        self.dirty = False
+        self._pages: deque[list] = deque()  # [listing url, detail requests outstanding]
+        self._next_url = None
+
+    def listing(self, page_url: str, next_url: str | None, details: int, books_total: int | None = None):
+        self.pages_seen += 1
+        if books_total is not None:
+            self.books_total = books_total
+        self._pages.append([page_url, details])
+        self._next_url = next_url
+        self._advance()
+
+    def detail_done(self, page_url: str):
+        for page in self._pages:
+            if page[0] == page_url:
+                page[1] -= 1
+                break
+        self._advance()
+
+    def item(self):
+        self.items += 1
+        self.dirty = True
+
+    def _advance(self):
+        while self._pages and self._pages[0][1] <= 0:
+            self._pages.popleft()
+        if self._pages:
+            self.resume_url = self._pages[0][0]
+        elif self._next_url:
+            self.resume_url = self._next_url
+        else:
+            self.state = "complete"
+        self.dirty = True
+
+    def fraction(self) -> float:
+        if self.state == "complete":
+            return 1.0
+        if self.books_total:
+            return min(self.items / self.books_total, 0.99)
+        return 0.0
+
+    def to_doc(self) -> dict:
+        return {
+            "url": self.url, "name": self.name, "state": self.state,
+            "pages_seen": self.pages_seen, "items": self.items, "books_total": self.books_total,
+            "resume_url": self.resume_url,
+        }
+
+class Checkpoints:
+    def __init__(self, db, job_id: str, mode: str, docs: dict | None = None):
+        self.db = db
+        self.job_id = job_id
+        self.mode = mode
+        self.categories: dict[str, CategoryProgress] = {
+            url: CategoryProgress(url, doc=doc) for url, doc in (docs or {}).items()
+        }
+        self.categories_total = None
+        self._t0 = time.monotonic()
+        self._f0 = None  # fraction done when this session started
+
+    @staticmethod
+    def resumable(db, mode: str) -> dict | None:
+        """The job a resumed crawl of `mode` continues: the newest one, unless it finished."""
+        job = db[JOBS].find_one({"mode": mode}, sort=[("started_at", -1)])
+        return job if job and job.get("status") != "finished" else None
+
+    @classmethod
+    def open(cls, db, mode: str, resume: bool = False, generation: str | None = None) -> "Checkpoints":
+        """Continue the newest job of `mode` when `resume` and it is unfinished, else start a new one.
+
+        A new job records the crawl `generation` its items are snapshotted
+        under, so that a resumed session keeps adding to the same one.
+        """
+        db[CHECKPOINTS].create_index([("job", ASCENDING), ("url", ASCENDING)], unique=True)
+        db[JOBS].create_index([("mode", ASCENDING), ("started_at", -1)])
+        now = datetime.now(timezone.utc)
+        job = cls.resumable(db, mode) if resume else None
+        if job:
+            docs = {d["url"]: d for d in db[CHECKPOINTS].find({"job": job["_id"]})}
+            cp = cls(db, job["_id"], mode, docs)
+            cp.categories_total = job.get("categories_total")
+            db[JOBS].update_one(
+                {"_id": job["_id"]},
+                {"$set": {"status": "running", "resumed_at": now, "updated_at": now}, "$inc": {"sessions": 1}},
+            )
+            return cp
+        # a dashboard run and a scheduled one may start in the same second
+        job_id = f"{now:%Y%m%dT%H%M%S}-{mode}-{uuid.uuid4().hex[:6]}"
+        db[JOBS].insert_one({
+            "_id": job_id, "mode": mode, "status": "running", "sessions": 1,
+            "started_at": now, "resumed_at": now, "updated_at": now,
+            "categories_total": None, "percent": 0.0, "items": 0, "eta_secs": None, "generation": generation,
+        })
+        return cls(db, job_id, mode)
+
+    def set_total(self, n: int):
+        self.categories_total = max(n, len(self.categories))
+
+    def category(self, url: str, name: str | None = None) -> CategoryProgress:
+        cat = self.categories.get(url)
+        if cat is None:
+            cat = self.categories[url] = CategoryProgress(url, name)
+            cat.dirty = True
+        return cat
+
+    def fraction(self) -> float:
+        total = self.categories_total or len(self.categories)
+        if not total:
+            return 0.0
+        return sum(c.fraction() for c in self.categories.values()) / total
+
+    def progress(self) -> dict:
+        f = self.fraction()
+        if self._f0 is None:
+            self._f0 = f
+        elapsed = time.monotonic() - self._t0
+        rate = (f - self._f0) / elapsed if elapsed > 0 else 0.0
+        return {
+            "percent": round(f * 100, 2),
+            "items": sum(c.items for c in self.categories.values()),
+            "categories_total": self.categories_total,
+            "categories_complete": sum(1 for c in self.categories.values() if c.state == "complete"),
+            "eta_secs": round((1 - f) / rate) if rate > 0 else None,
+        }
+
+    def flush(self):
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne(
+                {"job": self.job_id, "url": c.url},
+                {"$set": {**c.to_doc(), "job": self.job_id, "updated_at": now}},
+                upsert=True,
+            )
+            for c in self.categories.values() if c.dirty
+        ]
+        if ops:
+            self.db[CHECKPOINTS].bulk_write(ops, ordered=False)
+            for c in self.categories.values():
+                c.dirty = False
+        progress = self.progress()
+        eta = progress["eta_secs"]
+        self.db[JOBS].update_one({"_id": self.job_id}, {"$set": {
+            **progress, "updated_at": now, "eta_at": now + timedelta(seconds=eta) if eta is not None else None,
+        }})
+
+    def complete(self, reason: str) -> bool:
+        """Whether a session ending with `reason` finishes the job: every category complete."""
+        return (
+            reason == "finished"
+            and bool(self.categories)
+            and all(c.state == "complete" for c in self.categories.values())
+        )
+
+    def close(self, reason: str) -> str:
+        self.flush()
+        status = "finished" if self.complete(reason) else "interrupted"
+        self.db[JOBS].update_one(
+            {"_id": self.job_id},
+            {"$set": {"status": status, "finish_reason": reason, "finished_at": datetime.now(timezone.utc)}},
+        )
+        return status
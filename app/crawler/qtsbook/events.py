@@ -0,0 +1,234 @@
+"""Structured crawl events, written to a capped Mongo collection.
+
+`CrawlEventLog` (an extension) turns the crawl into typed, levelled
+events in `crawl_events`, which the dashboard reads and filters; nothing
+has to be scraped off the crawler's stdout. Each event is
+
+    {ts, run, spider, type, level, severity, msg, data}
+
+with `run` shared by every event of one crawl. Types:
+
+- `crawl.started`, `crawl.progress` (every CRAWL_EVENTS_INTERVAL_SECS),
+  `crawl.finished` (finish reason and the headline stats),
+- `item.scraped`, `item.dropped`, `item.error`,
+- `http.error` (responses with status >= 400), `spider.error`,
+- `log`: WARNING and above from any logger while the crawl runs.
+
+CRAWL_EVENTS_SAMPLE keeps a fraction of an event type, e.g.
+"item.scraped=0.01" writes one scraped item in a hundred; every event is
+still counted, and the counts go out with the progress and finish events.
+Events below CRAWL_EVENTS_LEVEL are not written. The collection is capped
+at CRAWL_EVENTS_MAX_MB, so old runs age out on their own; writes are
+buffered and flushed once a second.
+"""
+
+import logging
+import threading
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, MongoClient
+from pymongo.errors import CollectionInvalid
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from qtsbook.pipelines import new_run_id
+
+EVENTS = "crawl_events"
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+FLUSH_SECS = 1.0
+MAX_TRACEBACK = 4000
+
+def parse_sample(spec: str | dict | None) -> dict[str, float]:
+    """"item.scraped=0.01,http.error=0.5" -> {"item.scraped": 0.01, "http.error": 0.5}."""
+    if isinstance(spec, dict):
+        return {k: float(v) for k, v in spec.items()}
+    rates = {}
+    for part in (spec or "").split(","):
+        name, _, rate = part.partition("=")
+        if name.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+def ensure_events(db, max_bytes: int):
+    if EVENTS not in db.list_collection_names():
+        try:
+            db.create_collection(EVENTS, capped=True, size=max_bytes)
+        except CollectionInvalid:
+            pass  # another worker created it first
+    db[EVENTS].create_index([("run", ASCENDING), ("ts", ASCENDING)])
+
+class _LogForwarder(logging.Handler):
+    def __init__(self, events: "CrawlEventLog"):
+        super().__init__(logging.WARNING)
+        self.events = events
+
+    def emit(self, record):
+        # the event log's own writes go through pymongo; the scraper's errors and
+        # drops already arrive as item.* / spider.error events
+        if record.name.startswith(("pymongo", __name__, "scrapy.core.scraper")):
+            return
+        try:
+            level = "error" if record.levelno >= logging.ERROR else "warning"
+            self.events.emit("log", level, record.getMessage(), logger=record.name)
+        except Exception:
+            self.handleError(record)
+
+class CrawlEventLog:
+    def __init__(self, crawler):
+        s = crawler.settings
+        if not s.getbool("CRAWL_EVENTS_ENABLED", True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.settings = s
+        self.stats = crawler.stats
+        self.sample = parse_sample(s.get("CRAWL_EVENTS_SAMPLE"))
+        self.min_severity = LEVELS.get(str(s.get("CRAWL_EVENTS_LEVEL", "info")).lower(), 20)
+        self.interval = s.getfloat("CRAWL_EVENTS_INTERVAL_SECS", 30.0)
+        self.max_bytes = s.getint("CRAWL_EVENTS_MAX_MB", 16) * 1024 * 1024
+
+        self.run = None
+        self.spider_name = None
+        self.counts = Counter()  # every event, written or sampled out
+        self.written = 0
+        self._buffer = deque()  # appended to from pool threads by the log forwarder
+        self._lock = threading.Lock()
+        self._handler = None
+        self._flush_loop = None
+        self._progress_loop = None
+        self.client = None
+        self.coll = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(ext.item_error, signal=signals.item_error)
+        crawler.signals.connect(ext.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    # --- emitting ----------------------------------------------------------
+
+    def emit(self, type: str, level: str = "info", msg: str = "", **data):
+        """Record one event, subject to the level threshold and the type's sample rate."""
+        severity = LEVELS[level]
+        with self._lock:
+            self.counts[type] += 1
+            n = self.counts[type]
+        if severity < self.min_severity or not self._sampled(type, n):
+            return
+        self._buffer.append({
+            "ts": datetime.now(timezone.utc),
+            "run": self.run,
+            "spider": self.spider_name,
+            "type": type,
+            "level": level,
+            "severity": severity,
+            "msg": msg,
+            "data": data,
+        })
+
+    def _sampled(self, type: str, n: int) -> bool:
+        rate = self.sample.get(type, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        # every k-th event, so a sampled stream still shows the crawl evenly
+        return (n - 1) % round(1 / rate) == 0
+
+    def flush(self):
+        batch = []
+        while self._buffer:
+            batch.append(self._buffer.popleft())
+        if not batch or self.coll is None:
+            return
+        try:
+            self.coll.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except Exception as e:  # lost events must not fail the crawl
+            logging.getLogger(__name__).debug("Could not write %d crawl events: %s", len(batch), e)
+
+    # --- signals -----------------------------------------------------------
+
+    def item_scraped(self, item, response, spider):
+        self.emit("item.scraped", "debug" if item.get("not_modified") else "info", item.get("url") or "",
+                  url=item.get("url"), category=item.get("category"), not_modified=bool(item.get("not_modified")))
+
+    def item_dropped(self, item, response, exception, spider):
+        self.emit("item.dropped", "warning", f"{item.get('url')}: {exception}",
+                  url=item.get("url"), reason=str(exception))
+
+    def item_error(self, item, response, spider, failure):
+        self.emit("item.error", "error", f"{item.get('url')}: {failure.getErrorMessage()}",
+                  url=item.get("url"), error=failure.type.__name__,
+                  traceback=failure.getTraceback()[-MAX_TRACEBACK:])
+
+    def spider_error(self, failure, response, spider):
+        self.emit("spider.error", "error", f"{response.url}: {failure.getErrorMessage()}",
+                  url=response.url, error=failure.type.__name__,
+                  traceback=failure.getTraceback()[-MAX_TRACEBACK:])
+
+    def response_received(self, response, request, spider):
+        if response.status >= 400:
+            self.emit("http.error", "warning", f"HTTP {response.status} {response.url}",
+                      url=response.url, status=response.status, page_type=request.meta.get("page_type"))
+
+    def _progress(self):
+        st = self.stats
+        self.emit(
+            "crawl.progress", "info",
+            f"{st.get_value('response_received_count', 0)} pages, {st.get_value('item_scraped_count', 0)} items",
+            pages=st.get_value("response_received_count", 0), items=st.get_value("item_scraped_count", 0),
+            dropped=st.get_value("item_dropped_count", 0), errors=st.get_value("log_count/ERROR", 0),
+            counts=dict(self.counts),
+        )
+
+    # --- run lifecycle -----------------------------------------------------
+
+    def spider_opened(self, spider):
+        s = self.settings
+        # a sharded worker's events are its run's, one stream per worker
+        run_id = getattr(spider, "run_id", None)
+        self.run = f"{run_id}/{spider.worker}" if run_id else new_run_id()
+        self.spider_name = spider.name
+        self.client = MongoClient(s.get("MONGODB_URI"))
+        db = self.client[s.get("MONGODB_DB")]
+        try:
+            ensure_events(db, self.max_bytes)
+            self.coll = db[EVENTS]
+        except Exception as e:
+            spider.logger.warning("Crawl events disabled, %s unavailable: %s", EVENTS, e)
+        self._handler = _LogForwarder(self)
+        logging.getLogger().addHandler(self._handler)
+        self._flush_loop = task.LoopingCall(self.flush)
+        self._flush_loop.start(FLUSH_SECS, now=False)
+        if self.interval > 0:
+            self._progress_loop = task.LoopingCall(self._progress)
+            self._progress_loop.start(self.interval, now=False)
+        self.emit("crawl.started", "info", f"{spider.name} started", mode=getattr(spider, "mode", None))
+        spider.logger.info("Crawl events: run %s", self.run)
+
+    def spider_closed(self, spider, reason):
+        for loop in (self._progress_loop, self._flush_loop):
+            if loop and loop.running:
+                loop.stop()
+        if self._handler:
+            logging.getLogger().removeHandler(self._handler)
+        st = self.stats
+        self.emit(
+            "crawl.finished", "info" if reason == "finished" else "warning", f"{spider.name} {reason}",
+            reason=reason, pages=st.get_value("response_received_count", 0),
+            items=st.get_value("item_scraped_count", 0), dropped=st.get_value("item_dropped_count", 0),
+            errors=st.get_value("log_count/ERROR", 0), counts=dict(self.counts),
+        )
+        self.flush()
+        self.stats.set_value("events/written", self.written)
+        self.stats.set_value("events/seen", sum(self.counts.values()))
+        if self.client:
+            self.client.close()
@@ -0,0 +1,358 @@
+"""Crawl profiling: per-stage latency histograms, persisted per run.
+
+`CrawlProfiler` (an extension) records, for every run:
+
+- download latency (`download_latency` of responses that hit the network),
+- callback parse time (measured by `ParseTimingMiddleware`, the spider
+  middleware closest to the spider, around each step of the callback),
+- pipeline time (from the callback yielding an item until it is scraped,
+  dropped or fails),
+- time per Mongo command, per command name (a pymongo CommandListener),
+- response sizes and items/pages per second, overall and per interval.
+
+At close the profile is logged, summarised into `profile/*` stats and
+written to `crawl_runs` (kind "crawl"); scheduler/crawl_profile.py compares
+runs and flags regressions.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+
+from itemadapter import is_item
+from pymongo import MongoClient, monitoring
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+RUNS = "crawl_runs"
+
+MS_BOUNDS = [0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+BYTE_BOUNDS = [2 ** i for i in range(10, 24)]  # 1 KiB .. 8 MiB
+
+class Histogram:
+    """Fixed-bucket histogram; `bounds` are bucket upper bounds, the last bucket is open."""
+
+    def __init__(self, bounds=MS_BOUNDS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, v: float):
+        self.counts[bisect_left(self.bounds, v)] += 1
+        self.n += 1
+        self.total += v
+        self.min = v if self.min is None or v < self.min else self.min
+        self.max = v if self.max is None or v > self.max else self.max
+
+    def quantile(self, q: float) -> float | None:
+        if not self.n:
+            return None
+        rank, seen = q * self.n, 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                # linear within the bucket, clamped to what was observed
+                lo = max(self.bounds[i - 1] if i else 0.0, self.min)
+                hi = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.max
+
+    def merge(self, other: "Histogram"):
+        if other.bounds != self.bounds:
+            raise ValueError("Cannot merge histograms with different buckets")
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.n += other.n
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None or v < self.min else self.min
+                self.max = v if self.max is None or v > self.max else self.max
+
+    def to_doc(self) -> dict:
+        r = lambda v: round(v, 3) if v is not None else None  # noqa: E731
+        return {
+            "n": self.n,
+            "sum": r(self.total),
+            "mean": r(self.total / self.n) if self.n else None,
+            "min": r(self.min),
+            "max": r(self.max),
+            "p50": r(self.quantile(0.5)),
+            "p90": r(self.quantile(0.9)),
+            "p99": r(self.quantile(0.99)),
+            "bounds": self.bounds,
+            "counts": self.counts,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Histogram":
+        h = cls(doc["bounds"])
+        h.counts = list(doc["counts"])
+        h.n, h.total, h.min, h.max = doc["n"], doc["sum"] or 0.0, doc["min"], doc["max"]
+        return h
+
+def merge_profiles(docs: list[dict]) -> dict:
+    """Merge the histograms of several `crawl_runs` profiles (e.g. the workers of a sharded run)."""
+    stages: dict[str, Histogram] = {}
+    mongo: dict[str, Histogram] = {}
+    for doc in docs:
+        for target, hists in ((stages, doc.get("histograms", {})), (mongo, doc.get("mongo", {}))):
+            for name, h in hists.items():
+                if name in target:
+                    target[name].merge(Histogram.from_doc(h))
+                else:
+                    target[name] = Histogram.from_doc(h)
+    return {
+        "histograms": {k: h.to_doc() for k, h in stages.items()},
+        "mongo": {k: h.to_doc() for k, h in mongo.items()},
+    }
+
+class _MongoTimer(monitoring.CommandListener):
+    """Process-wide listener; reports to whichever profiler is currently attached."""
+
+    SKIP = {"hello", "ismaster", "isMaster", "ping", "endSessions"}
+
+    def __init__(self):
+        self.profiler = None
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        p = self.profiler
+        if p is not None and event.command_name not in self.SKIP:
+            p.mongo_op(event.command_name, event.duration_micros / 1000)
+
+    def failed(self, event):
+        p = self.profiler
+        if p is not None and event.command_name not in self.SKIP:
+            p.mongo_op(event.command_name, event.duration_micros / 1000, failed=True)
+
+_MONGO_TIMER = None
+
+def _mongo_timer() -> _MongoTimer:
+    # listeners cannot be unregistered, so one is registered per process and
+    # only clients created after this call report to it
+    global _MONGO_TIMER
+    if _MONGO_TIMER is None:
+        _MONGO_TIMER = _MongoTimer()
+        monitoring.register(_MONGO_TIMER)
+    return _MONGO_TIMER
+
+class CrawlProfiler:
+    def __init__(self, crawler):
+        s = crawler.settings
+        if not s.getbool("PROFILE_ENABLED", True):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.interval = s.getfloat("PROFILE_INTERVAL_SECS", 10.0)
+
+        self.download = Histogram()
+        self.parse = Histogram()
+        self.pipeline = Histogram()
+        self.sizes = Histogram(BYTE_BOUNDS)
+        self.mongo: dict[str, Histogram] = {}
+        self.mongo_failed = 0
+        self._mongo_lock = threading.Lock()
+
+        self.items = 0
+        self.responses = 0
+        self.cached = 0
+        self.timeline: list[dict] = []
+        self._in_pipeline: dict[int, float] = {}
+        self._last = (0.0, 0, 0)
+        self._tick = None
+        self.started_at = None
+        self._t0 = None
+
+        self._timer = _mongo_timer()
+        self._timer.profiler = self
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(ext.item_done, signal=signals.item_error)
+        return ext
+
+    # --- recording ---------------------------------------------------------
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        self.sizes.add(len(response.body))
+        if "cached" in response.flags:
+            self.cached += 1
+            return
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.download.add(latency * 1000)
+
+    def parse_done(self, seconds: float):
+        self.parse.add(seconds * 1000)
+
+    def item_started(self, item):
+        self._in_pipeline[id(item)] = time.perf_counter()
+
+    def item_done(self, item, **kwargs):
+        t0 = self._in_pipeline.pop(id(item), None)
+        if t0 is not None:
+            self.pipeline.add((time.perf_counter() - t0) * 1000)
+        self.items += 1
+
+    def mongo_op(self, name: str, ms: float, failed: bool = False):
+        # pymongo reports from whatever thread ran the command
+        with self._mongo_lock:
+            h = self.mongo.get(name)
+            if h is None:
+                h = self.mongo[name] = Histogram()
+            h.add(ms)
+            if failed:
+                self.mongo_failed += 1
+
+    def _sample(self):
+        now = time.perf_counter() - self._t0
+        t, items, responses = self._last
+        dt = now - t
+        if dt > 0:
+            self.timeline.append({
+                "t": round(now, 1),
+                "items_per_sec": round((self.items - items) / dt, 2),
+                "pages_per_sec": round((self.responses - responses) / dt, 2),
+            })
+        self._last = (now, self.items, self.responses)
+
+    # --- run lifecycle -----------------------------------------------------
+
+    def spider_opened(self, spider):
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        if self.interval > 0:
+            self._tick = task.LoopingCall(self._sample)
+            self._tick.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self._tick and self._tick.running:
+            self._tick.stop()
+        if self._timer.profiler is self:
+            self._timer.profiler = None
+        elapsed = time.perf_counter() - self._t0 if self._t0 else 0.0
+
+        stages = {"download_ms": self.download, "parse_ms": self.parse, "pipeline_ms": self.pipeline}
+        mongo_ms = sum(h.total for h in self.mongo.values())
+        for name, h in stages.items():
+            for q in ("p50", "p90", "p99"):
+                v = h.quantile(float(f"0.{q[1:]}"))
+                if v is not None:
+                    self.stats.set_value(f"profile/{name[:-3]}_{q}_ms", round(v, 2))
+        self.stats.set_value("profile/mongo_ms", round(mongo_ms, 1))
+        self.stats.set_value("profile/items_per_sec", round(self.items / elapsed, 2) if elapsed else 0.0)
+
+        spider.logger.info(
+            "Profile: %d items in %.1fs (%.1f/s); p50/p90/p99 ms: download %s, parse %s, pipeline %s; "
+            "mongo %.0f ms over %d commands",
+            self.items, elapsed, self.items / elapsed if elapsed else 0.0,
+            self._fmt(self.download), self._fmt(self.parse), self._fmt(self.pipeline),
+            mongo_ms, sum(h.n for h in self.mongo.values()),
+        )
+
+        s = self.crawler.settings
+        doc = {
+            "kind": "crawl",
+            "spider": spider.name,
+            "mode": getattr(spider, "mode", None),
+            "run_id": getattr(spider, "run_id", None),
+            "worker": getattr(spider, "worker", None),
+            "started_at": self.started_at,
+            "finished_at": datetime.now(timezone.utc),
+            "elapsed_secs": round(elapsed, 3),
+            "finish_reason": reason,
+            "items": self.items,
+            "responses": self.responses,
+            "cached_responses": self.cached,
+            "items_per_sec": round(self.items / elapsed, 3) if elapsed else 0.0,
+            "pages_per_sec": round(self.responses / elapsed, 3) if elapsed else 0.0,
+            "histograms": {**{k: h.to_doc() for k, h in stages.items()}, "response_bytes": self.sizes.to_doc()},
+            "mongo": {k: h.to_doc() for k, h in self.mongo.items()},
+            "mongo_failed": self.mongo_failed,
+            "timeline": self.timeline,
+            "settings": {k: s.get(k) for k in (
+                "CONCURRENT_REQUESTS", "CONCURRENT_REQUESTS_PER_DOMAIN", "MONGO_BATCH_SIZE",
+                "OFFLOAD_MODE", "DETAIL_EXTRACTOR", "HTTPCACHE_ENABLED",
+            )},
+        }
+        client = MongoClient(s.get("MONGODB_URI"))
+        try:
+            client[s.get("MONGODB_DB")][RUNS].insert_one(doc)
+        except Exception as e:  # a lost profile must not fail the crawl
+            spider.logger.warning("Could not store crawl profile: %s", e)
+        finally:
+            client.close()
+
+    @staticmethod
+    def _fmt(h: Histogram) -> str:
+        if not h.n:
+            return "-"
+        return "/".join(f"{h.quantile(q):.1f}" for q in (0.5, 0.9, 0.99))
+
+class ParseTimingMiddleware:
+    """Spider middleware that times callbacks for CrawlProfiler.
+
+    Must be the middleware closest to the spider (highest order), so that
+    the time spent in `next()` is the callback's own. Items it passes on are
+    handed to the profiler to start their pipeline clock.
+    """
+
+    def __init__(self, profiler: CrawlProfiler):
+        self.profiler = profiler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        profiler = next((e for e in crawler.extensions.middlewares if isinstance(e, CrawlProfiler)), None)
+        if profiler is None:
+            raise NotConfigured
+        return cls(profiler)
+
+    def process_spider_output(self, response, result, spider):
+        elapsed = 0.0
+        it = iter(result)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    out = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - t0
+                if is_item(out):
+                    self.profiler.item_started(out)
+                yield out
+        finally:
+            self.profiler.parse_done(elapsed)
+
+    async def process_spider_output_async(self, response, result, spider):
+        elapsed = 0.0
+        it = result.__aiter__()
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    out = await it.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - t0
+                if is_item(out):
+                    self.profiler.item_started(out)
+                yield out
+        finally:
+            self.profiler.parse_done(elapsed)
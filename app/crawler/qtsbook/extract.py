@@ -0,0 +1,174 @@
+"""Detail-page field extraction for BooksSpider.
+
+Three extractors produce the same field dict from a book page:
+
+- `extract_detail_xpath`: the original extractor, one `normalize-space()`
+  XPath over the whole document per product-table label (kept as the
+  benchmark baseline).
+- `extract_detail`: walks the product-information table once into a dict
+  on the lxml tree parsel has already built; other fields stay CSS.
+- `extract_detail_lxml`: the same, on a bare lxml tree with direct element
+  traversal and no parsel selectors (DETAIL_EXTRACTOR = "lxml").
+
+benchmarks/bench_extract.py checks that all three agree on the corpus.
+"""
+
+import re
+from urllib.parse import urljoin
+
+import lxml.etree
+import lxml.html
+
+RATINGS = {"zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+RATING_RE = re.compile(r"star-rating\s+(\w+)")
+
+def parse_rating(rating_class: str) -> int:
+    m = RATING_RE.search(rating_class or "")  # e.g., "star-rating Three"
+    return RATINGS.get((m.group(1) if m else "Zero").lower(), 0)
+
+def _num_reviews(s: str | None) -> int:
+    s = s or "0"
+    return int(s) if s.isdigit() else 0
+
+def _fields(url, name, description, category, image_src, rating, availability, table) -> dict:
+    return {
+        "url": url,
+        "name": name,
+        "description": (description or "").strip(),
+        "category": category,
+        "image_url": urljoin(url, image_src or ""),
+        "rating": rating,
+        "availability": availability,
+        "price_excl_tax": table.get("Price (excl. tax)"),
+        "price_incl_tax": table.get("Price (incl. tax)"),
+        "tax": table.get("Tax"),
+        "num_reviews": _num_reviews(table.get("Number of reviews")),
+    }
+
+def _has_class(el, cls: str) -> bool:
+    return cls in (el.get("class") or "").split()
+
+def _first_text(el) -> str | None:
+    """First direct text node of `el` (what `el::text` + .get() returns)."""
+    if el.text is not None:
+        return el.text
+    for child in el:
+        if child.tail is not None:
+            return child.tail
+    return None
+
+def _normalize_space(s: str) -> str:
+    return " ".join(s.split())
+
+def _td_after(th) -> str | None:
+    for sib in th.itersiblings():
+        if sib.tag == "td":
+            t = _first_text(sib)
+            if t is not None:
+                return t
+    return None
+
+def _table_row(tr, table: dict):
+    # first row wins, like the document-wide XPath lookup did
+    th = next((c for c in tr if c.tag == "th"), None)
+    if th is not None:
+        label = _normalize_space(th.text_content())
+        if label not in table:
+            table[label] = _td_after(th)
+
+def _product_table(root) -> dict:
+    """label -> first td text for every `<tr>` with a `<th>`."""
+    table = {}
+    for tr in root.iter("tr"):
+        _table_row(tr, table)
+    return table
+
+def extract_detail_xpath(response, category) -> dict:
+    def td(label):
+        xpath = f'//th[normalize-space()="{label}"]/following-sibling::td/text()'
+        return response.xpath(xpath).get()
+
+    table = {label: td(label) for label in ("Price (excl. tax)", "Price (incl. tax)", "Tax", "Number of reviews")}
+    return _fields(
+        response.url,
+        response.css("div.product_main h1::text").get(),
+        response.css("#product_description ~ p::text").get(),
+        category,
+        response.css("#product_gallery img::attr(src)").get(""),
+        parse_rating(response.css("p.star-rating::attr(class)").get("")),
+        " ".join(t.strip() for t in response.css("div.product_main p.availability ::text").getall()).strip(),
+        table,
+    )
+
+def extract_detail(response, category) -> dict:
+    return _fields(
+        response.url,
+        response.css("div.product_main h1::text").get(),
+        response.css("#product_description ~ p::text").get(),
+        category,
+        response.css("#product_gallery img::attr(src)").get(""),
+        parse_rating(response.css("p.star-rating::attr(class)").get("")),
+        " ".join(t.strip() for t in response.css("div.product_main p.availability ::text").getall()).strip(),
+        _product_table(response.selector.root),
+    )
+
+# --- lxml fast path: one walk over a bare tree, no selectors ---------------
+
+_PARSERS: dict[str, lxml.html.HTMLParser] = {}
+
+def _parser(encoding: str) -> lxml.html.HTMLParser:
+    parser = _PARSERS.get(encoding)
+    if parser is None:
+        parser = _PARSERS[encoding] = lxml.html.HTMLParser(recover=True, encoding=encoding)
+    return parser
+
+def extract_detail_lxml(response, category) -> dict:
+    # parse the body bytes directly; parsel would decode to str and re-parse
+    root = lxml.html.fromstring(response.body, parser=_parser(response.encoding))
+
+    name = None
+    rating_class = None
+    availability_parts = []
+    table = {}
+    description = None
+    image_src = ""
+
+    for el in root.iter(lxml.etree.Element):
+        tag = el.tag
+        if tag == "div" and _has_class(el, "product_main"):
+            for sub in el.iter("h1", "p"):
+                if sub.tag == "h1" and name is None:
+                    name = _first_text(sub)
+                elif sub.tag == "p" and _has_class(sub, "availability"):
+                    availability_parts.extend(sub.itertext())
+        elif tag == "p" and rating_class is None and _has_class(el, "star-rating"):
+            rating_class = el.get("class")
+        elif tag == "tr":
+            _table_row(el, table)
+        elif tag == "img" and not image_src:
+            gallery = next((a for a in el.iterancestors() if a.get("id") == "product_gallery"), None)
+            if gallery is not None:
+                image_src = el.get("src") or ""
+        elif description is None and el.get("id") == "product_description":
+            for sib in el.itersiblings():
+                if sib.tag == "p":
+                    description = _first_text(sib)
+                    if description is not None:
+                        break
+
+    return _fields(
+        response.url,
+        name,
+        description,
+        category,
+        image_src,
+        parse_rating(rating_class or ""),
+        " ".join(t.strip() for t in availability_parts).strip(),
+        table,
+    )
+
+EXTRACTORS = {
+    "xpath": extract_detail_xpath,
+    "parsel": extract_detail,
+    "lxml": extract_detail_lxml,
+}
@@ -0,0 +1,101 @@
+"""Shared crawl frontier for sharded crawls.
+
+Category URLs of one run live in the `frontier` collection, one doc per
+(run_id, url). Workers lease a few categories at a time, extend their
+leases with a heartbeat while crawling them and ack them once their spider
+goes idle. A worker that dies stops heartbeating; its leases expire and
+are handed to whichever worker asks next. A category whose lease expired
+FRONTIER_MAX_ATTEMPTS times is marked `failed` instead of retried forever.
+
+    pending -> leased -> done
+                  \\-> (lease expired) -> leased by another worker | failed
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+
+FRONTIER = "frontier"
+
+class Frontier:
+    def __init__(self, db, run_id: str, worker: str, lease_secs: int = 120, max_attempts: int = 3):
+        self.coll = db[FRONTIER]
+        self.run_id = run_id
+        self.worker = worker
+        self.lease_for = timedelta(seconds=lease_secs)
+        self.max_attempts = max_attempts
+
+    def ensure_indexes(self):
+        self.coll.create_index([("run_id", ASCENDING), ("url", ASCENDING)], unique=True)
+        self.coll.create_index([("run_id", ASCENDING), ("state", ASCENDING), ("lease_until", ASCENDING)])
+
+    def seed(self, categories: list[tuple[str, str | None]]) -> int:
+        """Add (url, name) pairs; categories already in the run are left alone."""
+        if not categories:
+            return 0
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne(
+                {"run_id": self.run_id, "url": url},
+                {"$setOnInsert": {
+                    "run_id": self.run_id, "url": url, "name": name,
+                    "state": "pending", "attempts": 0, "created_at": now,
+                }},
+                upsert=True,
+            )
+            for url, name in categories
+        ]
+        return self.coll.bulk_write(ops, ordered=False).upserted_count
+
+    def _expire(self, now: datetime):
+        # leases that ran out on their last attempt are given up on
+        self.coll.update_many(
+            {"run_id": self.run_id, "state": "leased", "lease_until": {"$lt": now},
+             "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"state": "failed", "failed_at": now}},
+        )
+
+    def lease(self) -> dict | None:
+        now = datetime.now(timezone.utc)
+        self._expire(now)
+        return self.coll.find_one_and_update(
+            {"run_id": self.run_id, "$or": [
+                {"state": "pending"},
+                {"state": "leased", "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {"state": "leased", "owner": self.worker, "leased_at": now, "lease_until": now + self.lease_for},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self) -> int:
+        now = datetime.now(timezone.utc)
+        res = self.coll.update_many(
+            {"run_id": self.run_id, "owner": self.worker, "state": "leased"},
+            {"$set": {"lease_until": now + self.lease_for}},
+        )
+        return res.modified_count
+
+    def ack(self, urls: list[str]) -> int:
+        """Mark categories done; a lease that was lost to another worker is not acked."""
+        if not urls:
+            return 0
+        res = self.coll.update_many(
+            {"run_id": self.run_id, "url": {"$in": urls}, "owner": self.worker, "state": "leased"},
+            {"$set": {"state": "done", "done_at": datetime.now(timezone.utc)}},
+        )
+        return res.modified_count
+
+    def open_count(self) -> int:
+        self._expire(datetime.now(timezone.utc))
+        return self.coll.count_documents({"run_id": self.run_id, "state": {"$in": ["pending", "leased"]}})
+
+    def counts(self) -> dict:
+        rows = self.coll.aggregate([
+            {"$match": {"run_id": self.run_id}},
+            {"$group": {"_id": "$state", "n": {"$sum": 1}}},
+        ])
+        return {r["_id"]: r["n"] for r in rows}
@@ -0,0 +1,71 @@
+"""Canonical book hashes.
+
+Every hashed field gets its own short blake2b digest over a canonical
+encoding (`field`, separator, JSON value), so "ab"+"c" and "a"+"bc" no
+longer collide and 4 is not "4". The digests are stored as the book's
+`field_hashes`; `content_hash` is the blake2b of the digest vector in
+HASHED_FIELDS order, tagged with HASH_PREFIX so hashes from the old SHA1
+scheme are recognisable.
+
+The pipeline fetches only `field_hashes` of the previous doc and compares
+digests to learn exactly which fields changed; it then loads just those
+fields' values for the `changes` entry.
+"""
+
+import hashlib
+import json
+
+HASH_PREFIX = "b2:"
+FIELD_DIGEST_SIZE = 8
+CONTENT_DIGEST_SIZE = 16
+
+HASHED_FIELDS = (
+    "name",
+    "description",
+    "category",
+    "price_incl_tax",
+    "availability",
+    "rating",
+    "num_reviews",
+)
+# stored alongside a hashed field and reported with it when it changes
+DERIVED_FIELDS = {"price_incl_tax": ("price_incl_tax_num",)}
+
+# what the diff needs from the previous doc before it knows what changed
+DIGEST_PROJECTION = {"url": 1, "content_hash": 1, "field_hashes": 1, "_id": 0}
+
+def _canonical(field: str, value) -> bytes:
+    return f"{field}\x1f{json.dumps(value, ensure_ascii=False, separators=(',', ':'), sort_keys=True)}".encode("utf-8")
+
+def field_digest(field: str, value) -> str:
+    return hashlib.blake2b(_canonical(field, value), digest_size=FIELD_DIGEST_SIZE).hexdigest()
+
+def item_hashes(item) -> tuple[str, dict]:
+    """Returns (content_hash, field_hashes) for a book item or doc."""
+    field_hashes = {f: field_digest(f, item.get(f)) for f in HASHED_FIELDS}
+    vector = bytes.fromhex("".join(field_hashes[f] for f in HASHED_FIELDS))
+    return HASH_PREFIX + hashlib.blake2b(vector, digest_size=CONTENT_DIGEST_SIZE).hexdigest(), field_hashes
+
+def is_current(doc) -> bool:
+    """True if `doc` was hashed with this scheme and carries its digest vector."""
+    hashes = doc.get("field_hashes")
+    return (
+        str(doc.get("content_hash") or "").startswith(HASH_PREFIX)
+        and isinstance(hashes, dict)
+        and all(f in hashes for f in HASHED_FIELDS)
+    )
+
+def changed_fields(prev_hashes: dict, cur_hashes: dict) -> list[str]:
+    """Fields to report for two digest vectors, derived fields included."""
+    out = []
+    for f in HASHED_FIELDS:
+        if prev_hashes.get(f) != cur_hashes.get(f):
+            out.append(f)
+            out.extend(DERIVED_FIELDS.get(f, ()))
+    return out
+
+def diff_fields(prev, item) -> list[str] | None:
+    """Changed fields by digest, or None when either side predates `field_hashes`."""
+    if prev and is_current(prev) and item.get("field_hashes"):
+        return changed_fields(prev["field_hashes"], item["field_hashes"])
+    return None
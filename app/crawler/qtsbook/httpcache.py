@@ -0,0 +1,37 @@
+"""HTTP cache storage with per-page-type expiry.
+
+Requests carry `meta["page_type"]` ("listing" or "detail"); entries older
+than HTTPCACHE_TTL_LISTING / HTTPCACHE_TTL_DETAIL are treated as missing, so
+the request goes to the network (with validators added by
+ConditionalRequestMiddleware). Other requests fall back to
+HTTPCACHE_EXPIRATION_SECS. Enable HTTPCACHE_GZIP to keep entries compressed.
+"""
+
+import pickle
+from pathlib import Path
+from time import time
+
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+
+
+class TTLCacheStorage(FilesystemCacheStorage):
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttls = {
+            "listing": settings.getint("HTTPCACHE_TTL_LISTING", 0),
+            "detail": settings.getint("HTTPCACHE_TTL_DETAIL", 0),
+        }
+
+    def _ttl(self, request) -> int:
+        return self.ttls.get(request.meta.get("page_type"), self.expiration_secs)
+
+    def _read_meta(self, spider, request):
+        rpath = Path(self._get_request_path(spider, request))
+        metapath = rpath / "pickled_meta"
+        if not metapath.exists():
+            return None  # not found
+        ttl = self._ttl(request)
+        if 0 < ttl < time() - metapath.stat().st_mtime:
+            return None  # expired
+        with self._open(metapath, "rb") as f:
+            return pickle.load(f)  # noqa: S301
@@ -0,0 +1,258 @@
+"""Cover images: downloaded alongside the crawl, stored once per content.
+
+`CoverImagesPipeline` runs ahead of the Mongo pipeline. It fetches each
+item's `image_url` through the crawler's own downloader, so covers come
+down concurrently with the pages (same slots, throttling and retries),
+and sets `image_digest` on the item. Images are kept in `images` under the
+SHA-256 of their bytes, so a cover shared by many books, or served under
+several URLs, is stored once. Each stored image gets a fixed-size JPEG
+thumbnail (IMAGES_THUMB_SIZE), made in a thread pool. The pool threads
+only thumbnail and insert; stats and the set of stored digests are updated
+back on the reactor thread.
+
+`image_sources` maps every image URL to its digest and validators. Within
+a run a URL is fetched at most once; across runs a URL checked less than
+IMAGES_REVALIDATE_HOURS ago is not requested at all, and an older one is
+revalidated with If-None-Match / If-Modified-Since, a 304 keeping the
+stored digest. Books whose cover URL now points at a different image (or
+that have no digest yet) are re-pointed when the spider closes.
+"""
+
+import asyncio
+import hashlib
+import io
+from datetime import datetime, timedelta, timezone
+
+import scrapy
+from bson import Binary
+from pymongo import MongoClient, UpdateMany, UpdateOne
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+from PIL import Image, ImageOps
+
+from qtsbook.pipelines import bump_epoch
+
+IMAGES = "images"
+SOURCES = "image_sources"
+
+def image_digest(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+def parse_size(value: str) -> tuple[int, int]:
+    """"150x225" -> (150, 225)."""
+    w, _, h = str(value).lower().partition("x")
+    return int(w), int(h or w)
+
+def make_thumbnail(body: bytes, size: tuple[int, int], quality: int = 85) -> dict:
+    """{width, height} of the image plus its `thumb`: a JPEG cropped and scaled to exactly `size`."""
+    with Image.open(io.BytesIO(body)) as img:
+        width, height = img.size
+        img.draft("RGB", (size[0] * 2, size[1] * 2))  # JPEGs decode at a reduced scale
+        thumb = ImageOps.fit(img.convert("RGB"), size, Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    thumb.save(out, "JPEG", quality=quality, optimize=True)
+    return {
+        "width": width,
+        "height": height,
+        "thumb": {"data": Binary(out.getvalue()), "content_type": "image/jpeg", "width": size[0], "height": size[1]},
+    }
+
+def _aware(dt):
+    return dt if dt is None or dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+class CoverImagesPipeline:
+    def __init__(self, crawler):
+        s = crawler.settings
+        self.crawler = crawler
+        self.settings = s
+        self.stats = crawler.stats
+        self.thumb_size = parse_size(s.get("IMAGES_THUMB_SIZE", "150x225"))
+        self.workers = max(1, s.getint("IMAGES_WORKERS", 2))
+        self.revalidate = timedelta(hours=s.getfloat("IMAGES_REVALIDATE_HOURS", 24))
+        self.max_bytes = s.getint("IMAGES_MAX_BYTES", 5 * 1024 * 1024)
+
+        self.client = None
+        self.db = None
+        self._pool = None
+        self.sources: dict[str, dict] = {}  # url -> {digest, etag, last_modified, checked_at}
+        self.stored: set[str] = set()  # digests already in `images`
+        self.uncovered: dict[str, str] = {}  # book url -> cover url, for books without a digest yet
+        self.missing: set[str] = set()  # their cover URLs
+        self._fetches: dict[str, asyncio.Future] = {}  # url -> digest, one download per URL per run
+        self._stores: dict[str, asyncio.Future] = {}  # digest -> its insert, one per image per run
+        self._dirty: dict[str, dict] = {}
+        self._relink: dict[str, str] = {}  # url -> digest to set on the books showing it
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("IMAGES_ENABLED", True):
+            raise NotConfigured
+        return cls(crawler)
+
+    def open_spider(self, spider):
+        s = self.settings
+        self.client = MongoClient(s.get("MONGODB_URI"))
+        self.db = self.client[s.get("MONGODB_DB")]
+        self.db["books"].create_index("image_url")
+        self.sources = {d.pop("_id"): d for d in self.db[SOURCES].find()}
+        self.stored = {d["_id"] for d in self.db[IMAGES].find({}, {"_id": 1})}
+        self.uncovered = {
+            d["url"]: d["image_url"]
+            for d in self.db["books"].find(
+                {"image_digest": {"$exists": False}, "image_url": {"$nin": [None, ""]}},
+                {"url": 1, "image_url": 1, "_id": 0},
+            )
+        }
+        self.missing = set(self.uncovered.values())
+        self._pool = ThreadPool(minthreads=1, maxthreads=self.workers, name="qts-images")
+        self._pool.start()
+        spider.logger.info(
+            "Cover images: %d known URLs, %d stored images, %d books without one; thumbnails %dx%d",
+            len(self.sources), len(self.stored), len(self.missing), *self.thumb_size,
+        )
+
+    def close_spider(self, spider):
+        if self._pool:
+            self._pool.stop()
+        now = datetime.now(timezone.utc)
+        ops = [UpdateOne({"_id": url}, {"$set": {**v, "updated_at": now}}, upsert=True) for url, v in self._dirty.items()]
+        if ops:
+            self.db[SOURCES].bulk_write(ops, ordered=False)
+        relink = [
+            UpdateMany({"image_url": url, "image_digest": {"$ne": digest}}, {"$set": {"image_digest": digest}})
+            for url, digest in self._relink.items()
+        ]
+        if relink:
+            r = self.db["books"].bulk_write(relink, ordered=False)
+            self.stats.set_value("images/books_relinked", r.modified_count)
+            if r.modified_count:
+                bump_epoch(self.db)  # after the book pipeline's own bump
+        if self.client:
+            self.client.close()
+        st = self.stats
+        spider.logger.info(
+            "Cover images: %d downloaded (%d new, %d duplicates), %d not modified, %d fresh, %d failed",
+            st.get_value("images/downloaded", 0), st.get_value("images/stored", 0),
+            st.get_value("images/duplicates", 0), st.get_value("images/not_modified", 0),
+            st.get_value("images/fresh", 0), st.get_value("images/failed", 0),
+        )
+
+    async def process_item(self, item, spider):
+        if item.get("not_modified"):
+            # a 304 carries no fields: only a stored book still without a cover needs one,
+            # and it gets it through the relink
+            url = self.uncovered.get(item["url"])
+        else:
+            url = item.get("image_url")
+        if not url:
+            return item
+        fetch = self._fetches.get(url)
+        if fetch is None:
+            fetch = self._fetches[url] = asyncio.ensure_future(self._fetch(url, spider))
+        digest = await fetch
+        if digest and not item.get("not_modified"):
+            item["image_digest"] = digest
+        return item
+
+    async def _fetch(self, url: str, spider) -> str | None:
+        src = self.sources.get(url)
+        prev = src.get("digest") if src else None
+        known = src if src and src.get("digest") in self.stored else None
+        now = datetime.now(timezone.utc)
+        if known and known.get("checked_at") and now - _aware(known["checked_at"]) < self.revalidate:
+            self.stats.inc_value("images/fresh")
+            return self._seen(url, known["digest"], prev)
+
+        headers = {}
+        if known and known.get("etag"):
+            headers["If-None-Match"] = known["etag"]
+        if known and known.get("last_modified"):
+            headers["If-Modified-Since"] = known["last_modified"]
+        request = scrapy.Request(url, headers=headers, meta={
+            "page_type": "image",
+            "dont_cache": True,
+            "download_maxsize": self.max_bytes,
+        })
+        try:
+            response = await maybe_deferred_to_future(self.crawler.engine.download(request))
+        except Exception as e:
+            self.stats.inc_value("images/failed")
+            spider.logger.warning("Cover image %s failed: %s", url, e)
+            return known["digest"] if known else None
+
+        if response.status == 304 and known:
+            self.stats.inc_value("images/not_modified")
+            self._checked(url, known["digest"], known.get("etag"), known.get("last_modified"), now)
+            return self._seen(url, known["digest"], prev)
+        if response.status != 200 or not response.body:
+            self.stats.inc_value("images/failed")
+            spider.logger.warning("Cover image %s: HTTP %d", url, response.status)
+            return known["digest"] if known else None
+
+        body = response.body
+        digest = image_digest(body)
+        self.stats.inc_value("images/downloaded")
+        self.stats.inc_value("images/downloaded_bytes", len(body))
+        store = self._stores.get(digest)
+        if digest in self.stored or store:
+            self.stats.inc_value("images/duplicates")
+        else:
+            ctype = (response.headers.get("Content-Type") or b"application/octet-stream").decode("latin-1")
+            store = self._stores[digest] = asyncio.ensure_future(self._save(digest, body, ctype, spider))
+        if store:
+            try:
+                await store
+            except Exception as e:
+                self.stats.inc_value("images/failed")
+                spider.logger.error("Storing cover image %s failed: %s", url, e)
+                return known["digest"] if known else None
+        self._checked(
+            url, digest,
+            (response.headers.get("ETag") or b"").decode("latin-1") or None,
+            (response.headers.get("Last-Modified") or b"").decode("latin-1") or None,
+            now,
+        )
+        return self._seen(url, digest, prev)
+
+    def _in_pool(self, fn, *args):
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self._pool, fn, *args)
+
+    async def _save(self, digest: str, body: bytes, content_type: str, spider):
+        thumbnailed = await maybe_deferred_to_future(self._in_pool(self._store, digest, body, content_type, spider))
+        # back on the reactor thread: the stats collector and `stored` are not thread-safe
+        self.stored.add(digest)
+        self.stats.inc_value("images/stored")
+        if thumbnailed:
+            self.stats.inc_value("images/thumbnails")
+
+    def _store(self, digest: str, body: bytes, content_type: str, spider) -> bool:
+        """Pool thread: thumbnail the image and insert it (racing inserts of one digest are harmless).
+
+        Returns whether it got a thumbnail; shared state is left to the caller.
+        """
+        doc = {
+            "data": Binary(body),
+            "content_type": content_type,
+            "size": len(body),
+            "created_at": datetime.now(timezone.utc),
+        }
+        thumbnailed = False
+        try:
+            doc.update(make_thumbnail(body, self.thumb_size))
+            thumbnailed = True
+        except Exception as e:  # not something Pillow can read: keep the original only
+            spider.logger.warning("No thumbnail for image %s: %s", digest, e)
+        self.db[IMAGES].update_one({"_id": digest}, {"$setOnInsert": doc}, upsert=True)
+        return thumbnailed
+
+    def _checked(self, url, digest, etag, last_modified, now):
+        v = {"digest": digest, "etag": etag, "last_modified": last_modified, "checked_at": now}
+        self.sources[url] = self._dirty[url] = v
+
+    def _seen(self, url: str, digest: str, prev: str | None) -> str:
+        if digest != prev or url in self.missing:
+            self._relink[url] = digest
+        return digest
@@ -12,6 +12,7 @@ class BookItem(scrapy.Item):
     description = scrapy.Field()
     category = scrapy.Field()
     image_url = scrapy.Field()
+    image_digest = scrapy.Field()  # SHA-256 of the stored cover, see qtsbook/images.py
     rating = scrapy.Field()
     availability = scrapy.Field()
     price_excl_tax = scrapy.Field()
@@ -23,5 +24,8 @@ class BookItem(scrapy.Item):
     crawled_at = scrapy.Field()
     source = scrapy.Field()
     raw_html = scrapy.Field()
-    raw_html_gz = scrapy.Field()
+    raw_html_ref = scrapy.Field()
+    raw_page = scrapy.Field()  # encoded `pages` doc handed over by the offload stage
     content_hash = scrapy.Field()
+    field_hashes = scrapy.Field()  # per-field digests, see qtsbook/hashing.py
+    not_modified = scrapy.Field()  # detail page answered 304: only touch the stored book
@@ -3,7 +3,12 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from datetime import datetime, timezone
+
+from pymongo import MongoClient, UpdateOne
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
@@ -98,3 +103,109 @@ class QtsbookDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ConditionalRequestMiddleware:
+    """Revalidates detail pages with If-None-Match / If-Modified-Since.
+
+    Validators (ETag, Last-Modified) are kept per URL in the
+    `http_validators` collection, so they survive a wiped HTTP cache. Sits
+    after HttpCacheMiddleware (higher order), so it only sees requests the
+    cache could not answer; a 304 reaches the spider as-is and is not cached.
+
+    New validators are written in batches of CONDITIONAL_FLUSH_SIZE and every
+    CONDITIONAL_FLUSH_INTERVAL_SECS, so a killed crawl keeps what it learned.
+    """
+
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+        self.validators: dict[str, dict] = {}
+        self._dirty: dict[str, dict] = {}
+        self.client = None
+        self.coll = None
+        self.flush_size = max(1, settings.getint("CONDITIONAL_FLUSH_SIZE", 500))
+        self._flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CONDITIONAL_REQUESTS_ENABLED", True):
+            raise NotConfigured
+        o = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
+        return o
+
+    def spider_opened(self, spider):
+        self.client = MongoClient(self.settings.get("MONGODB_URI"))
+        self.coll = self.client[self.settings.get("MONGODB_DB")]["http_validators"]
+        self.validators = {d["_id"]: d for d in self.coll.find({}, {"etag": 1, "last_modified": 1})}
+        spider.logger.info("Loaded HTTP validators for %d URLs", len(self.validators))
+        interval = self.settings.getfloat("CONDITIONAL_FLUSH_INTERVAL_SECS", 5)
+        if interval > 0:
+            self._flush_loop = task.LoopingCall(self._flush_tick, spider)
+            self._flush_loop.start(interval, now=False)
+
+    def spider_closed(self, spider):
+        hits = self.stats.get_value("httpcache/hit", 0)
+        misses = self.stats.get_value("httpcache/miss", 0)
+        if hits + misses:
+            self.stats.set_value("httpcache/hit_ratio", round(hits / (hits + misses), 3))
+        if self._flush_loop and self._flush_loop.running:
+            self._flush_loop.stop()
+        try:
+            self.flush()
+        finally:
+            if self.client:
+                self.client.close()
+
+    def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        now = datetime.now(timezone.utc)
+        self.coll.bulk_write([
+            UpdateOne({"_id": url}, {"$set": {**v, "updated_at": now}}, upsert=True)
+            for url, v in dirty.items()
+        ], ordered=False)
+        self.stats.inc_value("conditional/validators_saved", len(dirty))
+
+    def _flush_tick(self, spider):
+        # an exception escaping a LoopingCall stops it, so keep the timer alive
+        try:
+            self.flush()
+        except Exception:
+            spider.logger.exception("Saving HTTP validators failed")
+
+    def process_request(self, request, spider):
+        if request.meta.get("page_type") != "detail":
+            return None
+        v = self.validators.get(request.url)
+        if not v:
+            return None
+        if v.get("etag"):
+            request.headers.setdefault("If-None-Match", v["etag"])
+        if v.get("last_modified"):
+            request.headers.setdefault("If-Modified-Since", v["last_modified"])
+        self.stats.inc_value("conditional/sent")
+        return None
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags or request.meta.get("page_type") != "detail":
+            return response
+        if response.status == 304:
+            self.stats.inc_value("conditional/not_modified")
+            return response
+        if response.status == 200:
+            v = {
+                "etag": (response.headers.get("ETag") or b"").decode("latin-1") or None,
+                "last_modified": (response.headers.get("Last-Modified") or b"").decode("latin-1") or None,
+            }
+            old = self.validators.get(request.url) or {}
+            if (v["etag"] or v["last_modified"]) and (
+                v["etag"] != old.get("etag") or v["last_modified"] != old.get("last_modified")
+            ):
+                self.validators[request.url] = self._dirty[request.url] = v
+                if len(self._dirty) >= self.flush_size:
+                    self._flush_tick(spider)
+        return response
@@ -0,0 +1,168 @@
+"""CPU offload stage: hashes and compresses raw pages off the reactor thread.
+
+`CpuOffloadPipeline` runs ahead of the Mongo pipeline. It pops `raw_html`
+from the item, computes the item hashes and the encoded `pages` doc in a
+thread or process pool, and hands the result on as `raw_page`. Bodies
+waiting for or inside the pool are capped at OFFLOAD_MAX_PENDING_BYTES.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pymongo import MongoClient
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+from qtsbook.hashing import item_hashes
+from qtsbook.rawstore import PageCodec, latest_dictionary, page_digest
+
+# worker-side state: set by configure_worker() in the main process (threads)
+# or as the process pool initializer
+_DICT_DOC = None
+_LEVEL = None
+_local = threading.local()
+
+def configure_worker(dict_doc, level):
+    global _DICT_DOC, _LEVEL
+    _DICT_DOC, _LEVEL = dict_doc, level
+    _local.__dict__.clear()
+
+def _codec() -> PageCodec:
+    # zstd compressors are not thread-safe, so every worker thread gets its own
+    codec = getattr(_local, "codec", None)
+    if codec is None:
+        codec = _local.codec = PageCodec(_DICT_DOC, level=_LEVEL)
+    return codec
+
+def hash_and_encode(fields: dict, raw: bytes | None):
+    """Returns ((content_hash, field_hashes), page doc or None, hash CPU s, compress CPU s)."""
+    t0 = time.thread_time()
+    hashes = item_hashes(fields)
+    digest = page_digest(raw) if raw else None
+    t1 = time.thread_time()
+    page = _codec().encode(raw, digest) if raw else None
+    t2 = time.thread_time()
+    return hashes, page, t1 - t0, t2 - t1
+
+class CpuOffloadPipeline:
+    def __init__(self, settings, stats=None):
+        self.mode = (settings.get("OFFLOAD_MODE") or "off").lower()
+        self.workers = max(1, settings.getint("OFFLOAD_WORKERS", 4))
+        self.max_pending = settings.getint("OFFLOAD_MAX_PENDING_BYTES", 64 * 1024 * 1024)
+        self.level = settings.get("RAW_HTML_COMPRESS_LEVEL")
+        self.settings = settings
+        self.stats = stats
+
+        self._pool = None
+        self._executor = None
+        self._pending_bytes = 0
+        self._waiters = deque()
+
+        self.items = 0
+        self.hash_cpu = 0.0
+        self.compress_cpu = 0.0
+        self.wait_time = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, stats=crawler.stats)
+
+    def open_spider(self, spider):
+        if self.mode == "off":
+            return
+        client = MongoClient(self.settings.get("MONGODB_URI"))
+        try:
+            dict_doc = latest_dictionary(client[self.settings.get("MONGODB_DB")])
+        finally:
+            client.close()
+
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=configure_worker, initargs=(dict_doc, self.level),
+            )
+        else:
+            configure_worker(dict_doc, self.level)
+            self._pool = ThreadPool(minthreads=1, maxthreads=self.workers, name="qts-offload")
+            self._pool.start()
+        spider.logger.info("CPU offload: %s pool with %d workers", self.mode, self.workers)
+
+    def close_spider(self, spider):
+        if self._pool:
+            self._pool.stop()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        if self.mode == "off" or not self.items:
+            return
+        spider.logger.info(
+            "CPU offload: %d items, hash %.1f ms (%.3f ms/item), compress %.1f ms (%.3f ms/item), "
+            "waited %.1f ms for pending-bytes budget",
+            self.items,
+            self.hash_cpu * 1000, self.hash_cpu * 1000 / self.items,
+            self.compress_cpu * 1000, self.compress_cpu * 1000 / self.items,
+            self.wait_time * 1000,
+        )
+        if self.stats:
+            self.stats.set_value("offload/items", self.items)
+            self.stats.set_value("offload/hash_cpu_ms", round(self.hash_cpu * 1000, 1))
+            self.stats.set_value("offload/compress_cpu_ms", round(self.compress_cpu * 1000, 1))
+            self.stats.set_value("offload/budget_wait_ms", round(self.wait_time * 1000, 1))
+
+    def process_item(self, item, spider):
+        if self.mode == "off" or item.get("not_modified"):
+            return item
+        return self._offload(item)
+
+    @defer.inlineCallbacks
+    def _offload(self, item):
+        raw = item.pop("raw_html", None)
+        size = len(raw) if raw else 0
+
+        t0 = time.perf_counter()
+        yield self._reserve(size)
+        self.wait_time += time.perf_counter() - t0
+        try:
+            hashes, page, hash_cpu, compress_cpu = yield self._submit(dict(item), raw)
+        finally:
+            self._release(size)
+
+        item["content_hash"], item["field_hashes"] = hashes
+        if page:
+            item["raw_page"] = page
+        self.items += 1
+        self.hash_cpu += hash_cpu
+        self.compress_cpu += compress_cpu
+        return item
+
+    def _submit(self, fields, raw):
+        if self._executor:
+            fut = self._executor.submit(hash_and_encode, fields, raw)
+            return defer.Deferred.fromFuture(asyncio.wrap_future(fut))
+        from twisted.internet import reactor
+        return threads.deferToThreadPool(reactor, self._pool, hash_and_encode, fields, raw)
+
+    def _reserve(self, size):
+        # a single body larger than the budget still goes through, on its own
+        if not self._waiters and (self._pending_bytes == 0 or self._pending_bytes + size <= self.max_pending):
+            self._take(size)
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self._waiters.append((size, d))
+        return d
+
+    def _take(self, size):
+        self._pending_bytes += size
+        if self.stats:
+            self.stats.max_value("offload/pending_bytes_max", self._pending_bytes)
+
+    def _release(self, size):
+        self._pending_bytes -= size
+        while self._waiters:
+            size, d = self._waiters[0]
+            if self._pending_bytes and self._pending_bytes + size > self.max_pending:
+                break
+            self._waiters.popleft()
+            self._take(size)
+            d.callback(None)
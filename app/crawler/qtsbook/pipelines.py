@@ -3,121 +3,951 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
-import gzip
-import hashlib
+import asyncio
+import time
+import uuid
 from datetime import datetime, timezone
-from pymongo import MongoClient
+from pymongo import ASCENDING, TEXT, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from scrapy import signals
+from scrapy.utils.defer import deferred_from_coro
 from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import is_asyncio_reactor_installed
+from twisted.internet import task
 import re
 
+from qtsbook.checkpoints import Checkpoints
+from qtsbook.hashing import DIGEST_PROJECTION, diff_fields, item_hashes
+from qtsbook.rawstore import DICTS, PAGES, PageCodec, RawHtmlStore
+
 PRICE_RE = re.compile(r"[\d.]+")
 
+FIELDS_TO_COMPARE = [
+    "name",
+    "description",
+    "category",
+    "price_incl_tax", "price_incl_tax_num",
+    "availability",
+    "rating",
+    "num_reviews",
+]
+SIGNIFICANT_FIELDS = ["price_incl_tax", "price_incl_tax_num", "availability"]
+
+# books hashed before `field_hashes` are diffed on values, so they come back
+# whole, minus the HTML snapshot the diff never looks at
+PREV_PROJECTION = {"raw_html_gz": 0}
+# drops the inline snapshot left on books written before the `pages` store
+UNSET_INLINE_HTML = {"raw_html_gz": ""}
+# the API pages through these in (field, _id) order (app/api/pagination.py)
+KEYSET_INDEXES = {
+    "books": [[(f, ASCENDING), ("_id", ASCENDING)] for f in (
+        "crawled_at", "price_incl_tax_num", "rating", "num_reviews", "name",
+    )],
+    "changes": [[("changed_at", ASCENDING), ("_id", ASCENDING)]],
+}
+# `q` with QTS_SEARCH_BACKEND=text (app/api/search.py); a collection has at most one text index
+TEXT_INDEX = [("name", TEXT), ("category", TEXT), ("description", TEXT)]
+TEXT_INDEX_OPTIONS = {"name": "books_text", "weights": {"name": 3, "category": 2, "description": 1}}
+# bumped whenever a spider closes; the API drops its response cache when it moves (app/api/cache.py)
+META = "meta"
+EPOCH_ID = "crawl_epoch"
+# unchanged books are touched with one update_many per this many URLs
+TOUCH_BATCH_SIZE = 500
+
+# crawl generations: per-run snapshots of the compared fields
+SNAPSHOTS = "snapshots"
+GENERATIONS = "crawl_generations"
+SNAPSHOT_FIELDS = ["content_hash", "field_hashes", *FIELDS_TO_COMPARE]
+
+# price/stock/rating history: a time-series collection, one point per book per crawl
+HISTORY = "book_history"
+HISTORY_SOURCE_FIELDS = {"url": 1, "price_incl_tax_num": 1, "availability": 1, "rating": 1, "_id": 0}
+STOCK_RE = re.compile(r"\((\d+) available\)")
+
+def bump_epoch(db):
+    """Advance the crawl epoch (with a motor `db`, returns the awaitable)."""
+    return db[META].update_one(
+        {"_id": EPOCH_ID}, {"$inc": {"epoch": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}, upsert=True,
+    )
+
 def parse_price_num(s: str | None) -> float | None:
     if not s:
         return None
     m = PRICE_RE.search(s)
     return float(m.group(0)) if m else None
 
+def prepare_item(item):
+    # the offload stage may already have hashed the item off the reactor thread
+    if not (item.get("content_hash") and item.get("field_hashes")):
+        item["content_hash"], item["field_hashes"] = item_hashes(item)
+    item["crawled_at"] = datetime.now(timezone.utc)
+
+    item["price_incl_tax_num"] = parse_price_num(item.get("price_incl_tax"))
+    item["price_excl_tax_num"] = parse_price_num(item.get("price_excl_tax"))
+    return item
+
+def history_point(item, ts=None) -> dict:
+    """`book_history` point for a book (an item or a `books` doc)."""
+    availability = (item.get("availability") or "").strip()
+    in_stock = availability.lower().startswith("in stock")
+    m = STOCK_RE.search(availability)
+    return {
+        "ts": ts or datetime.now(timezone.utc),
+        "book": item["url"],
+        "price": item.get("price_incl_tax_num"),
+        "in_stock": in_stock,
+        "stock": int(m.group(1)) if m else (None if in_stock else 0),
+        "rating": item.get("rating"),
+    }
+
+def history_options(retention_days: int = 0) -> dict:
+    opts = {"timeseries": {"timeField": "ts", "metaField": "book", "granularity": "hours"}}
+    if retention_days > 0:
+        opts["expireAfterSeconds"] = retention_days * 86400
+    return opts
+
+def ensure_history(db, retention_days: int = 0):
+    if HISTORY not in db.list_collection_names():
+        try:
+            db.create_collection(HISTORY, **history_options(retention_days))
+        except CollectionInvalid:
+            pass  # another worker created it first
+    db[HISTORY].create_index([("book", ASCENDING), ("ts", ASCENDING)])
+
+def build_change(prev, item, changed_at=None, fields=None) -> dict | None:
+    """Return the `changes` document for `item` against `prev`, or None if nothing changed.
+
+    `fields` narrows the comparison to fields already known to differ (see
+    `hashing.diff_fields`); `prev` then only needs those values.
+    """
+    changed_at = changed_at or datetime.now(timezone.utc)
+
+    if not prev:
+        return {
+            "url": item["url"],
+            "changed_at": changed_at,
+            "change_kind": "new",
+            "significant": True,
+            "fields_changed": {
+                "name": {"prev": None, "new": item.get("name")},
+                "category": {"prev": None, "new": item.get("category")},
+                "price_incl_tax": {"prev": None, "new": item.get("price_incl_tax")},
+                "availability": {"prev": None, "new": item.get("availability")},
+                "rating": {"prev": None, "new": item.get("rating")},
+            },
+            "price_delta": None,
+            "prev_hash": None,
+            "new_hash": item["content_hash"],
+        }
+
+    # if we get here, it existed before — compute diffs
+    changed = {}
+    for f in (FIELDS_TO_COMPARE if fields is None else fields):
+        if prev.get(f) != item.get(f):
+            changed[f] = {"prev": prev.get(f), "new": item.get(f)}
+
+    if not changed:
+        return None
+
+    significant = any(k in changed for k in SIGNIFICANT_FIELDS)
+
+    price_delta = None
+    if "price_incl_tax_num" in changed:
+        try:
+            old = prev.get("price_incl_tax_num")
+            new = item.get("price_incl_tax_num")
+            if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+                price_delta = round(new - old, 2)
+        except Exception:
+            price_delta = None
+
+    return {
+        "url": item["url"],
+        "changed_at": changed_at,
+        "change_kind": "update",
+        "significant": significant,
+        "fields_changed": changed,
+        "price_delta": price_delta,
+        "prev_hash": prev.get("content_hash"),
+        "new_hash": item["content_hash"],
+    }
+
+def build_removed(prev, changed_at=None) -> dict:
+    """`changes` document for a book that was in the previous generation but not this one."""
+    return {
+        "url": prev["url"],
+        "changed_at": changed_at or datetime.now(timezone.utc),
+        "change_kind": "removed",
+        "significant": True,
+        "fields_changed": {
+            "name": {"prev": prev.get("name"), "new": None},
+            "category": {"prev": prev.get("category"), "new": None},
+            "price_incl_tax": {"prev": prev.get("price_incl_tax"), "new": None},
+            "availability": {"prev": prev.get("availability"), "new": None},
+        },
+        "price_delta": None,
+        "prev_hash": prev.get("content_hash"),
+        "new_hash": None,
+    }
+
+def new_run_id() -> str:
+    return f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+def snapshot_op(run_id: str, item, carried: bool = False) -> UpdateOne:
+    """Record `item` in generation `run_id`.
+
+    A carried row (a 304 or fast-refresh marker) has no fields of its own;
+    it takes them from the previous generation when the run is finalized.
+    """
+    doc = {"run_id": run_id, "url": item["url"], "carried": carried}
+    if not carried:
+        doc.update({f: item.get(f) for f in SNAPSHOT_FIELDS})
+    return UpdateOne({"run_id": run_id, "url": item["url"]}, {"$set": doc}, upsert=True)
+
+def open_generation(db, run_id: str, sources=None):
+    """Register generation `run_id` of the books of `sources` (None: every source).
+
+    The first one ever is diffed against a baseline copied from `books`.
+    """
+    db[SNAPSHOTS].create_index([("run_id", ASCENDING), ("url", ASCENDING)], unique=True)
+    now = datetime.now(timezone.utc)
+    if not db[GENERATIONS].find_one({"status": "complete"}, {"_id": 1}):
+        baseline = f"baseline-{run_id}"
+        db["books"].aggregate([
+            {"$project": {"_id": 0, "url": 1, **{f: 1 for f in SNAPSHOT_FIELDS}}},
+            {"$set": {"run_id": baseline, "carried": False}},
+            {"$merge": {"into": SNAPSHOTS, "on": ["run_id", "url"], "whenMatched": "replace"}},
+        ])
+        db[GENERATIONS].update_one(
+            {"_id": baseline},
+            {"$setOnInsert": {"status": "complete", "baseline": True, "started_at": now, "finished_at": now}},
+            upsert=True,
+        )
+    db[GENERATIONS].update_one(
+        {"_id": run_id},
+        {"$setOnInsert": {"status": "open", "started_at": now, "sources": sorted(sources) if sources else None}},
+        upsert=True,
+    )
+
+def previous_generations(gens, run_id: str, sources) -> list[tuple[dict, set | None]]:
+    """The complete generations `run_id` is diffed against, newest first, each with the sources it is the latest of.
+
+    A generation without `sources` (a baseline, an older run, a run of every
+    source) covers all of them, and so does it for a `run_id` without sources.
+    """
+    prevs = []
+    left = set(sources) if sources else None
+    for gen in gens.find({"status": "complete", "_id": {"$ne": run_id}}, {"sources": 1}).sort("finished_at", -1):
+        if not gen.get("sources"):
+            prevs.append((gen, left))
+            break
+        if left is None:
+            continue  # a subset of sources can't stand for all of them
+        covered = left & set(gen["sources"])
+        if covered:
+            prevs.append((gen, covered))
+            left -= covered
+        if not left:
+            break
+    return prevs
+
+def _snapshot_match(gen: dict, sources: set | None) -> dict:
+    if sources is None:
+        return {"run_id": gen["_id"]}
+    # snapshots of generations that predate `sources` may predate their `source` field too
+    legacy = [] if gen.get("sources") else [None]
+    return {"run_id": gen["_id"], "source": {"$in": [*sorted(sources), *legacy]}}
+
+def finalize_generation(db, run_id: str, keep: int = 3) -> dict:
+    """Diff generation `run_id` against the previous complete one and record the changes.
+
+    A generation only covers the sources its spider crawled (a catalog run
+    of some sites, a books run): each of them is diffed against the last
+    complete generation that crawled it, and the books of other sources are
+    left alone. One aggregation groups both sides' snapshots by URL: URLs
+    only in this run are new, URLs only in the previous one were removed,
+    URLs in both with different content hashes were updated. The resulting
+    `changes` are bulk-inserted and generations beyond the last `keep`
+    (other than the latest of a source) are pruned.
+    """
+    snaps, gens = db[SNAPSHOTS], db[GENERATIONS]
+    sources = (gens.find_one({"_id": run_id}, {"sources": 1}) or {}).get("sources")
+    prevs = previous_generations(gens, run_id, sources)
+    prev_ids = [gen["_id"] for gen, _ in prevs]
+    now = datetime.now(timezone.utc)
+
+    if prev_ids:
+        # carried rows take their fields from the previous generation
+        snaps.aggregate([
+            {"$match": {"run_id": run_id, "carried": True}},
+            {"$lookup": {
+                "from": SNAPSHOTS,
+                "let": {"url": "$url"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [{"$in": ["$run_id", prev_ids]}, {"$eq": ["$url", "$$url"]}]}}},
+                    {"$project": {f: 1 for f in SNAPSHOT_FIELDS} | {"_id": 0}},
+                    {"$limit": 1},
+                ],
+                "as": "prev",
+            }},
+            {"$unwind": "$prev"},
+            {"$replaceWith": {"$mergeObjects": ["$prev", {"_id": "$_id", "run_id": "$run_id", "url": "$url", "carried": True}]}},
+            {"$merge": {"into": SNAPSHOTS, "on": "_id", "whenMatched": "replace", "whenNotMatched": "discard"}},
+        ])
+
+    rows = snaps.aggregate([
+        {"$match": {"$or": [{"run_id": run_id}, *(_snapshot_match(gen, srcs) for gen, srcs in prevs)]}},
+        {"$group": {
+            "_id": "$url",
+            "cur": {"$max": {"$cond": [{"$eq": ["$run_id", run_id]}, "$$ROOT", None]}},
+            "prev": {"$max": {"$cond": [{"$ne": ["$run_id", run_id]}, "$$ROOT", None]}},
+        }},
+        {"$match": {"$expr": {"$or": [
+            {"$eq": [{"$ifNull": ["$cur", None]}, None]},
+            {"$eq": [{"$ifNull": ["$prev", None]}, None]},
+            {"$ne": ["$cur.content_hash", "$prev.content_hash"]},
+        ]}}},
+    ], allowDiskUse=True)
+
+    changes = []
+    counts = {"new": 0, "update": 0, "removed": 0}
+    for row in rows:
+        cur, old = row.get("cur"), row.get("prev")
+        if cur is None:
+            change = build_removed(old, now)
+        elif cur.get("content_hash") is None:
+            continue  # carried, but the previous generation never had it
+        else:
+            change = build_change(old, cur, now, diff_fields(old, cur))
+        if change:
+            changes.append(change)
+            counts[change["change_kind"]] += 1
+    for i in range(0, len(changes), 1000):
+        db["changes"].insert_many(changes[i:i + 1000], ordered=False)
+
+    gens.update_one(
+        {"_id": run_id},
+        {"$set": {"status": "complete", "finished_at": datetime.now(timezone.utc), "previous": prev_ids, "counts": counts}},
+    )
+
+    # keep the last `keep` complete generations and the latest of every source (the next run diffs against them)
+    complete = list(gens.find({"status": "complete"}, {"sources": 1}).sort("finished_at", -1))
+    kept = [g["_id"] for g in complete[:keep]]
+    seen: set = set()
+    for g in complete:
+        if not g.get("sources"):
+            kept.append(g["_id"])  # covers every source: nothing older is needed
+            break
+        if not seen.issuperset(g["sources"]):
+            kept.append(g["_id"])
+            seen.update(g["sources"])
+    stale = [g["_id"] for g in gens.find({"_id": {"$nin": kept + [run_id]}, "finished_at": {"$exists": True}}, {"_id": 1})]
+    if stale:
+        snaps.delete_many({"run_id": {"$in": stale}})
+        gens.delete_many({"_id": {"$in": stale}})
+    return counts
+
+def open_run_generation(db, settings, spider) -> tuple[str | None, bool]:
+    """The generation `spider`'s items are snapshotted under (None: diff per item) and whether this process finalizes it."""
+    if getattr(spider, "mode", None) == "targeted":
+        # a targeted batch only sees its few URLs; as a generation the rest of the catalog would look removed
+        spider.logger.info("Targeted batch: diffing per item, no crawl generation")
+        return None, False
+    # a sharded worker shares its run's generation; the orchestrator finalizes it
+    generation = getattr(spider, "run_id", None) or new_run_id()
+    finalize = not getattr(spider, "run_id", None)
+    uses_checkpoints = getattr(spider, "uses_checkpoints", None)
+    if finalize and uses_checkpoints and uses_checkpoints(settings):
+        # a checkpoint job is one generation however many sessions it takes (see finalize_run)
+        job = Checkpoints.resumable(db, spider.mode) if spider.resume else None
+        if job and not job.get("generation"):
+            # its earlier sessions were never snapshotted: diffed, their books would look removed
+            finalize = False
+            spider.logger.warning("Resumed job %s has no crawl generation; not finalizing", job["_id"])
+        elif job:
+            generation = job["generation"]
+        spider.generation = generation
+    # the generation covers the spider's sources only: books of the others are never seen as removed
+    open_generation(db, generation, getattr(spider, "sources", None))
+    spider.logger.info("Crawl generation %s", generation)
+    return generation, finalize
+
+def finalize_run(settings, stats, spider, generation: str, reason: str):
+    """Diff a finished run's generation (on spider_closed, once the finish reason is known)."""
+    if reason != "finished":
+        # an interrupted run never saw every book; diffing it would report them removed
+        spider.logger.warning("Crawl generation %s not finalized (%s)", generation, reason)
+        return
+    checkpoints = getattr(spider, "checkpoints", None)
+    if checkpoints is not None and not checkpoints.complete(reason):
+        # skipped or unfinished categories: the session that completes the job finalizes it
+        spider.logger.info("Crawl generation %s stays open until job %s completes", generation, checkpoints.job_id)
+        return
+    client = MongoClient(settings.get("MONGODB_URI"))
+    try:
+        t0 = time.perf_counter()
+        db = client[settings.get("MONGODB_DB")]
+        counts = finalize_generation(db, generation, keep=settings.getint("MONGO_GENERATIONS_KEEP", 3))
+        bump_epoch(db)  # the run's changes only exist from here
+    finally:
+        client.close()
+    spider.logger.info(
+        "Crawl generation %s: %d new, %d updated, %d removed (%.1f ms)",
+        generation, counts["new"], counts["update"], counts["removed"], (time.perf_counter() - t0) * 1000,
+    )
+    if stats:
+        for kind, n in counts.items():
+            stats.set_value(f"generation/{kind}", n)
+
 class MongoPipeline:
-    def __init__(self):
+    """Upserts books and records changes.
+
+    With MONGO_BATCH_SIZE > 0 items are buffered and written in batches: one
+    `$in` lookup for previous docs, one unordered `bulk_write` for `books` and
+    one `insert_many` for `changes`. A batch is flushed once it holds
+    MONGO_BATCH_SIZE items, every MONGO_BATCH_INTERVAL_MS, and on close.
+
+    With MONGO_HASH_INDEX the `url -> content_hash` map is loaded once at open;
+    items whose hash is unchanged skip the diff and the document rewrite and
+    only get their `crawled_at` touched in batches (or nothing at all when
+    MONGO_TOUCH_UNCHANGED is off).
+
+    The diff first fetches only the previous `field_hashes` (see
+    qtsbook/hashing.py) and then the values of the fields whose digests
+    differ; books without digests are still diffed on their full doc.
+
+    Raw HTML goes to the content-addressed `pages` store; books keep only
+    `raw_html_ref`.
+
+    With BOOK_HISTORY_ENABLED every book seen by the crawl, changed or not,
+    gets one point (price, stock, rating) in the `book_history` time-series
+    collection; unchanged books repeat their last known values.
+
+    With MONGO_GENERATIONS the per-item diff is skipped altogether: every
+    item is recorded in `snapshots` under the run's id and, once the spider
+    has finished, `finalize_generation` diffs the whole run against the
+    previous one (including books that disappeared; an item that was dropped
+    or failed in a pipeline is carried over, not removed). Sharded workers share
+    their run's generation, which the orchestrator finalizes. Targeted
+    batches are diffed per item: they never see the whole catalog. A
+    checkpointed job keeps one generation across its resumed sessions and
+    finalizes it when the job completes.
+    """
+
+    def __init__(self, settings=None, stats=None):
+        self.settings = settings
+        self.stats = stats
         self.client = None
         self.db = None
         self.books = None
         self.changes = None
+        self.raw_store = None
+
+        self.batch_size = 0
+        self.batch_interval_ms = 0
+        self._batch = []
+        self._batch_pages = {}
+        self._flush_loop = None
+
+        self.touch_unchanged = True
+        self._hashes = None  # url -> content_hash, None when the index is off
+        self._touch = []
+        self.not_modified = 0
+        self.index_hits = 0
+        self.index_misses = 0
+        self.touched = 0
+        self.skipped_writes = 0
+
+        self.generation = None  # run id when MONGO_GENERATIONS is on
+        self.finalize = False
+        self._snapshots = []
+
+        self._history = None  # url -> last history point, None when history is off
+        self._points = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipe = cls(settings=crawler.settings, stats=crawler.stats)
+        # the generation can only be diffed once the finish reason is known
+        crawler.signals.connect(pipe.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipe.item_failed, signal=signals.item_dropped)
+        crawler.signals.connect(pipe.item_failed, signal=signals.item_error)
+        return pipe
 
     def open_spider(self, spider):
-        s = get_project_settings()
+        s = self.settings or get_project_settings()
         self.client = MongoClient(s.get("MONGODB_URI"))
         self.db = self.client[s.get("MONGODB_DB")]
         self.books = self.db["books"]
         self.changes = self.db["changes"]
+        self.raw_store = RawHtmlStore(self.db, level=s.get("RAW_HTML_COMPRESS_LEVEL"))
 
         # indexes for uniqueness & fast API queries
         self.books.create_index("url", unique=True)
         self.books.create_index([("category", 1), ("price_incl_tax", 1), ("rating", -1)])
+        for name, indexes in KEYSET_INDEXES.items():
+            for keys in indexes:
+                self.db[name].create_index(keys)
+        if s.getbool("MONGO_TEXT_INDEX"):
+            self.books.create_index(TEXT_INDEX, **TEXT_INDEX_OPTIONS)
+
+        if s.getbool("MONGO_HASH_INDEX", True):
+            t0 = time.perf_counter()
+            self._hashes = {
+                d["url"]: d.get("content_hash")
+                for d in self.books.find({}, {"url": 1, "content_hash": 1, "_id": 0})
+            }
+            spider.logger.info(
+                "Loaded content_hash index for %d books in %.1f ms",
+                len(self._hashes), (time.perf_counter() - t0) * 1000,
+            )
+        self.touch_unchanged = s.getbool("MONGO_TOUCH_UNCHANGED", True)
+
+        if s.getbool("BOOK_HISTORY_ENABLED", True):
+            ensure_history(self.db, s.getint("BOOK_HISTORY_RETENTION_DAYS", 0))
+            # last known values, repeated for books that come back unchanged
+            self._history = {d["url"]: history_point(d) for d in self.books.find({}, HISTORY_SOURCE_FIELDS)}
+
+        if s.getbool("MONGO_GENERATIONS", False):
+            self.generation, self.finalize = open_run_generation(self.db, s, spider)
+
+        self.batch_size = s.getint("MONGO_BATCH_SIZE", 0)
+        self.batch_interval_ms = s.getint("MONGO_BATCH_INTERVAL_MS", 1000)
+        if self.batch_size > 0 and self.batch_interval_ms > 0:
+            self._flush_loop = task.LoopingCall(self._flush_tick, spider)
+            self._flush_loop.start(self.batch_interval_ms / 1000, now=False)
 
     def close_spider(self, spider):
+        if self._flush_loop and self._flush_loop.running:
+            self._flush_loop.stop()
+        self._flush_batch(spider)
+        self._flush_touches()
+        self._flush_snapshots()
+        self._flush_points()
+        if self.stats:
+            self.stats.set_value("mongo/not_modified", self.not_modified)
+        if self.stats and self._hashes is not None:
+            self.stats.set_value("mongo/index_hits", self.index_hits)
+            self.stats.set_value("mongo/index_misses", self.index_misses)
+            self.stats.set_value("mongo/touched", self.touched)
+            self.stats.set_value("mongo/skipped_writes", self.skipped_writes)
         if self.client:
+            bump_epoch(self.db)
             self.client.close()
 
+    def spider_closed(self, spider, reason):
+        if self.generation and self.finalize:
+            finalize_run(self.settings or get_project_settings(), self.stats, spider, self.generation, reason)
+
+    def item_failed(self, item, response, spider, **kwargs):
+        # a parse or DB error is no delisting: the book keeps its last snapshot instead of turning up removed
+        if not self.generation or not item.get("url"):
+            return
+        self._snapshot(item, carried=True)
+        if self.stats:
+            self.stats.inc_value("generation/carried_failures")
+
     def process_item(self, item, spider):
-        key = (
-            f"{item.get('name', '')}"
-            f"{item.get('price_incl_tax', '')}"
-            f"{item.get('availability', '')}"
-            f"{item.get('rating', '')}"
-            f"{item.get('num_reviews', '')}"
-        ).encode("utf-8", "ignore")
-        item["content_hash"] = hashlib.sha1(key).hexdigest()
-        item["crawled_at"] = datetime.now(timezone.utc)
+        if item.get("not_modified"):
+            self.not_modified += 1
+            self._snapshot(item, carried=True)
+            self._record_point(item, carried=True)
+            self._touch_unchanged(item)
+            return item
 
-        item["price_incl_tax_num"] = parse_price_num(item.get("price_incl_tax"))
-        item["price_excl_tax_num"] = parse_price_num(item.get("price_excl_tax"))
+        prepare_item(item)
+        raw = item.pop("raw_html", None)
+        page = item.pop("raw_page", None)
+        self._snapshot(item)
+        self._record_point(item)
 
-        if "raw_html" in item:
-            item["raw_html_gz"] = gzip.compress(item.pop("raw_html"))
+        if self._hashes is not None:
+            if self._hashes.get(item["url"]) == item["content_hash"]:
+                self.index_hits += 1
+                self._touch_unchanged(item)
+                return item
+            self.index_misses += 1
+            self._hashes[item["url"]] = item["content_hash"]
 
-        prev = self.books.find_one({"url": item["url"]})
+        if raw and page is None:
+            page = self.raw_store.encode(raw)
+        if page:
+            item["raw_html_ref"] = page["_id"]
 
-        doc = dict(item)
-        self.books.update_one({"url": item["url"]}, {"$set": doc}, upsert=True)
-
-        if not prev:
-            self.changes.insert_one({
-                "url": item["url"],
-                "changed_at": datetime.now(timezone.utc),
-                "change_kind": "new",
-                "significant": True,
-                "fields_changed": {
-                    "name": {"prev": None, "new": item.get("name")},
-                    "category": {"prev": None, "new": item.get("category")},
-                    "price_incl_tax": {"prev": None, "new": item.get("price_incl_tax")},
-                    "availability": {"prev": None, "new": item.get("availability")},
-                    "rating": {"prev": None, "new": item.get("rating")},
-                },
-                "price_delta": None,
-                "prev_hash": None,
-                "new_hash": item["content_hash"],
-            })
+        if self.batch_size > 0:
+            self._batch.append(item)
+            if page:
+                self._batch_pages[page["_id"]] = page
+            if len(self._batch) >= self.batch_size:
+                self._flush_batch(spider)
             return item
 
-        # if we get here, it existed before — compute diffs
-        fields_to_compare = [
-            "name",
-            "price_incl_tax", "price_incl_tax_num",
-            "availability",
-            "rating",
-            "num_reviews",
-        ]
-        changed = {}
-        for f in fields_to_compare:
-            if prev.get(f) != item.get(f):
-                changed[f] = {"prev": prev.get(f), "new": item.get(f)}
-
-        if not changed:
+        if page:
+            self.raw_store.put(page)
+
+        if self.generation:
+            self.books.update_one({"url": item["url"]}, {"$set": dict(item), "$unset": UNSET_INLINE_HTML}, upsert=True)
             return item
 
-        significant = any(k in changed for k in ["price_incl_tax", "price_incl_tax_num", "availability"])
+        prev = self._prev_docs([item]).get(item["url"])
 
-        price_delta = None
-        if "price_incl_tax_num" in changed:
+        doc = dict(item)
+        self.books.update_one({"url": item["url"]}, {"$set": doc, "$unset": UNSET_INLINE_HTML}, upsert=True)
+
+        change = build_change(prev, item, fields=diff_fields(prev, item))
+        if change:
+            self.changes.insert_one(change)
+        return item
+
+    def _prev_docs(self, items) -> dict:
+        """url -> previous book, holding its digests plus the values of the fields that changed."""
+        urls = list({item["url"] for item in items})
+        prevs = {d["url"]: d for d in self.books.find({"url": {"$in": urls}}, DIGEST_PROJECTION)}
+        fields, changed, legacy = set(), set(), []
+        for item in items:
+            prev = prevs.get(item["url"])
+            if prev is None:
+                continue
+            diff = diff_fields(prev, item)
+            if diff is None:
+                legacy.append(item["url"])
+            elif diff:
+                fields.update(diff)
+                changed.add(item["url"])
+        if changed:
+            projection = {"url": 1, "_id": 0, **{f: 1 for f in fields}}
+            for d in self.books.find({"url": {"$in": list(changed)}}, projection):
+                prevs[d["url"]].update(d)
+        if legacy:
+            prevs.update({d["url"]: d for d in self.books.find({"url": {"$in": legacy}}, PREV_PROJECTION)})
+        return prevs
+
+    def _snapshot(self, item, carried: bool = False):
+        if not self.generation:
+            return
+        self._snapshots.append(snapshot_op(self.generation, item, carried))
+        if len(self._snapshots) >= TOUCH_BATCH_SIZE:
+            self._flush_snapshots()
+
+    def _flush_snapshots(self):
+        if not self._snapshots:
+            return
+        ops, self._snapshots = self._snapshots, []
+        self.db[SNAPSHOTS].bulk_write(ops, ordered=False)
+
+    def _record_point(self, item, carried: bool = False):
+        if self._history is None:
+            return
+        if carried:
+            last = self._history.get(item["url"])
+            if last is None:
+                return
+            point = {**last, "ts": datetime.now(timezone.utc)}
+        else:
+            point = history_point(item, item.get("crawled_at"))
+            self._history[item["url"]] = point
+        # insert_many sets _id on the docs it is given, so never hand it the cached point
+        self._points.append(dict(point))
+        if len(self._points) >= TOUCH_BATCH_SIZE:
+            self._flush_points()
+
+    def _flush_points(self):
+        if not self._points:
+            return
+        points, self._points = self._points, []
+        self.db[HISTORY].insert_many(points, ordered=False)
+
+    def _touch_unchanged(self, item):
+        if not self.touch_unchanged:
+            self.skipped_writes += 1
+            return
+        self._touch.append(item["url"])
+        if len(self._touch) >= TOUCH_BATCH_SIZE:
+            self._flush_touches()
+
+    def _flush_touches(self):
+        if not self._touch:
+            return
+        urls, self._touch = self._touch, []
+        self.books.update_many(
+            {"url": {"$in": urls}},
+            {"$set": {"crawled_at": datetime.now(timezone.utc)}},
+        )
+        self.touched += len(urls)
+
+    def _flush_tick(self, spider):
+        # an exception escaping a LoopingCall stops it, so keep the timer alive
+        try:
+            self._flush_batch(spider)
+            self._flush_touches()
+            self._flush_snapshots()
+            self._flush_points()
+        except Exception:
+            spider.logger.exception("Mongo batch flush failed")
+
+    def _flush_batch(self, spider):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        pages, self._batch_pages = list(self._batch_pages.values()), {}
+
+        t0 = time.perf_counter()
+        prevs = {}
+        if not self.generation:  # generations are diffed once, at the end of the run
+            prevs = self._prev_docs(batch)
+        t_fetch = time.perf_counter()
+
+        now = datetime.now(timezone.utc)
+        ops, changes = [], []
+        for item in batch:
+            doc = dict(item)
+            ops.append(UpdateOne({"url": item["url"]}, {"$set": doc, "$unset": UNSET_INLINE_HTML}, upsert=True))
+            if self.generation:
+                continue
+            prev = prevs.get(item["url"])
+            change = build_change(prev, item, now, diff_fields(prev, item))
+            if change:
+                changes.append(change)
+            # a URL seen twice in one batch diffs against its earlier copy
+            prevs[item["url"]] = doc
+
+        try:
+            self.raw_store.put_many(pages)
+        except BulkWriteError as e:
+            spider.logger.error("Mongo batch: %d page writes failed", len(e.details.get("writeErrors", [])))
+        try:
+            self.books.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            spider.logger.error("Mongo batch: %d book writes failed", len(e.details.get("writeErrors", [])))
+        t_books = time.perf_counter()
+
+        if changes:
             try:
-                old = prev.get("price_incl_tax_num")
-                new = item.get("price_incl_tax_num")
-                if isinstance(old, (int, float)) and isinstance(new, (int, float)):
-                    price_delta = round(new - old, 2)
-            except Exception:
-                price_delta = None
-
-        self.changes.insert_one({
-            "url": item["url"],
-            "changed_at": datetime.now(timezone.utc),
-            "change_kind": "update",
-            "significant": significant,
-            "fields_changed": changed,
-            "price_delta": price_delta,
-            "prev_hash": prev.get("content_hash"),
-            "new_hash": item["content_hash"],
-        })
+                self.changes.insert_many(changes, ordered=False)
+            except BulkWriteError as e:
+                spider.logger.error("Mongo batch: %d change inserts failed", len(e.details.get("writeErrors", [])))
+        t_changes = time.perf_counter()
+
+        total_ms = (t_changes - t0) * 1000
+        spider.logger.info(
+            "Mongo batch: %d items, %d changes in %.1f ms (fetch %.1f, books %.1f, changes %.1f)",
+            len(batch), len(changes), total_ms,
+            (t_fetch - t0) * 1000, (t_books - t_fetch) * 1000, (t_changes - t_books) * 1000,
+        )
+        if self.stats:
+            self.stats.inc_value("mongo/batches")
+            self.stats.inc_value("mongo/batch_items", len(batch))
+            self.stats.max_value("mongo/batch_ms_max", round(total_ms, 1))
+
+class AsyncMongoPipeline:
+    """Non-blocking drop-in for MongoPipeline backed by motor.
+
+    Runs on Scrapy's asyncio reactor, so downloads keep going while Mongo
+    answers. At most MONGO_MAX_INFLIGHT items are persisted concurrently;
+    the rest wait on the semaphore, which backs up Scrapy's item queue.
+
+    It records what MongoPipeline records, item by item instead of in
+    batches: the content_hash index skip (MONGO_HASH_INDEX), history
+    points, crawl generations (opened and finalized with the same helpers,
+    over a short-lived blocking client) and the same `mongo/*` stats.
+    """
+
+    def __init__(self, settings=None, stats=None):
+        self.settings = settings
+        self.stats = stats
+        self.client = None
+        self.db = None
+        self.books = None
+        self.changes = None
+        self.pages = None
+        self.codec = None
+        self._inflight = None
+        self._history = None
+
+        self.touch_unchanged = True
+        self._hashes = None  # url -> content_hash, None when the index is off
+        self.not_modified = 0
+        self.index_hits = 0
+        self.index_misses = 0
+        self.touched = 0
+        self.skipped_writes = 0
+
+        self.generation = None  # run id when MONGO_GENERATIONS is on
+        self.finalize = False
+        self._snapshots = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipe = cls(settings=crawler.settings, stats=crawler.stats)
+        crawler.signals.connect(pipe.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(pipe.item_failed, signal=signals.item_dropped)
+        crawler.signals.connect(pipe.item_failed, signal=signals.item_error)
+        return pipe
+
+    def open_spider(self, spider):
+        if not is_asyncio_reactor_installed():
+            raise RuntimeError(
+                "AsyncMongoPipeline needs TWISTED_REACTOR = "
+                "'twisted.internet.asyncioreactor.AsyncioSelectorReactor'"
+            )
+        return deferred_from_coro(self._open(spider))
 
+    async def _open(self, spider):
+        # imported here so the blocking pipeline doesn't need motor installed
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        s = self.settings or get_project_settings()
+        self.client = AsyncIOMotorClient(s.get("MONGODB_URI"))
+        self.db = self.client[s.get("MONGODB_DB")]
+        self.books = self.db["books"]
+        self.changes = self.db["changes"]
+        self.pages = self.db[PAGES]
+        self.codec = PageCodec(
+            await self.db[DICTS].find_one(sort=[("created_at", -1)]),
+            level=s.get("RAW_HTML_COMPRESS_LEVEL"),
+        )
+
+        await self.books.create_index("url", unique=True)
+        await self.books.create_index([("category", 1), ("price_incl_tax", 1), ("rating", -1)])
+        for name, indexes in KEYSET_INDEXES.items():
+            for keys in indexes:
+                await self.db[name].create_index(keys)
+        if s.getbool("MONGO_TEXT_INDEX"):
+            await self.books.create_index(TEXT_INDEX, **TEXT_INDEX_OPTIONS)
+
+        self._inflight = asyncio.Semaphore(max(1, s.getint("MONGO_MAX_INFLIGHT", 16)))
+
+        if s.getbool("MONGO_HASH_INDEX", True):
+            t0 = time.perf_counter()
+            self._hashes = {
+                d["url"]: d.get("content_hash")
+                async for d in self.books.find({}, {"url": 1, "content_hash": 1, "_id": 0})
+            }
+            spider.logger.info(
+                "Loaded content_hash index for %d books in %.1f ms",
+                len(self._hashes), (time.perf_counter() - t0) * 1000,
+            )
+        self.touch_unchanged = s.getbool("MONGO_TOUCH_UNCHANGED", True)
+
+        if s.getbool("BOOK_HISTORY_ENABLED", True):
+            if HISTORY not in await self.db.list_collection_names():
+                try:
+                    await self.db.create_collection(HISTORY, **history_options(s.getint("BOOK_HISTORY_RETENTION_DAYS", 0)))
+                except CollectionInvalid:
+                    pass
+            await self.db[HISTORY].create_index([("book", ASCENDING), ("ts", ASCENDING)])
+            self._history = {d["url"]: history_point(d) async for d in self.books.find({}, HISTORY_SOURCE_FIELDS)}
+
+        if s.getbool("MONGO_GENERATIONS", False):
+            # once per run, on the same blocking helpers as MongoPipeline
+            self.generation, self.finalize = await asyncio.to_thread(self._open_generation, s, spider)
+
+    def _open_generation(self, settings, spider) -> tuple[str | None, bool]:
+        client = MongoClient(settings.get("MONGODB_URI"))
+        try:
+            return open_run_generation(client[settings.get("MONGODB_DB")], settings, spider)
+        finally:
+            client.close()
+
+    def close_spider(self, spider):
+        return deferred_from_coro(self._close())
+
+    async def _close(self):
+        await self._flush_snapshots()
+        if self.stats:
+            self.stats.set_value("mongo/not_modified", self.not_modified)
+        if self.stats and self._hashes is not None:
+            self.stats.set_value("mongo/index_hits", self.index_hits)
+            self.stats.set_value("mongo/index_misses", self.index_misses)
+            self.stats.set_value("mongo/touched", self.touched)
+            self.stats.set_value("mongo/skipped_writes", self.skipped_writes)
+        if self.client:
+            await bump_epoch(self.db)
+            self.client.close()
+
+    def spider_closed(self, spider, reason):
+        if self.generation and self.finalize:
+            finalize_run(self.settings or get_project_settings(), self.stats, spider, self.generation, reason)
+
+    def item_failed(self, item, response, spider, **kwargs):
+        # as in MongoPipeline: a failed item keeps its last snapshot instead of turning up removed
+        if not self.generation or not item.get("url"):
+            return
+        self._snapshots.append(snapshot_op(self.generation, item, carried=True))
+        if self.stats:
+            self.stats.inc_value("generation/carried_failures")
+
+    async def process_item(self, item, spider):
+        if item.get("not_modified"):
+            self.not_modified += 1
+            last = self._history.get(item["url"]) if self._history is not None else None
+            async with self._inflight:
+                await self._snapshot(item, carried=True)
+                await self._touch_unchanged(item)
+                if last:
+                    await self.db[HISTORY].insert_one({**last, "ts": datetime.now(timezone.utc)})
+            return item
+
+        prepare_item(item)
+        raw = item.pop("raw_html", None)
+        page = item.pop("raw_page", None)
+
+        async with self._inflight:
+            await self._snapshot(item)
+            if self._history is not None:
+                point = history_point(item, item.get("crawled_at"))
+                self._history[item["url"]] = point
+                await self.db[HISTORY].insert_one(dict(point))
+
+            if self._hashes is not None:
+                if self._hashes.get(item["url"]) == item["content_hash"]:
+                    self.index_hits += 1
+                    await self._touch_unchanged(item)
+                    return item
+                self.index_misses += 1
+                self._hashes[item["url"]] = item["content_hash"]
+
+            if raw and page is None:
+                page = self.codec.encode(raw)
+            if page:
+                item["raw_html_ref"] = page["_id"]
+                await self.pages.update_one({"_id": page["_id"]}, {"$setOnInsert": page}, upsert=True)
+
+            if self.generation:  # diffed once, at the end of the run
+                await self.books.update_one({"url": item["url"]}, {"$set": dict(item), "$unset": UNSET_INLINE_HTML}, upsert=True)
+                return item
+
+            prev = await self.books.find_one({"url": item["url"]}, DIGEST_PROJECTION)
+            fields = diff_fields(prev, item)
+            if prev and fields is None:
+                prev = await self.books.find_one({"url": item["url"]}, PREV_PROJECTION)
+            elif fields:
+                prev.update(await self.books.find_one({"url": item["url"]}, {f: 1 for f in fields}) or {})
+
+            doc = dict(item)
+            await self.books.update_one({"url": item["url"]}, {"$set": doc, "$unset": UNSET_INLINE_HTML}, upsert=True)
+
+            change = build_change(prev, item, fields=fields)
+            if change:
+                await self.changes.insert_one(change)
         return item
+
+    async def _snapshot(self, item, carried: bool = False):
+        if not self.generation:
+            return
+        self._snapshots.append(snapshot_op(self.generation, item, carried))
+        if len(self._snapshots) >= TOUCH_BATCH_SIZE:
+            await self._flush_snapshots()
+
+    async def _flush_snapshots(self):
+        if not self._snapshots:
+            return
+        ops, self._snapshots = self._snapshots, []
+        await self.db[SNAPSHOTS].bulk_write(ops, ordered=False)
+
+    async def _touch_unchanged(self, item):
+        if not self.touch_unchanged:
+            self.skipped_writes += 1
+            return
+        await self.books.update_one({"url": item["url"]}, {"$set": {"crawled_at": datetime.now(timezone.utc)}})
+        self.touched += 1
@@ -0,0 +1,127 @@
+"""Content-addressed store for raw page HTML.
+
+Pages live in the `pages` collection keyed by the SHA-256 of the raw body, so
+identical pages are stored once and `books` docs only carry `raw_html_ref`.
+Bodies are compressed with zstd, using the newest dictionary from
+`page_dicts` when one has been trained; without the optional `zstandard`
+package they fall back to gzip.
+"""
+
+import gzip
+import hashlib
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+PAGES = "pages"
+DICTS = "page_dicts"
+
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 9
+DICT_SIZE = 112_640  # zstd's default dictionary size (110 KiB)
+
+def page_digest(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+def train_dictionary(samples: list[bytes], size: int = DICT_SIZE) -> dict | None:
+    """Train a zstd dictionary from raw pages; returns a `page_dicts` doc."""
+    if zstandard is None or not samples:
+        return None
+    d = zstandard.train_dictionary(size, samples)
+    return {
+        "_id": d.dict_id(),
+        "data": d.as_bytes(),
+        "size": len(d.as_bytes()),
+        "samples": len(samples),
+        "created_at": datetime.now(timezone.utc),
+    }
+
+def latest_dictionary(db) -> dict | None:
+    return db[DICTS].find_one(sort=[("created_at", -1)])
+
+class PageCodec:
+    """Encodes raw pages into `pages` docs and decodes them back."""
+
+    def __init__(self, dict_doc: dict | None = None, level: int | None = None):
+        self.use_zstd = zstandard is not None
+        if level in (None, ""):
+            level = ZSTD_LEVEL if self.use_zstd else GZIP_LEVEL
+        self.level = int(level)
+        self.dict_id = None
+        self._compressor = None
+        self._dicts: dict[int, object] = {}
+        if self.use_zstd:
+            zdict = None
+            if dict_doc:
+                zdict = self.add_dictionary(dict_doc)
+                self.dict_id = dict_doc["_id"]
+            self._compressor = zstandard.ZstdCompressor(level=self.level, dict_data=zdict)
+
+    def has_dictionary(self, dict_id) -> bool:
+        return dict_id in self._dicts
+
+    def add_dictionary(self, dict_doc: dict):
+        zdict = zstandard.ZstdCompressionDict(bytes(dict_doc["data"]))
+        self._dicts[dict_doc["_id"]] = zdict
+        return zdict
+
+    def encode(self, raw: bytes, digest: str | None = None) -> dict:
+        if self.use_zstd:
+            data, codec = self._compressor.compress(raw), "zstd"
+        else:
+            data, codec = gzip.compress(raw, compresslevel=self.level), "gzip"
+        return {
+            "_id": digest or page_digest(raw),
+            "codec": codec,
+            "dict_id": self.dict_id if codec == "zstd" else None,
+            "data": data,
+            "size": len(raw),
+            "stored_size": len(data),
+            "created_at": datetime.now(timezone.utc),
+        }
+
+    def decode(self, doc: dict) -> bytes:
+        data = bytes(doc["data"])
+        if doc.get("codec") == "gzip":
+            return gzip.decompress(data)
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed pages")
+        zdict = self._dicts.get(doc["dict_id"]) if doc.get("dict_id") else None
+        return zstandard.ZstdDecompressor(dict_data=zdict).decompress(data)
+
+def upsert_op(page: dict) -> UpdateOne:
+    # $setOnInsert: a page that is already stored is never rewritten
+    return UpdateOne({"_id": page["_id"]}, {"$setOnInsert": page}, upsert=True)
+
+class RawHtmlStore:
+    """Blocking `pages` access for the pipeline and offline tools."""
+
+    def __init__(self, db, level: int | None = None):
+        self.pages = db[PAGES]
+        self.dicts = db[DICTS]
+        self.codec = PageCodec(latest_dictionary(db), level=level)
+
+    def encode(self, raw: bytes) -> dict:
+        return self.codec.encode(raw)
+
+    def put(self, page: dict):
+        self.pages.update_one({"_id": page["_id"]}, {"$setOnInsert": page}, upsert=True)
+
+    def put_many(self, pages: list[dict]):
+        if pages:
+            self.pages.bulk_write([upsert_op(p) for p in pages], ordered=False)
+
+    def get(self, digest: str) -> bytes | None:
+        doc = self.pages.find_one({"_id": digest})
+        if not doc:
+            return None
+        dict_id = doc.get("dict_id")
+        if dict_id and not self.codec.has_dictionary(dict_id):
+            dict_doc = self.dicts.find_one({"_id": dict_id})
+            if dict_doc:
+                self.codec.add_dictionary(dict_doc)
+        return self.codec.decode(doc)
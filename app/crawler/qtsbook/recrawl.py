@@ -0,0 +1,207 @@
+"""Adaptive recrawl planning from observed change rates.
+
+A plan has two kinds of unit: a `book` (its detail page) and a `category`
+(its listing pages, refreshed the fast-mode way, which is how new books
+are found). Each unit's change rate, in changes per day, is estimated over
+the last `history_days`:
+
+- book: `update` changes over the time the book has been observed (its
+  first `book_history` point), shrunk towards the pooled rate of its
+  category with a prior worth `prior_days` of observation; the category
+  rate is shrunk towards the catalog's, and that towards DEFAULT_RATE;
+- category: `new` / `removed` changes since the first crawl, shrunk
+  towards the catalog-wide churn rate the same way.
+
+Crawl frequencies follow the square-root rule, f ∝ sqrt(rate / cost), which
+minimises expected staleness for a fixed number of requests. They are
+scaled so one window's crawls fit the request budget and clamped to
+[1/max_hours, 1/min_hours]. The plan is stored in `recrawl_plan` (one doc
+per unit with its rate, interval and next due time), and `select_due`
+picks the most overdue units for one targeted run (`-a mode=targeted`).
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+from pymongo import ReplaceOne, UpdateOne
+
+PLAN = "recrawl_plan"
+HISTORY = "book_history"
+
+LISTING_PAGE_SIZE = 20
+# a change a week, until the data says otherwise
+DEFAULT_RATE = 1 / 7
+# the first crawl reports every book as new; that is not churn
+FIRST_CRAWL_GRACE = timedelta(hours=12)
+
+def _days(delta: timedelta) -> float:
+    return max(delta.total_seconds() / 86400, 0.0)
+
+def _aware(dt: datetime | None) -> datetime | None:
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+def _shrunk(changes: float, days: float, prior: float, prior_days: float) -> float:
+    return (changes + prior_days * prior) / (days + prior_days)
+
+def estimate_units(db, now: datetime, history_days: int = 30, prior_days: float = 7.0) -> list[dict]:
+    """Rate estimates for every book and category in `books`."""
+    since = now - timedelta(days=history_days)
+    seen = {
+        r["_id"]: _aware(r["first"])
+        for r in db[HISTORY].aggregate([
+            {"$match": {"ts": {"$gte": since}}},
+            {"$group": {"_id": "$book", "first": {"$min": "$ts"}}},
+        ])
+    }
+    updates = {
+        r["_id"]: r["n"]
+        for r in db["changes"].aggregate([
+            {"$match": {"change_kind": "update", "changed_at": {"$gte": since}}},
+            {"$group": {"_id": "$url", "n": {"$sum": 1}}},
+        ])
+    }
+    first_seen = max(min(seen.values(), default=now), since)
+    churn = {
+        r["_id"]: r["n"]
+        for r in db["changes"].aggregate([
+            {"$match": {"change_kind": {"$in": ["new", "removed"]}, "changed_at": {"$gt": first_seen + FIRST_CRAWL_GRACE}}},
+            {"$group": {
+                "_id": {"$ifNull": ["$fields_changed.category.new", "$fields_changed.category.prev"]},
+                "n": {"$sum": 1},
+            }},
+        ])
+    }
+
+    books, categories = [], {}
+    for d in db["books"].find({}, {"url": 1, "category": 1, "crawled_at": 1, "_id": 0}):
+        last = _aware(d.get("crawled_at")) or now
+        days = _days(now - (seen.get(d["url"]) or last))
+        books.append({
+            "kind": "book", "key": d["url"], "category": d.get("category"),
+            "changes": updates.get(d["url"], 0), "observed_days": days, "cost": 1, "last_crawled": last,
+        })
+        cat = categories.setdefault(d.get("category"), {"books": 0, "changes": 0, "days": 0.0, "last": last})
+        cat["books"] += 1
+        cat["changes"] += updates.get(d["url"], 0)
+        cat["days"] += days
+        cat["last"] = max(cat["last"], last)
+
+    # book rates pooled per category, category rates pooled catalog-wide
+    catalog_rate = _shrunk(
+        sum(c["changes"] for c in categories.values()), sum(c["days"] for c in categories.values()),
+        DEFAULT_RATE, prior_days,
+    )
+    for cat in categories.values():
+        cat["rate"] = _shrunk(cat["changes"], cat["days"], catalog_rate, prior_days)
+    for b in books:
+        b["rate"] = _shrunk(b["changes"], b["observed_days"], categories[b["category"]]["rate"], prior_days)
+
+    churn_days = _days(now - first_seen - FIRST_CRAWL_GRACE)
+    churn_prior = _shrunk(sum(churn.get(c, 0) for c in categories), len(categories) * churn_days,
+                          DEFAULT_RATE, prior_days)
+    units = books
+    for name, cat in categories.items():
+        n = churn.get(name, 0)
+        units.append({
+            "kind": "category", "key": name, "category": name,
+            "changes": n, "observed_days": churn_days,
+            "cost": max(1, math.ceil(cat["books"] / LISTING_PAGE_SIZE)),
+            "last_crawled": cat["last"],
+            "rate": _shrunk(n, churn_days, churn_prior, prior_days),
+        })
+    return units
+
+def allocate(units: list[dict], budget: int, window_hours: float, min_hours: float, max_hours: float) -> float:
+    """Set `per_day` and `interval_hours` on every unit; returns the planned requests per window."""
+    lo, hi = 24 / max_hours, 24 / min_hours
+    window_days = window_hours / 24
+    weights = [math.sqrt(u["rate"] / u["cost"]) for u in units]
+
+    def spend(k: float) -> float:
+        return window_days * sum(u["cost"] * min(hi, max(lo, k * w)) for u, w in zip(units, weights))
+
+    positive = [w for w in weights if w > 0]
+    if not positive or spend(0) >= budget:
+        k = 0.0
+    elif spend(hi / min(positive)) <= budget:
+        k = hi / min(positive)
+    else:
+        a, b = 0.0, hi / min(positive)
+        for _ in range(60):
+            k = (a + b) / 2
+            a, b = (k, b) if spend(k) <= budget else (a, k)
+        k = a
+    for u, w in zip(units, weights):
+        u["per_day"] = min(hi, max(lo, k * w))
+        u["interval_hours"] = 24 / u["per_day"]
+    return spend(k)
+
+def write_plan(db, units: list[dict], now: datetime, last_crawled: dict | None = None):
+    """Replace `recrawl_plan` with `units`; `last_crawled` overrides per plan id (kept from targeted runs)."""
+    last_crawled = last_crawled or {}
+    ops = []
+    for u in units:
+        _id = f"{u['kind']}:{u['key']}"
+        last = max(u["last_crawled"], last_crawled.get(_id) or u["last_crawled"])
+        ops.append(ReplaceOne({"_id": _id}, {
+            "_id": _id,
+            "kind": u["kind"],
+            "key": u["key"],
+            "category": u["category"],
+            "rate_per_day": round(u["rate"], 5),
+            "changes": u["changes"],
+            "observed_days": round(u["observed_days"], 2),
+            "cost": u["cost"],
+            "interval_hours": round(u["interval_hours"], 2),
+            "last_crawled": last,
+            "next_due": last + timedelta(hours=u["interval_hours"]),
+            "planned_at": now,
+        }, upsert=True))
+    if ops:
+        db[PLAN].bulk_write(ops, ordered=False)
+    db[PLAN].delete_many({"planned_at": {"$lt": now}})
+    db[PLAN].create_index("next_due")
+    db[PLAN].create_index("batch", sparse=True)
+
+def plan(db, now: datetime, budget: int, window_hours: float = 24, min_hours: float = 6, max_hours: float = 336,
+         history_days: int = 30, prior_days: float = 7.0) -> dict:
+    units = estimate_units(db, now, history_days, prior_days)
+    planned = allocate(units, budget, window_hours, min_hours, max_hours)
+    # targeted runs stamp their units; keep whichever of that and crawled_at is later
+    kept = {d["_id"]: _aware(d.get("last_crawled")) for d in db[PLAN].find({}, {"last_crawled": 1})}
+    write_plan(db, units, now, kept)
+    return {
+        "units": len(units),
+        "books": sum(1 for u in units if u["kind"] == "book"),
+        "categories": sum(1 for u in units if u["kind"] == "category"),
+        "planned_requests": round(planned),
+        "budget": budget,
+    }
+
+def select_due(db, now: datetime, cap: int, batch: str) -> list[dict]:
+    """Mark the most overdue units, up to `cap` requests, as `batch`; returns them."""
+    due = list(db[PLAN].find({"next_due": {"$lte": now}}))
+    # expected changes missed so far
+    due.sort(key=lambda d: d["rate_per_day"] * _days(now - _aware(d["last_crawled"])), reverse=True)
+    picked, spent = [], 0
+    for d in due:
+        if picked and spent + d["cost"] > cap:
+            continue
+        picked.append(d)
+        spent += d["cost"]
+    if picked:
+        db[PLAN].update_many({"_id": {"$in": [d["_id"] for d in picked]}}, {"$set": {"batch": batch}})
+    return picked
+
+def mark_crawled(db, batch: str, now: datetime):
+    """After a targeted run: move its units' due times on."""
+    ops = [
+        UpdateOne(
+            {"_id": d["_id"]},
+            {"$set": {"last_crawled": now, "next_due": now + timedelta(hours=d["interval_hours"])},
+             "$unset": {"batch": ""}},
+        )
+        for d in db[PLAN].find({"batch": batch}, {"interval_hours": 1})
+    ]
+    if ops:
+        db[PLAN].bulk_write(ops, ordered=False)
+    return len(ops)
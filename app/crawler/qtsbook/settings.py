@@ -58,25 +58,111 @@ DEFAULT_REQUEST_HEADERS = {
 #SPIDER_MIDDLEWARES = {
 #    "qtsbook.middlewares.QtsbookSpiderMiddleware": 543,
 #}
+SPIDER_MIDDLEWARES = {
+   # closest to the spider, so it times the callbacks alone
+   "qtsbook.extensions.ParseTimingMiddleware": 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "qtsbook.middlewares.QtsbookDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # after HttpCacheMiddleware (900): only sees requests the cache can't answer
+    "qtsbook.middlewares.ConditionalRequestMiddleware": 950,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
+EXTENSIONS = {
+   "qtsbook.extensions.CrawlProfiler": 500,
+   "qtsbook.events.CrawlEventLog": 510,
+}
+# Per-stage latency histograms stored in `crawl_runs` (see qtsbook/extensions.py),
+# with an items/sec sample every PROFILE_INTERVAL_SECS
+PROFILE_ENABLED = os.getenv("QTS_PROFILE", "true").lower() in {"1", "true", "yes", "on"}
+PROFILE_INTERVAL_SECS = float(os.getenv("QTS_PROFILE_INTERVAL_SECS", "10"))
+# Typed crawl events in the capped `crawl_events` collection (qtsbook/events.py),
+# read by the dashboard. Per-type sample rates ("item.scraped=0.01,http.error=0.5"),
+# a minimum level (debug/info/warning/error) and a progress event every N secs
+CRAWL_EVENTS_ENABLED = os.getenv("QTS_CRAWL_EVENTS", "true").lower() in {"1", "true", "yes", "on"}
+CRAWL_EVENTS_SAMPLE = os.getenv("QTS_CRAWL_EVENTS_SAMPLE", "item.scraped=0.01")
+CRAWL_EVENTS_LEVEL = os.getenv("QTS_CRAWL_EVENTS_LEVEL", "info")
+CRAWL_EVENTS_INTERVAL_SECS = float(os.getenv("QTS_CRAWL_EVENTS_INTERVAL_SECS", "30"))
+CRAWL_EVENTS_MAX_MB = int(os.getenv("QTS_CRAWL_EVENTS_MAX_MB", "16"))
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# QTS_MONGO_PIPELINE=qtsbook.pipelines.AsyncMongoPipeline swaps in the motor-backed,
+# non-blocking variant (same change detection; needs the asyncio reactor below)
 ITEM_PIPELINES = {
-   "qtsbook.pipelines.MongoPipeline": 300,
+   "qtsbook.offload.CpuOffloadPipeline": 200,
+   "qtsbook.images.CoverImagesPipeline": 250,
+   os.getenv("QTS_MONGO_PIPELINE", "qtsbook.pipelines.MongoPipeline"): 300,
 }
 
+# Hash + compress raw pages in a worker pool instead of on the reactor thread:
+# "thread", "process" or "off"; at most OFFLOAD_MAX_PENDING_BYTES of raw bodies
+# wait for / sit in the pool at once
+OFFLOAD_MODE = os.getenv("QTS_OFFLOAD_MODE", "thread")
+OFFLOAD_WORKERS = int(os.getenv("QTS_OFFLOAD_WORKERS", "4"))
+OFFLOAD_MAX_PENDING_BYTES = int(os.getenv("QTS_OFFLOAD_MAX_PENDING_MB", "64")) * 1024 * 1024
+# Raw page compression level (zstd 1-22, gzip 1-9); empty = codec default
+RAW_HTML_COMPRESS_LEVEL = os.getenv("QTS_RAW_HTML_COMPRESS_LEVEL") or None
+
+# Buffered Mongo writes: flush every N items or every T ms (0 = write per item)
+MONGO_BATCH_SIZE = int(os.getenv("QTS_MONGO_BATCH_SIZE", "0"))
+MONGO_BATCH_INTERVAL_MS = int(os.getenv("QTS_MONGO_BATCH_INTERVAL_MS", "1000"))
+# Preload url -> content_hash so unchanged books skip the diff and the rewrite;
+# unchanged books then only get crawled_at touched (unless that is turned off)
+MONGO_HASH_INDEX = os.getenv("QTS_MONGO_HASH_INDEX", "true").lower() in {"1", "true", "yes", "on"}
+MONGO_TOUCH_UNCHANGED = os.getenv("QTS_MONGO_TOUCH_UNCHANGED", "true").lower() in {"1", "true", "yes", "on"}
+# The API's `$text` search backend needs the books_text index; the default in-process one does not
+MONGO_TEXT_INDEX = os.getenv("QTS_SEARCH_BACKEND", "memory") == "text"
+# Crawl generations: snapshot every item under the run id and diff the whole run
+# against the previous one when it finishes (also records removed books),
+# instead of diffing item by item; the last MONGO_GENERATIONS_KEEP are kept
+MONGO_GENERATIONS = os.getenv("QTS_CRAWL_GENERATIONS", "false").lower() in {"1", "true", "yes", "on"}
+MONGO_GENERATIONS_KEEP = int(os.getenv("QTS_CRAWL_GENERATIONS_KEEP", "3"))
+# One price/stock/rating point per book per crawl in the `book_history`
+# time-series collection; points older than the retention are expired (0 = keep)
+BOOK_HISTORY_ENABLED = os.getenv("QTS_BOOK_HISTORY", "true").lower() in {"1", "true", "yes", "on"}
+BOOK_HISTORY_RETENTION_DAYS = int(os.getenv("QTS_BOOK_HISTORY_RETENTION_DAYS", "0"))
+# Upper bound on items AsyncMongoPipeline persists concurrently
+MONGO_MAX_INFLIGHT = int(os.getenv("QTS_MONGO_MAX_INFLIGHT", "16"))
+
+# Cover images (qtsbook/images.py): downloaded during the crawl into the
+# content-addressed `images` collection with a WxH JPEG thumbnail (needs
+# Pillow) made by IMAGES_WORKERS threads; a cover URL checked within
+# IMAGES_REVALIDATE_HOURS is not requested again, older ones are revalidated
+IMAGES_ENABLED = os.getenv("QTS_IMAGES", "true").lower() in {"1", "true", "yes", "on"}
+IMAGES_THUMB_SIZE = os.getenv("QTS_IMAGES_THUMB_SIZE", "150x225")
+IMAGES_WORKERS = int(os.getenv("QTS_IMAGES_WORKERS", "2"))
+IMAGES_REVALIDATE_HOURS = float(os.getenv("QTS_IMAGES_REVALIDATE_HOURS", "24"))
+IMAGES_MAX_BYTES = int(os.getenv("QTS_IMAGES_MAX_MB", "5")) * 1024 * 1024
+
+# Detail page extractor (see qtsbook/extract.py): "parsel" walks the product
+# table once, "lxml" skips parsel selectors, "xpath" is the old per-field path
+DETAIL_EXTRACTOR = os.getenv("QTS_DETAIL_EXTRACTOR", "parsel")
+
+# Sharded crawls (scheduler/run_sharded.py): categories leased per worker at a
+# time, lease length (renewed by a heartbeat every third of it) and how many
+# expired leases a category gets before it is marked failed
+FRONTIER_LEASE_BATCH = int(os.getenv("QTS_FRONTIER_LEASE_BATCH", "2"))
+FRONTIER_LEASE_SECS = int(os.getenv("QTS_FRONTIER_LEASE_SECS", "120"))
+FRONTIER_MAX_ATTEMPTS = int(os.getenv("QTS_FRONTIER_MAX_ATTEMPTS", "3"))
+
+# Per-category checkpoints (crawl_jobs / crawl_checkpoints) for full and fast
+# crawls, flushed every CHECKPOINT_INTERVAL_SECS; `-a resume=true` continues
+# the newest unfinished job
+CRAWL_CHECKPOINTS = os.getenv("QTS_CRAWL_CHECKPOINTS", "true").lower() in {"1", "true", "yes", "on"}
+CHECKPOINT_INTERVAL_SECS = int(os.getenv("QTS_CHECKPOINT_INTERVAL_SECS", "5"))
+
+# Site definitions for the multi-site `catalog` spider (qtsbook/sitedefs.py);
+# default: qtsbook/sites/
+SITE_DEFINITIONS_DIR = os.getenv("QTS_SITES_DIR") or None
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
@@ -97,10 +183,22 @@ DOWNLOAD_TIMEOUT = 20
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 HTTPCACHE_ENABLED = True
+# Fallback expiry for requests without a page_type (0 = never expire)
 HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+# Per page type expiry; expired detail pages are revalidated (ETag/Last-Modified)
+HTTPCACHE_TTL_LISTING = int(os.getenv("QTS_CACHE_TTL_LISTING", str(60 * 60)))
+HTTPCACHE_TTL_DETAIL = int(os.getenv("QTS_CACHE_TTL_DETAIL", str(12 * 60 * 60)))
+HTTPCACHE_DIR = "httpcache-gz"  # entries are gzip-compressed; kept apart from the old plain cache
+HTTPCACHE_GZIP = True
+HTTPCACHE_IGNORE_HTTP_CODES = [304]
+HTTPCACHE_STORAGE = "qtsbook.httpcache.TTLCacheStorage"
+
+# Send stored validators with detail requests so unchanged pages come back as 304
+CONDITIONAL_REQUESTS_ENABLED = os.getenv("QTS_CONDITIONAL_REQUESTS", "true").lower() in {"1", "true", "yes", "on"}
+# new validators are saved per this many URLs and every this many seconds
+CONDITIONAL_FLUSH_SIZE = int(os.getenv("QTS_CONDITIONAL_FLUSH_SIZE", "500"))
+CONDITIONAL_FLUSH_INTERVAL_SECS = float(os.getenv("QTS_CONDITIONAL_FLUSH_INTERVAL_SECS", "5"))
 
 # Set settings whose default value is deprecated to a future-proof value
+TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
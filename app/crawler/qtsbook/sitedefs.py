@@ -0,0 +1,156 @@
+"""Declarative site definitions for CatalogSpider.
+
+One YAML file per site in SITE_DEFINITIONS_DIR (qtsbook/sites/ by default):
+
+    name: books_toscrape            # also its download slot
+    source: books.toscrape.com      # stored on its books (default: the name)
+    enabled: true                   # crawled when no sites are named explicitly
+    start_urls: ["https://books.toscrape.com/"]
+    allowed_domains: [books.toscrape.com]
+    throttle:                       # this site's own budget (Scrapy DOWNLOAD_SLOTS)
+      concurrency: 8
+      delay: 0.25
+      randomize_delay: true
+      autothrottle: true            # false: AutoThrottle leaves this site's delay alone
+    listing:
+      categories: ".side_categories ul li ul li a"   # start page -> listing pages (optional)
+      category_name: ".page-header h1::text"        # on the listing page
+      items: "article.product_pod h3 a::attr(href)"
+      next_page: "li.next a::attr(href)"
+    detail:
+      fields:
+        name: {css: "div.product_main h1::text"}
+        rating: {css: "p.star-rating::attr(class)", type: rating}
+
+A field is one `css` or `xpath` expression plus options: `all` (join every
+match, each stripped), `strip`, `default` and `type` (str, int, url,
+rating). `category` defaults to the listing's category name, `url` is the
+page URL. The fields map onto the `books` schema, so every site shares the
+pipeline; fields a site does not define are left out.
+"""
+
+import os
+from pathlib import Path
+from urllib.parse import urljoin, urlparse
+
+import yaml
+
+from qtsbook.extract import parse_rating
+
+SITES_DIR = Path(__file__).resolve().parent / "sites"
+
+BOOK_FIELDS = (
+    "name", "description", "category", "image_url", "rating", "availability",
+    "price_excl_tax", "price_incl_tax", "tax", "num_reviews",
+)
+FIELD_TYPES = ("str", "int", "url", "rating")
+DEFAULT_THROTTLE = {"concurrency": 4, "delay": 0.0, "randomize_delay": True, "autothrottle": True}
+
+class SiteDefinitionError(ValueError):
+    pass
+
+def _convert(value, ftype: str, url: str):
+    if ftype == "int":
+        value = (value or "").strip()
+        return int(value) if value.isdigit() else 0
+    if ftype == "rating":
+        return parse_rating(value or "")
+    if ftype == "url":
+        return urljoin(url, value or "")
+    return value
+
+class FieldSpec:
+    def __init__(self, name: str, spec, where: str):
+        if isinstance(spec, str):
+            spec = {"css": spec}
+        if not isinstance(spec, dict) or len({"css", "xpath"} & spec.keys()) != 1:
+            raise SiteDefinitionError(f"{where}: field {name!r} needs exactly one of css / xpath")
+        self.name = name
+        self.css = spec.get("css")
+        self.xpath = spec.get("xpath")
+        self.all = bool(spec.get("all", False))
+        self.strip = bool(spec.get("strip", False))
+        self.default = spec.get("default")
+        self.type = spec.get("type", "str")
+        if self.type not in FIELD_TYPES:
+            raise SiteDefinitionError(f"{where}: field {name!r} has unknown type {self.type!r}")
+
+    def extract(self, response):
+        sel = response.css(self.css) if self.css else response.xpath(self.xpath)
+        if self.all:
+            value = " ".join(t.strip() for t in sel.getall()).strip()
+        else:
+            value = sel.get()
+            if value is not None and self.strip:
+                value = value.strip()
+        if not value and self.default is not None:
+            value = self.default
+        return _convert(value, self.type, response.url)
+
+class SiteDefinition:
+    def __init__(self, doc: dict, where: str = "<site>"):
+        if not isinstance(doc, dict):
+            raise SiteDefinitionError(f"{where}: expected a mapping")
+        self.name = doc.get("name") or ""
+        if not self.name or not self.name.replace("_", "").replace("-", "").isalnum():
+            raise SiteDefinitionError(f"{where}: `name` must be a simple identifier")
+        self.enabled = bool(doc.get("enabled", True))
+        self.source = doc.get("source") or self.name
+        self.start_urls = list(doc.get("start_urls") or [])
+        if not self.start_urls:
+            raise SiteDefinitionError(f"{where}: `start_urls` is required")
+        self.allowed_domains = list(doc.get("allowed_domains") or {urlparse(u).hostname for u in self.start_urls})
+        self.throttle = {**DEFAULT_THROTTLE, **(doc.get("throttle") or {})}
+
+        listing = doc.get("listing") or {}
+        if not listing.get("items"):
+            raise SiteDefinitionError(f"{where}: `listing.items` is required")
+        self.categories = listing.get("categories")
+        self.category_name = listing.get("category_name")
+        self.items = listing["items"]
+        self.next_page = listing.get("next_page")
+
+        fields = (doc.get("detail") or {}).get("fields") or {}
+        unknown = set(fields) - set(BOOK_FIELDS)
+        if unknown:
+            raise SiteDefinitionError(f"{where}: unknown fields {', '.join(sorted(unknown))}")
+        if "name" not in fields:
+            raise SiteDefinitionError(f"{where}: `detail.fields.name` is required")
+        self.fields = [FieldSpec(k, v, where) for k, v in fields.items()]
+
+    def download_slot(self) -> dict:
+        t = self.throttle
+        return {
+            "concurrency": int(t["concurrency"]),
+            "delay": float(t["delay"]),
+            "randomize_delay": bool(t["randomize_delay"]),
+        }
+
+    def extract(self, response, category: str | None) -> dict:
+        fields = {"url": response.url, "category": category}
+        for f in self.fields:
+            fields[f.name] = f.extract(response)
+        return fields
+
+def load_sites(directory: str | os.PathLike | None = None) -> dict[str, SiteDefinition]:
+    """Every definition in `directory`, by name."""
+    directory = Path(directory or SITES_DIR)
+    sites = {}
+    for path in sorted(directory.glob("*.y*ml")):
+        with open(path, encoding="utf-8") as fh:
+            site = SiteDefinition(yaml.safe_load(fh), where=str(path))
+        if site.name in sites:
+            raise SiteDefinitionError(f"{path}: duplicate site name {site.name!r}")
+        sites[site.name] = site
+    return sites
+
+def select_sites(sites: dict[str, SiteDefinition], names: str | None = None) -> list[SiteDefinition]:
+    """The sites named in `names` (comma-separated), or every enabled one."""
+    if not names:
+        return [s for s in sites.values() if s.enabled]
+    picked = []
+    for name in (n.strip() for n in names.split(",")):
+        if name not in sites:
+            raise SiteDefinitionError(f"unknown site {name!r} (known: {', '.join(sorted(sites))})")
+        picked.append(sites[name])
+    return picked
@@ -1,69 +1,370 @@
-import re
-from urllib.parse import urljoin
+import os
+import socket
 from datetime import datetime, timezone
+from urllib.parse import urlparse
 import scrapy
+from pymongo import MongoClient
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task
+from qtsbook.checkpoints import Checkpoints
+from qtsbook.extract import EXTRACTORS, parse_rating
+from qtsbook.frontier import Frontier
 from qtsbook.items import BookItem
+from qtsbook.recrawl import PLAN
 
 BASE = "https://books.toscrape.com/"
+SOURCE = "books.toscrape.com"
+
+LISTING = {"page_type": "listing"}
+# detail pages may be revalidated; a 304 means "unchanged since last crawl"
+DETAIL = {"page_type": "detail", "handle_httpstatus_list": [304]}
+
+def stock_state(availability: str | None) -> bool:
+    # listing cards say "In stock", detail pages "In stock (22 available)"
+    return (availability or "").strip().lower().startswith("in stock")
 
 class BooksSpider(scrapy.Spider):
+    """Crawls every category, listing page and book.
+
+    `-a mode=fast` is a listing-only refresh: price, stock state and rating
+    are read from the category listings and compared with the stored books;
+    only new books or books whose listing fields differ get a detail request.
+    The rest are passed on as `not_modified` markers.
+
+    `-a mode=targeted -a batch=<id>` crawls only the units the adaptive
+    recrawl scheduler (scheduler/schedule_adaptive.py) put in that batch of
+    `recrawl_plan`: book detail pages directly, and categories through
+    their listings the fast-refresh way.
+
+    Full and fast crawls record per-category checkpoints (see
+    qtsbook/checkpoints.py); `-a resume=true` continues the newest
+    unfinished job of the same mode, skipping completed categories.
+
+    `-a base_url=http://127.0.0.1:8765/` crawls a books.toscrape-shaped
+    mirror instead of the real site (see benchmarks/mirror_server.py).
+
+    `-a frontier=<run_id>` makes the spider one worker of a sharded crawl
+    (see scheduler/run_sharded.py): category links from the home page are
+    seeded into the shared `frontier` collection instead of being followed,
+    and the worker crawls only the categories it leases from there. When it
+    goes idle it acks them and leases more; it stays open while other
+    workers still hold leases, so it can take over those of a worker that
+    died.
+    """
+
     name = "books"
     allowed_domains = ["books.toscrape.com"]
+    sources = [SOURCE]  # what its crawl generations cover
     start_urls = [BASE]
 
-    def parse(self, response):
-        for href in response.css(".side_categories a::attr(href)").getall():
-            href = href.strip()
+    def __init__(self, mode: str = "full", frontier: str | None = None, worker: str | None = None,
+                 batch: str | None = None, resume: str | bool = False, base_url: str | None = None,
+                 *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if base_url:
+            self.start_urls = [base_url]
+            self.allowed_domains = [urlparse(base_url).hostname]
+        if mode not in ("full", "fast", "targeted"):
+            raise ValueError(f"Unknown crawl mode: {mode!r}")
+        if mode == "targeted" and not batch:
+            raise ValueError("mode=targeted needs -a batch=<id>")
+        self.mode = mode
+        self.batch = batch
+        self.listing_index: dict[str, tuple] = {}
+        self.target_categories: set[str] = set()
+        self.resume = str(resume).lower() in {"1", "true", "yes", "on"}
+        self.checkpoints: Checkpoints | None = None
+        self._checkpoint_loop = None
+        self.generation: str | None = None  # set by MongoPipeline when MONGO_GENERATIONS is on
+        self.run_id = frontier
+        self.worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+        self.frontier: Frontier | None = None
+        self.leased: list[str] = []
+        self._mongo = None
+        self._heartbeat = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        name = crawler.settings.get("DETAIL_EXTRACTOR", "parsel")
+        if name not in EXTRACTORS:
+            raise ValueError(f"Unknown DETAIL_EXTRACTOR: {name!r}")
+        spider.extract_detail = EXTRACTORS[name]
+        if spider.run_id:
+            crawler.signals.connect(spider._on_idle, signal=signals.spider_idle)
+        if spider.uses_checkpoints(crawler.settings):
+            crawler.signals.connect(spider._on_item_scraped, signal=signals.item_scraped)
+            crawler.signals.connect(spider._on_item_failed, signal=signals.item_dropped)
+            crawler.signals.connect(spider._on_item_failed, signal=signals.item_error)
+            crawler.signals.connect(spider._on_request_dropped, signal=signals.request_dropped)
+        if spider.run_id or spider.uses_checkpoints(crawler.settings):
+            crawler.signals.connect(spider._on_closed, signal=signals.spider_closed)
+        return spider
+
+    def uses_checkpoints(self, settings) -> bool:
+        # sharded runs track categories in the frontier; targeted runs are too small to resume
+        return settings.getbool("CRAWL_CHECKPOINTS", True) and not self.run_id and self.mode != "targeted"
+
+    @property
+    def listing_refresh(self) -> bool:
+        return self.mode in ("fast", "targeted")
+
+    async def start(self):
+        if self.listing_refresh:
+            self.listing_index = self._load_listing_index()
+            self.logger.info("Fast refresh: comparing listings against %d stored books", len(self.listing_index))
+        if self.run_id:
+            self._open_frontier()
+        if self.uses_checkpoints(self.settings):
+            self._open_checkpoints()
+        if self.mode == "targeted":
+            for request in self._targeted_requests():
+                yield request
+            return
+        for url in self.start_urls:
+            yield scrapy.Request(url, meta=self._listing_meta())
+
+    def _targeted_requests(self):
+        client = MongoClient(self.settings.get("MONGODB_URI"))
+        try:
+            units = list(client[self.settings.get("MONGODB_DB")][PLAN].find(
+                {"batch": self.batch}, {"kind": 1, "key": 1, "category": 1},
+            ))
+        finally:
+            client.close()
+        books = [u for u in units if u["kind"] == "book"]
+        self.target_categories = {u["key"] for u in units if u["kind"] == "category"}
+        self.logger.info("Targeted crawl %s: %d books, %d categories", self.batch, len(books), len(self.target_categories))
+        for u in books:
+            yield scrapy.Request(u["key"], callback=self.parse_detail, cb_kwargs={"category": u.get("category")},
+                                 meta=dict(DETAIL))
+        if self.target_categories:
+            # category URLs are not stored; pick them off the home page by name
+            for url in self.start_urls:
+                yield scrapy.Request(url, meta=self._listing_meta())
+
+    def _listing_meta(self) -> dict:
+        # a fast refresh is only as fresh as its listings: never serve them from cache
+        return {**LISTING, "dont_cache": True} if self.listing_refresh else dict(LISTING)
+
+    def _load_listing_index(self) -> dict[str, tuple]:
+        client = MongoClient(self.settings.get("MONGODB_URI"))
+        try:
+            cursor = client[self.settings.get("MONGODB_DB")]["books"].find(
+                {}, {"url": 1, "price_incl_tax": 1, "availability": 1, "rating": 1, "_id": 0},
+            )
+            return {
+                d["url"]: (d.get("price_incl_tax"), stock_state(d.get("availability")), d.get("rating"))
+                for d in cursor
+            }
+        finally:
+            client.close()
+
+    def _category_links(self, response) -> list[tuple[str, str | None]]:
+        # only the nested categories: the top-level "Books" one lists every book
+        # again, under the wrong category name
+        links = response.css(".side_categories ul li ul li a") or response.css(".side_categories a")
+        categories = []
+        for a in links:
+            href = (a.attrib.get("href") or "").strip()
             if href and "category" in href:
-                yield response.follow(href, callback=self.parse_category)
+                categories.append((response.urljoin(href), (a.css("::text").get() or "").strip() or None))
+        return categories
+
+    def parse(self, response):
+        if self.frontier:
+            yield from self._seed_frontier(response)
+            return
+        categories = self._category_links(response)
+        if self.mode == "targeted":
+            categories = [(url, name) for url, name in categories if name in self.target_categories]
+        if self.checkpoints:
+            self.checkpoints.set_total(len(categories))
+        for url, name in categories:
+            if not self.checkpoints:
+                yield scrapy.Request(url, callback=self.parse_category, meta=self._listing_meta())
+                continue
+            cat = self.checkpoints.category(url, name)
+            if cat.state == "complete":
+                self.crawler.stats.inc_value("checkpoint/categories_skipped")
+                continue
+            if cat.resume_url != url:
+                self.crawler.stats.inc_value("checkpoint/categories_resumed")
+                self.logger.info("Resuming %s at %s", name or url, cat.resume_url)
+            yield scrapy.Request(cat.resume_url, callback=self.parse_category,
+                                 meta={**self._listing_meta(), "checkpoint": url}, dont_filter=True)
+
+    # --- checkpoints -------------------------------------------------------
+
+    def _open_checkpoints(self):
+        s = self.settings
+        if self._mongo is None:
+            self._mongo = MongoClient(s.get("MONGODB_URI"), tz_aware=True)
+        self.checkpoints = Checkpoints.open(
+            self._mongo[s.get("MONGODB_DB")], self.mode, resume=self.resume, generation=self.generation,
+        )
+        self.crawler.stats.set_value("checkpoint/job", self.checkpoints.job_id)
+        self.logger.info(
+            "Checkpoint job %s (%s, %d categories on record)",
+            self.checkpoints.job_id, "resumed" if self.checkpoints.categories else "new", len(self.checkpoints.categories),
+        )
+        self._checkpoint_loop = task.LoopingCall(self.checkpoints.flush)
+        self._checkpoint_loop.start(max(1, s.getint("CHECKPOINT_INTERVAL_SECS", 5)), now=False)
+
+    def _checkpoint_meta(self, response) -> dict:
+        key = response.meta.get("checkpoint")
+        return {"checkpoint": key, "listing": response.url} if key and self.checkpoints else {}
+
+    def _detail_done(self, meta):
+        cat = self.checkpoints.categories.get(meta.get("checkpoint")) if self.checkpoints else None
+        if cat is None or meta.get("page_type") != "detail" or cat.state == "complete":
+            return
+        cat.detail_done(meta["listing"])
+        if cat.state == "complete":
+            self.crawler.stats.inc_value("checkpoint/categories_completed")
+
+    def _on_item_scraped(self, item, response, spider):
+        cat = self.checkpoints.categories.get(response.meta.get("checkpoint")) if self.checkpoints else None
+        if cat:
+            cat.item()
+        self._detail_done(response.meta)
+
+    def _on_item_failed(self, item, response, spider, **kwargs):
+        self._detail_done(response.meta)
+
+    def _on_request_dropped(self, request, spider):
+        # e.g. filtered as a duplicate: the book was already reached through another listing
+        self._detail_done(request.meta)
+
+    def _detail_failed(self, failure):
+        self.logger.warning("Detail request %s failed: %r", failure.request.url, failure.value)
+        self._detail_done(failure.request.meta)
+
+    # --- sharded crawl -----------------------------------------------------
+
+    def _open_frontier(self):
+        s = self.settings
+        self._mongo = MongoClient(s.get("MONGODB_URI"), tz_aware=True)
+        self.frontier = Frontier(
+            self._mongo[s.get("MONGODB_DB")], self.run_id, self.worker,
+            lease_secs=s.getint("FRONTIER_LEASE_SECS", 120),
+            max_attempts=s.getint("FRONTIER_MAX_ATTEMPTS", 3),
+        )
+        self.frontier.ensure_indexes()
+        self._heartbeat = task.LoopingCall(self.frontier.heartbeat)
+        self._heartbeat.start(max(1, s.getint("FRONTIER_LEASE_SECS", 120) // 3), now=False)
+        self.logger.info("Frontier worker %s joined run %s", self.worker, self.run_id)
+
+    def _seed_frontier(self, response):
+        # a top-level "Books" category would also hand the whole crawl to a single worker
+        seeded = self.frontier.seed(self._category_links(response))
+        self.crawler.stats.inc_value("shard/categories_seeded", seeded)
+        yield from self._lease_categories()
+
+    def _lease_categories(self):
+        for _ in range(max(1, self.settings.getint("FRONTIER_LEASE_BATCH", 2)) - len(self.leased)):
+            doc = self.frontier.lease()
+            if doc is None:
+                break
+            self.leased.append(doc["url"])
+            self.crawler.stats.inc_value("shard/categories_leased")
+            if doc["attempts"] > 1:
+                # an earlier lease ran out: its worker died or stalled
+                self.crawler.stats.inc_value("shard/categories_reclaimed")
+                self.logger.info("Taking over %s (attempt %d)", doc["url"], doc["attempts"])
+            # dont_filter: a category can come back to the worker that lost its lease
+            yield scrapy.Request(doc["url"], callback=self.parse_category, meta=self._listing_meta(), dont_filter=True)
+
+    def _on_idle(self, spider):
+        # idle means every request of the leased categories has been handled
+        if self.leased:
+            acked = self.frontier.ack(self.leased)
+            self.crawler.stats.inc_value("shard/categories_acked", acked)
+            self.leased = []
+        requests = list(self._lease_categories())
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests or self.frontier.open_count():
+            # others still hold leases: wait, in case one of them expires
+            raise DontCloseSpider
+
+    def _on_closed(self, spider, reason):
+        if self._heartbeat and self._heartbeat.running:
+            self._heartbeat.stop()
+        if self._checkpoint_loop and self._checkpoint_loop.running:
+            self._checkpoint_loop.stop()
+        if self.checkpoints:
+            status = self.checkpoints.close(reason)
+            self.crawler.stats.set_value("checkpoint/status", status)
+            self.logger.info("Checkpoint job %s %s", self.checkpoints.job_id, status)
+        if self._mongo:
+            self._mongo.close()
 
     def parse_category(self, response):
         category_name = response.css(".page-header h1::text").get() or response.css("h1::text").get()
+        ck = self._checkpoint_meta(response)
+        errback = self._detail_failed if ck else None
 
         # Product cards on the listing page
-        for href in response.css("article.product_pod h3 a::attr(href)").getall():
-            yield response.follow(href, callback=self.parse_detail, cb_kwargs={"category": category_name})
+        if self.listing_refresh:
+            out = list(self._refresh_from_listing(response, category_name, ck))
+        else:
+            out = [
+                response.follow(href, callback=self.parse_detail, errback=errback,
+                                cb_kwargs={"category": category_name}, meta={**DETAIL, **ck})
+                for href in response.css("article.product_pod h3 a::attr(href)").getall()
+            ]
 
         # Category specific pagination
         next_rel = response.css("li.next a::attr(href)").get()
+        if ck:
+            # register the page's detail requests before any of them can come back
+            total = response.css("form.form-horizontal strong::text").get()
+            self.checkpoints.category(ck["checkpoint"], category_name).listing(
+                response.url, response.urljoin(next_rel) if next_rel else None,
+                sum(1 for r in out if isinstance(r, scrapy.Request)),
+                int(total) if total and total.strip().isdigit() else None,
+            )
+        yield from out
+
         if next_rel:
-            yield response.follow(next_rel, callback=self.parse_category)
+            meta = self._listing_meta()
+            if ck:
+                meta["checkpoint"] = ck["checkpoint"]
+            yield response.follow(next_rel, callback=self.parse_category, meta=meta)
+
+    def _refresh_from_listing(self, response, category_name, ck=None):
+        ck = ck or {}
+        stats = self.crawler.stats
+        for pod in response.css("article.product_pod"):
+            href = pod.css("h3 a::attr(href)").get()
+            if not href:
+                continue
+            url = response.urljoin(href)
+            listed = (
+                (pod.css("p.price_color::text").get() or "").strip() or None,
+                stock_state(" ".join(t.strip() for t in pod.css("p.availability ::text").getall())),
+                parse_rating(pod.css("p.star-rating::attr(class)").get("")),
+            )
+            stats.inc_value("fast/listed")
+            if self.listing_index.get(url) == listed:
+                stats.inc_value("fast/unchanged")
+                yield BookItem(url=url, category=category_name, not_modified=True)
+            else:
+                stats.inc_value("fast/scheduled")
+                # the listing already says it changed, so don't let the cache answer
+                yield response.follow(href, callback=self.parse_detail, errback=self._detail_failed if ck else None,
+                                      cb_kwargs={"category": category_name}, meta={**DETAIL, "dont_cache": True, **ck})
 
     def parse_detail(self, response, category):
-        def td(label):
-            xpath = f'//th[normalize-space()="{label}"]/following-sibling::td/text()'
-            return response.xpath(xpath).get()
-
-        price_excl = td("Price (excl. tax)")
-        price_incl = td("Price (incl. tax)")
-        tax = td("Tax")
-        num_reviews = td("Number of reviews") or "0"
-
-        rating_class = response.css("p.star-rating::attr(class)").get("")  # e.g., "star-rating Three"
-        m = re.search(r"star-rating\s+(\w+)", rating_class)
-        rating_name = (m.group(1) if m else "Zero").lower()
-        mapping = {"zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
-        rating = mapping.get(rating_name, 0)
-
-        availability_text = " ".join(t.strip() for t in response.css("div.product_main p.availability ::text").getall()).strip()
-
-        item = BookItem()
-        item["url"] = response.url
-        item["name"] = response.css("div.product_main h1::text").get()
-        item["description"] = (response.css("#product_description ~ p::text").get() or "").strip()
-        item["category"] = category
-        item["image_url"] = urljoin(response.url, response.css("#product_gallery img::attr(src)").get("") or "")
-        item["rating"] = rating
-        item["availability"] = availability_text
-        item["price_excl_tax"] = price_excl
-        item["price_incl_tax"] = price_incl
-        item["tax"] = tax
-        item["num_reviews"] = int(num_reviews) if num_reviews.isdigit() else 0
-
-        item["source"] = "books.toscrape.com"
+        if response.status == 304:
+            yield BookItem(url=response.url, category=category, not_modified=True)
+            return
+
+        item = BookItem(**self.extract_detail(response, category))
+        item["source"] = SOURCE
         item["raw_html"] = response.body
         item["crawled_at"] = datetime.now(timezone.utc)
-
-        print(item)
         yield item
 
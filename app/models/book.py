@@ -9,6 +9,7 @@ class Book(BaseModel):
     description: Optional[str] = None
     category: Optional[str] = None
     image_url: Optional[HttpUrl] = None
+    image_digest: Optional[str] = None  # served at /images/{image_digest}
     rating: int = Field(ge=0, le=5)
     availability: Optional[str] = None
 
@@ -27,19 +28,51 @@ class Book(BaseModel):
         populate_by_name = True
         from_attributes = True
 
+class BookSummary(BaseModel):
+    """The list-view subset of Book: no description, tax breakdown or hashes."""
+    id: str = Field(alias="_id")
+    url: HttpUrl
+    name: str
+    category: Optional[str] = None
+    image_url: Optional[HttpUrl] = None
+    image_digest: Optional[str] = None
+    rating: int = Field(ge=0, le=5)
+    availability: Optional[str] = None
+    price_incl_tax: Optional[str] = None
+    price_incl_tax_num: Optional[float] = None
+    num_reviews: int = 0
+    crawled_at: datetime
+
+    class Config:
+        populate_by_name = True
+        from_attributes = True
+
 class Change(BaseModel):
     id: str = Field(alias="_id")
     url: HttpUrl
     changed_at: datetime
 
-    change_kind: Literal["new", "update"] = "update"
+    change_kind: Literal["new", "update", "removed"] = "update"
     significant: bool = False
     fields_changed: Dict[str, Dict[str, Any]] = {}
     price_delta: Optional[float] = None
 
     prev_hash: Optional[str] = None
-    new_hash: str
+    new_hash: Optional[str] = None  # None for removed books
 
     class Config:
         populate_by_name = True
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class HistoryPoint(BaseModel):
+    """One downsampled bucket of `book_history` (a single point when bucket=raw)."""
+    ts: datetime
+    price_min: Optional[float] = None
+    price_max: Optional[float] = None
+    price_last: Optional[float] = None
+    in_stock_last: Optional[bool] = None
+    stock_min: Optional[int] = None
+    stock_last: Optional[int] = None
+    rating_last: Optional[int] = None
+    points: int = 1
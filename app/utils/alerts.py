@@ -13,6 +13,9 @@ def build_change_summary(db, since_hours: int = 24) -> dict:
     updated_count = db["changes"].count_documents({
         "changed_at": {"$gte": since}, "change_kind": "update"
     })
+    removed_count = db["changes"].count_documents({
+        "changed_at": {"$gte": since}, "change_kind": "removed"
+    })
     significant_count = db["changes"].count_documents({
         "changed_at": {"$gte": since}, "significant": True
     })
@@ -29,6 +32,7 @@ def build_change_summary(db, since_hours: int = 24) -> dict:
         "total": total,
         "new": new_count,
         "updated": updated_count,
+        "removed": removed_count,
         "significant": significant_count,
         "significant_sample": sample,
     }
@@ -39,6 +43,7 @@ def _format_summary_text(summary: dict) -> str:
         f"- Total changes: {summary['total']}",
         f"- New items:     {summary['new']}",
         f"- Updates:       {summary['updated']}",
+        f"- Removed:       {summary['removed']}",
         f"- Significant:   {summary['significant']}",
     ]
     if summary["significant_sample"]:
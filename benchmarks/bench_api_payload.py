@@ -0,0 +1,137 @@
+"""Bytes read from Mongo and bytes sent per /books page, by projection.
+
+    python benchmarks/bench_api_payload.py                      # 2000 books in mongomock
+    python benchmarks/bench_api_payload.py --books 20000 --inline-html 1.0
+    python benchmarks/bench_api_payload.py --mongo mongodb://localhost:27017
+
+Seeds a `books` collection from the saved corpus (benchmarks/corpus/), each
+page extracted and stored the way the pipeline writes it (hashes, price
+numbers, `raw_html_ref`). A fraction of the books (--inline-html) also
+carries `raw_html_gz`, the inline snapshot of books written before the
+`pages` store, which is what an unprojected read drags along. Then pages
+through the collection as /books does and prints, per page, the BSON bytes
+read, the JSON bytes of the response and the time to read and render it:
+
+- `unprojected`: the whole stored document, as before projections,
+- `default`: the Book fields only (every /books response now),
+- `summary`: view=summary,
+- `fields`: fields=id,name,price_incl_tax,image_digest.
+
+The benchmark database is dropped afterwards unless --keep.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CORPUS = Path(__file__).resolve().parent / "corpus"
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "app" / "crawler"))
+
+import bson  # noqa: E402
+from bson import ObjectId  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from scrapy.http import HtmlResponse  # noqa: E402
+
+from app.api.routes_books import BOOK_FIELDS, SUMMARY_FIELDS, _render, _sparse  # noqa: E402
+from qtsbook.extract import extract_detail  # noqa: E402
+from qtsbook.hashing import item_hashes  # noqa: E402
+from qtsbook.pipelines import parse_price_num  # noqa: E402
+
+BASE = "https://books.toscrape.com/catalogue/"
+SPARSE = "id,name,price_incl_tax,image_digest"
+
+def seed(coll, n: int, inline_html: float):
+    pages = [(BASE + p.stem + "/index.html", p.read_bytes()) for p in sorted(CORPUS.glob("*.html"))]
+    if not pages:
+        sys.exit(f"No pages in {CORPUS}")
+    now = datetime.now(timezone.utc)
+    every = round(1 / inline_html) if inline_html > 0 else 0
+    docs = []
+    for i in range(n):
+        url, body = pages[i % len(pages)]
+        item = extract_detail(HtmlResponse(url=url, body=body, encoding="utf-8"), "Books")
+        item["url"] = f"{url}?copy={i}"
+        item["price_incl_tax_num"] = parse_price_num(item.get("price_incl_tax"))
+        item["price_excl_tax_num"] = parse_price_num(item.get("price_excl_tax"))
+        item["content_hash"], item["field_hashes"] = item_hashes(item)
+        item.update({
+            "image_digest": "%064x" % (i % 16),
+            "crawled_at": now - timedelta(seconds=i),
+            "source": "books.toscrape.com",
+            "raw_html_ref": ObjectId(),
+        })
+        if every and i % every == 0:
+            item["raw_html_gz"] = bson.Binary(gzip.compress(body))
+        docs.append(item)
+    coll.insert_many(docs)
+
+def measure(coll, projection, sparse, view: str, page_size: int, pages: int) -> dict:
+    read = sent = 0
+    elapsed = 0.0
+    for p in range(pages):
+        t0 = time.perf_counter()
+        docs = list(coll.find({}, projection).sort("crawled_at", -1).skip(p * page_size).limit(page_size))
+        read += sum(len(bson.encode(d)) for d in docs)
+        items = [_render(d, sparse, view) for d in docs]
+        body = json.dumps(jsonable_encoder({"items": items}), ensure_ascii=False, separators=(",", ":"))
+        elapsed += time.perf_counter() - t0
+        sent += len(body.encode())
+    return {"read_kib": read / pages / 1024, "sent_kib": sent / pages / 1024, "ms": elapsed * 1000 / pages}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--books", type=int, default=2000)
+    ap.add_argument("--inline-html", type=float, default=0.5, help="fraction of books with raw_html_gz inline")
+    ap.add_argument("--page-size", type=int, default=20)
+    ap.add_argument("--pages", type=int, default=50, help="pages read per projection")
+    ap.add_argument("--mongo", default="mock", help="MongoDB URI, or `mock` for mongomock")
+    ap.add_argument("--keep", action="store_true", help="keep the benchmark database")
+    args = ap.parse_args()
+
+    if args.mongo == "mock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongo mock needs mongomock (pip install mongomock), or pass a MongoDB URI")
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo)
+    db = client["qts_bench_payload"]
+    db.drop_collection("books")
+    db["books"].create_index([("crawled_at", 1), ("_id", 1)])
+    seed(db["books"], args.books, args.inline_html)
+    pages = min(args.pages, max(1, args.books // args.page_size))
+
+    runs = {
+        "unprojected": (None, None, "full"),
+        "default": (BOOK_FIELDS, None, "full"),
+        "summary": (SUMMARY_FIELDS, None, "summary"),
+        "fields": (None, _sparse(SPARSE), "full"),
+    }
+    print(f"{args.books} books ({args.inline_html:.0%} with inline HTML), {pages} pages of {args.page_size}")
+    print(f"{'projection':<12} {'read KiB/page':>14} {'sent KiB/page':>14} {'ms/page':>9}")
+    base = None
+    try:
+        for name, (projection, sparse, view) in runs.items():
+            if sparse:
+                projection = dict.fromkeys(sparse, 1)
+            r = measure(db["books"], projection, sparse, view, args.page_size, pages)
+            base = base or r
+            print(
+                f"{name:<12} {r['read_kib']:>14.1f} {r['sent_kib']:>14.1f} {r['ms']:>9.2f}"
+                f"   read x{r['read_kib'] / base['read_kib']:.3f}, sent x{r['sent_kib'] / base['sent_kib']:.3f}"
+            )
+    finally:
+        if not args.keep:
+            client.drop_database("qts_bench_payload")
+
+
+if __name__ == "__main__":
+    main()
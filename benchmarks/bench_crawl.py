@@ -0,0 +1,231 @@
+"""End-to-end crawl benchmark against the local mirror (benchmarks/mirror_server.py).
+
+    python benchmarks/bench_crawl.py                                  # 1000 books, CONCURRENT_REQUESTS 8/16/32
+    python benchmarks/bench_crawl.py --concurrency 4 16 64 --latency-ms 30 --jitter-ms 10
+    python benchmarks/bench_crawl.py --mongo mongodb://localhost:27017 --mode fast
+
+Starts the mirror in its own process, then runs a full `BooksSpider` crawl
+with the project's pipelines (offload, MongoPipeline) once per
+CONCURRENT_REQUESTS value, each in a fresh process and a fresh database.
+AutoThrottle, robots.txt, the HTTP cache and conditional requests are off,
+so runs differ only in the setting under test. Cover downloads are off too
+unless `--images`.
+
+`--mongo mock` (the default) keeps the data in mongomock, which must be
+installed; the book history is off there (no time-series collections) and
+Mongo command timings are not recorded. Point `--mongo` at a real server
+to include Mongo in the measurement; the benchmark databases are dropped
+afterwards unless `--keep`.
+
+Prints pages/sec, items/sec, peak RSS and the p50/p90 per-stage times
+from the crawl profiler (download, parse, pipeline) for each run.
+"""
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+SCRAPY_ROOT = REPO_ROOT / "app" / "crawler"
+HERE = Path(__file__).resolve().parent
+
+sys.path.insert(0, str(HERE))
+from mirror_server import add_arguments  # noqa: E402
+
+# qtsbook modules that open their own MongoClient
+MONGO_MODULES = (
+    "qtsbook.pipelines", "qtsbook.middlewares", "qtsbook.offload",
+    "qtsbook.extensions", "qtsbook.events", "qtsbook.images", "qtsbook.spiders.books_spider",
+)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _wait_for(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    sys.exit(f"mirror server did not come up on port {port}")
+
+def _use_mongomock():
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit("--mongo mock needs mongomock (pip install mongomock), or pass a MongoDB URI")
+    import importlib
+    from types import SimpleNamespace
+    from pymongo import InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        # mongomock's own bulk_write breaks on the options newer pymongo passes along
+        upserted = modified = 0
+        for op in requests:
+            if isinstance(op, InsertOne):
+                self.insert_one(op._doc)
+            elif isinstance(op, (UpdateOne, UpdateMany, ReplaceOne)):
+                fn = {UpdateOne: self.update_one, UpdateMany: self.update_many, ReplaceOne: self.replace_one}[type(op)]
+                r = fn(op._filter, op._doc, upsert=op._upsert)
+                upserted += r.upserted_id is not None
+                modified += r.modified_count
+            else:
+                raise NotImplementedError(type(op).__name__)
+        return SimpleNamespace(upserted_count=upserted, modified_count=modified)
+
+    mongomock.Collection.bulk_write = bulk_write
+    shared = mongomock.MongoClient()
+
+    class Client:
+        # every MongoClient(...) in the crawl shares one in-memory server
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getitem__(self, name):
+            return shared[name]
+
+        def close(self):
+            pass
+
+    for name in MONGO_MODULES:
+        importlib.import_module(name).MongoClient = Client
+
+def run_child(cfg: dict) -> dict:
+    """One crawl in this process; returns its measurements."""
+    sys.path.insert(0, str(SCRAPY_ROOT))
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "qtsbook.settings")
+    os.chdir(SCRAPY_ROOT)
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.setdict({
+        "LOG_LEVEL": cfg["log_level"],
+        "CONCURRENT_REQUESTS": cfg["concurrency"],
+        "CONCURRENT_REQUESTS_PER_DOMAIN": cfg["concurrency"],
+        "AUTOTHROTTLE_ENABLED": False,
+        "ROBOTSTXT_OBEY": False,
+        "DOWNLOAD_DELAY": 0,
+        "HTTPCACHE_ENABLED": False,
+        "CONDITIONAL_REQUESTS_ENABLED": False,
+        "IMAGES_ENABLED": cfg["images"],
+        "MONGODB_URI": cfg["mongo"] if cfg["mongo"] != "mock" else "mongodb://mock",
+        "MONGODB_DB": cfg["db"],
+    }, priority="cmdline")
+    if cfg["mongo"] == "mock":
+        _use_mongomock()
+        settings.set("BOOK_HISTORY_ENABLED", False, priority="cmdline")
+
+    from qtsbook.spiders.books_spider import BooksSpider
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BooksSpider)
+    process.crawl(crawler, mode=cfg["mode"], base_url=cfg["base_url"])
+    t0 = time.perf_counter()
+    process.start()
+    wall = time.perf_counter() - t0
+
+    stats = crawler.stats.get_stats()
+    elapsed = stats.get("elapsed_time_seconds") or wall
+    pages = stats.get("downloader/response_count", 0)
+    items = stats.get("item_scraped_count", 0)
+    result = {
+        "concurrency": cfg["concurrency"],
+        "pages": pages,
+        "items": items,
+        "elapsed_secs": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 1) if elapsed else 0.0,
+        "items_per_sec": round(items / elapsed, 1) if elapsed else 0.0,
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "errors": stats.get("log_count/ERROR", 0),
+        "stages": {k[len("profile/"):]: v for k, v in stats.items() if k.startswith("profile/")},
+    }
+    if cfg["mongo"] != "mock" and not cfg["keep"]:
+        from pymongo import MongoClient
+        client = MongoClient(cfg["mongo"])
+        client.drop_database(cfg["db"])
+        client.close()
+    return result
+
+def _fmt(v) -> str:
+    return "-" if v is None else f"{v:.1f}"
+
+def print_results(results: list[dict]):
+    print(f"\n{'conc':>5} {'pages/s':>8} {'items/s':>8} {'RSS MiB':>8}  "
+          f"{'download p50/p90':>17} {'parse p50/p90':>14} {'pipeline p50/p90':>17} {'mongo ms':>9}")
+    for r in results:
+        s = r["stages"]
+        print(
+            f"{r['concurrency']:>5} {r['pages_per_sec']:>8.1f} {r['items_per_sec']:>8.1f} {r['peak_rss_mib']:>8.1f}  "
+            f"{_fmt(s.get('download_p50_ms')) + '/' + _fmt(s.get('download_p90_ms')):>17} "
+            f"{_fmt(s.get('parse_p50_ms')) + '/' + _fmt(s.get('parse_p90_ms')):>14} "
+            f"{_fmt(s.get('pipeline_p50_ms')) + '/' + _fmt(s.get('pipeline_p90_ms')):>17} "
+            f"{_fmt(s.get('mongo_ms')):>9}"
+            + (f"   {r['errors']} errors" if r["errors"] else "")
+        )
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        print("RESULT " + json.dumps(run_child(json.loads(sys.argv[2]))), flush=True)
+        return
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(ap)
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[8, 16, 32], help="CONCURRENT_REQUESTS values")
+    ap.add_argument("--mode", choices=("full", "fast"), default="full", help="crawl mode")
+    ap.add_argument("--mongo", default="mock", help='"mock" (mongomock) or a MongoDB URI')
+    ap.add_argument("--images", action="store_true", help="download cover images during the crawl")
+    ap.add_argument("--keep", action="store_true", help="keep the benchmark databases")
+    ap.add_argument("--log-level", default="WARNING")
+    ap.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = ap.parse_args()
+
+    port = _free_port()
+    mirror = subprocess.Popen([
+        sys.executable, str(HERE / "mirror_server.py"), "--port", str(port),
+        "--books", str(args.books), "--categories", str(args.categories), "--seed", str(args.seed),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        *(["--recorded"] if args.recorded else []),
+    ], stdout=subprocess.DEVNULL)
+    results = []
+    try:
+        _wait_for(port)
+        print(f"Mirror: {args.books} books, {args.categories} categories, "
+              f"latency {args.latency_ms:g}±{args.jitter_ms:g} ms on port {port}; mongo: {args.mongo}")
+        for c in args.concurrency:
+            cfg = {
+                "concurrency": c, "mode": args.mode, "base_url": f"http://127.0.0.1:{port}/",
+                "mongo": args.mongo, "db": f"qtsbook_bench_{c}_{os.getpid()}", "keep": args.keep,
+                "images": args.images, "log_level": args.log_level,
+            }
+            out = subprocess.run([sys.executable, __file__, "--child", json.dumps(cfg)],
+                                 stdout=subprocess.PIPE, text=True)
+            line = next((ln for ln in out.stdout.splitlines() if ln.startswith("RESULT ")), None)
+            if line is None:
+                print(f"CONCURRENT_REQUESTS={c}: crawl failed (exit {out.returncode})")
+                continue
+            r = json.loads(line[len("RESULT "):])
+            results.append(r)
+            print(f"CONCURRENT_REQUESTS={c}: {r['pages']} pages, {r['items']} items in {r['elapsed_secs']:.1f}s")
+    finally:
+        mirror.terminate()
+        mirror.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
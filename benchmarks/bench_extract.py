@@ -0,0 +1,111 @@
+"""Detail-page extractor benchmark over the saved corpus in benchmarks/corpus/.
+
+    python benchmarks/bench_extract.py                 # all extractors, 50 rounds
+    python benchmarks/bench_extract.py --rounds 200 --only parsel lxml
+
+For each extractor prints pages/sec and the tracemalloc peak per page, then
+checks that every extractor builds the same BookItem for every page (exits
+non-zero if they differ). Each page gets a fresh HtmlResponse per round, so
+document parsing is part of the measured cost, as it is in the spider.
+"""
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CORPUS = Path(__file__).resolve().parent / "corpus"
+sys.path.insert(0, str(REPO_ROOT / "app" / "crawler"))
+
+from scrapy.http import HtmlResponse  # noqa: E402
+
+from qtsbook.extract import EXTRACTORS  # noqa: E402
+from qtsbook.items import BookItem  # noqa: E402
+
+BASE = "https://books.toscrape.com/catalogue/"
+CATEGORY = "Books"
+
+def load_corpus() -> list[tuple[str, bytes]]:
+    pages = [(BASE + p.stem + "/index.html", p.read_bytes()) for p in sorted(CORPUS.glob("*.html"))]
+    if not pages:
+        sys.exit(f"No pages in {CORPUS}")
+    return pages
+
+def _responses(pages):
+    return [HtmlResponse(url=url, body=body, encoding="utf-8") for url, body in pages]
+
+def run_once(extract, pages) -> list[BookItem]:
+    return [BookItem(**extract(r, CATEGORY)) for r in _responses(pages)]
+
+def bench(extract, pages, rounds: int) -> dict:
+    run_once(extract, pages)  # warm up (lxml parser cache, cssselect translation cache)
+
+    gc.collect()
+    elapsed = 0.0
+    for _ in range(rounds):
+        responses = _responses(pages)
+        t0 = time.perf_counter()
+        for r in responses:
+            BookItem(**extract(r, CATEGORY))
+        elapsed += time.perf_counter() - t0
+
+    gc.collect()
+    responses = _responses(pages)
+    tracemalloc.start()
+    peak = 0
+    for r in responses:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        BookItem(**extract(r, CATEGORY))
+        _, p = tracemalloc.get_traced_memory()
+        peak = max(peak, p - base)
+    tracemalloc.stop()
+
+    n = rounds * len(pages)
+    return {"pages_per_sec": n / elapsed, "ms_per_page": elapsed * 1000 / n, "peak_kib": peak / 1024}
+
+def check_identical(names, pages) -> list[str]:
+    outputs = {name: run_once(EXTRACTORS[name], pages) for name in names}
+    ref_name, ref = names[0], outputs[names[0]]
+    problems = []
+    for name in names[1:]:
+        for (url, _), a, b in zip(pages, ref, outputs[name]):
+            if dict(a) != dict(b):
+                fields = sorted(k for k in set(a) | set(b) if a.get(k) != b.get(k))
+                problems.append(f"{name} != {ref_name} for {url}: {', '.join(fields)}")
+    return problems
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rounds", type=int, default=50, help="passes over the corpus per extractor")
+    ap.add_argument("--only", nargs="+", choices=sorted(EXTRACTORS), help="extractors to run")
+    args = ap.parse_args()
+
+    names = args.only or list(EXTRACTORS)
+    pages = load_corpus()
+    print(f"{len(pages)} pages, {sum(len(b) for _, b in pages) / 1024:.0f} KiB, {args.rounds} rounds")
+    print(f"{'extractor':<10} {'pages/s':>10} {'ms/page':>9} {'peak KiB/page':>14}")
+    base_rate = None
+    for name in names:
+        r = bench(EXTRACTORS[name], pages, args.rounds)
+        base_rate = base_rate or r["pages_per_sec"]
+        print(
+            f"{name:<10} {r['pages_per_sec']:>10.0f} {r['ms_per_page']:>9.3f} {r['peak_kib']:>14.1f}"
+            f"   x{r['pages_per_sec'] / base_rate:.2f}"
+        )
+
+    if len(names) > 1:
+        problems = check_identical(names, pages)
+        if problems:
+            print("\nExtractors disagree:")
+            for p in problems:
+                print("  " + p)
+            sys.exit(1)
+        print(f"\nOK: {', '.join(names)} produce identical BookItems for all {len(pages)} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Search latency for /books?q= as the catalog grows.
+
+    python benchmarks/bench_search.py                           # 10k and 100k books
+    python benchmarks/bench_search.py --sizes 1000000 --queries 50
+    python benchmarks/bench_search.py --mongo mongodb://localhost:27017
+
+Makes a synthetic catalog from the words of the books in the saved corpus
+(benchmarks/corpus/): every book gets a 2-6 word name, a category and a
+40-word description, with a long tail of made-up words so the vocabulary
+grows with the catalog as a real one does. For each size it prints the
+build time and size of the in-process index (app/api/search.py) and the
+median and p95 latency of these queries:
+
+- `regex`: the old filter, an unanchored case-insensitive regex over every
+  name (what `{"$regex": q, "$options": "i"}` makes Mongo do per search),
+- `word`, `two words`: exact words, one common and one rarer,
+- `prefix`: the first letters of a word, as typed,
+- `typo`: a word with two letters swapped.
+
+With --mongo the same catalog is also loaded into MongoDB and timed with
+the `$regex` filter and with `$text` on the books_text index (20 results,
+like a page). That database is dropped afterwards unless --keep.
+"""
+
+import argparse
+import itertools
+import random
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from bson import ObjectId
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CORPUS = Path(__file__).resolve().parent / "corpus"
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(REPO_ROOT / "app" / "crawler"))
+
+from scrapy.http import HtmlResponse  # noqa: E402
+
+from app.api.search import SearchIndex, tokenize  # noqa: E402
+from qtsbook.extract import extract_detail  # noqa: E402
+from qtsbook.pipelines import TEXT_INDEX, TEXT_INDEX_OPTIONS  # noqa: E402
+
+CATEGORIES = ["Poetry", "Travel", "Mystery", "Historical Fiction", "Science", "Fantasy", "Romance", "Horror"]
+
+def vocabulary() -> list[str]:
+    """Words of the corpus books' names and descriptions, most frequent first."""
+    counts: Counter = Counter()
+    for page in sorted(CORPUS.glob("*.html")):
+        response = HtmlResponse(url="https://books.toscrape.com/" + page.name, body=page.read_bytes(), encoding="utf-8")
+        item = extract_detail(response, "Books")
+        counts.update(w for w in tokenize(f"{item.get('name')} {item.get('description')}") if len(w) > 2)
+    if not counts:
+        sys.exit(f"No pages in {CORPUS}")
+    return [w for w, _ in counts.most_common()]
+
+def catalog(n: int, words: list[str], rng: random.Random) -> list[dict]:
+    # a Zipf-ish pick: a few words common, most of them rare; one in ten is made up
+    cum = list(itertools.accumulate(1 / (i + 10) for i in range(len(words))))
+    made_up = max(100, n // 20)
+
+    def word():
+        if rng.random() < 0.1:
+            return "w%x" % rng.randrange(made_up)
+        return rng.choices(words, cum_weights=cum)[0]
+
+    return [
+        {
+            "_id": ObjectId(),
+            "name": " ".join(word().title() for _ in range(rng.randint(2, 6))),
+            "category": rng.choice(CATEGORIES),
+            "description": " ".join(word() for _ in range(40)),
+        }
+        for _ in range(n)
+    ]
+
+def queries(docs: list[dict], rng: random.Random, k: int) -> dict[str, list[str]]:
+    names = [tokenize(d["name"]) for d in rng.sample(docs, k)]
+    long = [[w for w in ws if len(w) >= 5] or ["novel"] for ws in names]
+    return {
+        "regex": [ws[0] for ws in names],
+        "word": [ws[0] for ws in names],
+        "two words": [" ".join(ws[:2]) for ws in names],
+        "prefix": [ws[0][:3] for ws in long],
+        "typo": [ws[0][:1] + ws[0][2] + ws[0][1] + ws[0][3:] for ws in long],
+    }
+
+def timed(fn, qs: list[str]) -> tuple[float, float, float]:
+    """(median ms, p95 ms, mean hits)."""
+    ms, hits = [], []
+    for q in qs:
+        t0 = time.perf_counter()
+        hits.append(fn(q))
+        ms.append((time.perf_counter() - t0) * 1000)
+    ms.sort()
+    return statistics.median(ms), ms[min(len(ms) - 1, int(len(ms) * 0.95))], statistics.mean(hits)
+
+def regex_scan(docs: list[dict]):
+    names = [d["name"] for d in docs]
+    return lambda q: sum(1 for name in names if re.search(q, name, re.I))
+
+def row(label: str, median: float, p95: float, hits: float):
+    print(f"  {label:<14} {median:>10.2f} {p95:>10.2f} {hits:>10.0f}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="10000,100000", help="comma-separated catalog sizes")
+    ap.add_argument("--queries", type=int, default=200, help="queries timed per kind")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--mongo", default=None, help="also time $regex and $text on this MongoDB")
+    ap.add_argument("--keep", action="store_true", help="keep the benchmark database")
+    args = ap.parse_args()
+
+    words = vocabulary()
+    client = None
+    if args.mongo:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo)
+    try:
+        for n in (int(s) for s in args.sizes.split(",")):
+            rng = random.Random(args.seed)
+            docs = catalog(n, words, rng)
+            index = SearchIndex.build(docs)
+            qs = queries(docs, rng, args.queries)
+            postings = sum(len(ids) for ids, _ in index._postings.values())
+            print(
+                f"{n} books: index built in {index.build_secs:.1f}s, {index.terms} terms, "
+                f"{postings} postings (~{postings * 8 / 2**20:.0f} MiB of arrays)"
+            )
+            print(f"  {'query':<14} {'median ms':>10} {'p95 ms':>10} {'hits':>10}")
+            row("regex", *timed(regex_scan(docs), qs["regex"]))
+            for kind in ("word", "two words", "prefix", "typo"):
+                row(kind, *timed(lambda q: len(index.search(q)[0]), qs[kind]))
+
+            if client is not None:
+                coll = client["qts_bench_search"]["books"]
+                coll.drop()
+                coll.insert_many(docs)
+                coll.create_index(TEXT_INDEX, **TEXT_INDEX_OPTIONS)
+                few = qs["word"][: max(1, args.queries // 10)]
+                row("mongo $regex", *timed(
+                    lambda q: len(list(coll.find({"name": {"$regex": q, "$options": "i"}}, {"_id": 1}).limit(20))), few))
+                row("mongo $text", *timed(
+                    lambda q: len(list(coll.find({"$text": {"$search": q}}, {"_id": 1}).limit(20))), few))
+            del docs, index
+    finally:
+        if client is not None and not args.keep:
+            client.drop_database("qts_bench_search")
+
+
+if __name__ == "__main__":
+    main()
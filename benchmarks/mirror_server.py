@@ -0,0 +1,261 @@
+"""Local books.toscrape-shaped site for crawl benchmarks.
+
+    python benchmarks/mirror_server.py                                  # 1000 books on :8765
+    python benchmarks/mirror_server.py --books 5000 --categories 50 --latency-ms 40 --jitter-ms 20
+    python benchmarks/mirror_server.py --recorded                       # detail pages from the corpus
+
+Serves a home page with the category sidebar, paginated category listings
+(20 books a page, "N results", `li.next`) and book detail pages with the
+markup the spider reads. The catalog is generated from `--seed`, so two
+servers with the same arguments serve the same site. `--recorded` serves
+the saved real pages in benchmarks/corpus/ as detail pages (round robin,
+with each book's name and price swapped in), so detail parsing costs what
+it does against the real site. Cover images (/media/...) are a small set
+of generated PNGs shared between books, with an ETag that a matching
+If-None-Match turns into a 304. Every response is held back by
+`--latency-ms` ± `--jitter-ms` to stand in for the network.
+"""
+
+import argparse
+import hashlib
+import html
+import random
+import re
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+CORPUS = Path(__file__).resolve().parent / "corpus"
+PAGE_SIZE = 20
+COVERS = 16  # distinct cover images; books share them round robin
+RATINGS = ("One", "Two", "Three", "Four", "Five")
+WORDS = (
+    "light attic velvet secret river night garden stone winter glass city shadow "
+    "house letter summer road silence fire island mirror dream storm ocean paper"
+).split()
+
+H1_RE = re.compile(rb"<h1>.*?</h1>", re.S)
+PRICE_RE = re.compile(rb"\xc2\xa3\d+\.\d\d")  # "£47.82" in UTF-8
+
+class Catalog:
+    """A deterministic synthetic catalog: categories, books and their rendered pages."""
+
+    def __init__(self, books: int = 1000, categories: int = 50, seed: int = 1, recorded: bool = False):
+        rng = random.Random(seed)
+        self.categories = [(f"{rng.choice(WORDS).title()} {i + 1}", f"category-{i + 1}_{i + 2}")
+                           for i in range(max(1, categories))]
+        self.books = []
+        self.by_category: dict[str, list[dict]] = {slug: [] for _, slug in self.categories}
+        for n in range(books):
+            name, slug = self.categories[n % len(self.categories)]
+            title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+            stock = rng.choice((0, rng.randint(1, 22)))
+            book = {
+                "slug": f"{title.lower().replace(' ', '-')}_{n + 1}",
+                "title": title,
+                "category": name,
+                "category_slug": slug,
+                "price": f"{rng.uniform(10, 60):.2f}",
+                "stock": stock,
+                "rating": rng.choice(RATINGS),
+                "reviews": rng.randint(0, 3),
+                "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + ".",
+            }
+            self.books.append(book)
+            self.by_category[slug].append(book)
+        self.by_slug = {b["slug"]: b for b in self.books}
+        self.recorded = [p.read_bytes() for p in sorted(CORPUS.glob("*.html"))] if recorded else []
+
+    def home(self) -> bytes:
+        links = "".join(
+            f'<li><a href="catalogue/category/books/{slug}/index.html">{html.escape(name)}</a></li>'
+            for name, slug in self.categories
+        )
+        return _page("All products", (
+            '<div class="side_categories"><ul class="nav nav-list"><li>'
+            f'<a href="catalogue/category/books_1/index.html">Books</a><ul>{links}</ul></li></ul></div>'
+        ))
+
+    def listing(self, slug: str, page: int) -> bytes | None:
+        books = self.by_category.get(slug)
+        if books is None or page < 1 or (page - 1) * PAGE_SIZE >= max(len(books), 1):
+            return None
+        name = next(n for n, s in self.categories if s == slug)
+        pods = "".join(
+            '<li><article class="product_pod">'
+            f'<p class="star-rating {b["rating"]}"></p>'
+            f'<h3><a href="../../../{b["slug"]}/index.html" title="{html.escape(b["title"])}">{html.escape(b["title"])}</a></h3>'
+            f'<div class="product_price"><p class="price_color">£{b["price"]}</p>'
+            f'<p class="{"instock" if b["stock"] else "outofstock"} availability">'
+            f'{"In stock" if b["stock"] else "Out of stock"}</p></div></article></li>'
+            for b in books[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        )
+        pager = f'<li class="next"><a href="page-{page + 1}.html">next</a></li>' if page * PAGE_SIZE < len(books) else ""
+        return _page(name, (
+            f'<div class="page-header action"><h1>{html.escape(name)}</h1></div>'
+            f'<form method="get" class="form-horizontal"><strong>{len(books)}</strong> results.</form>'
+            f'<ol class="row">{pods}</ol><ul class="pager">{pager}</ul>'
+        ))
+
+    def detail(self, slug: str) -> bytes | None:
+        b = self.by_slug.get(slug)
+        if b is None:
+            return None
+        if self.recorded:
+            body = self.recorded[(int(slug.rsplit("_", 1)[1]) - 1) % len(self.recorded)]
+            body = H1_RE.sub(f"<h1>{html.escape(b['title'])}</h1>".encode(), body, count=1)
+            return PRICE_RE.sub(f"£{b['price']}".encode(), body)
+        availability = f"In stock ({b['stock']} available)" if b["stock"] else "Out of stock"
+        rows = (
+            ("UPC", hashlib.md5(slug.encode()).hexdigest()[:16]), ("Product Type", "Books"),
+            ("Price (excl. tax)", f"£{b['price']}"), ("Price (incl. tax)", f"£{b['price']}"), ("Tax", "£0.00"),
+            ("Availability", availability), ("Number of reviews", str(b["reviews"])),
+        )
+        table = "".join(f"<tr><th>{k}</th><td>{v}</td></tr>" for k, v in rows)
+        return _page(b["title"], (
+            '<ul class="breadcrumb"><li><a href="../../index.html">Home</a></li>'
+            '<li><a href="../category/books_1/index.html">Books</a></li>'
+            f'<li><a href="../category/books/{b["category_slug"]}/index.html">{html.escape(b["category"])}</a></li>'
+            f'<li class="active">{html.escape(b["title"])}</li></ul>'
+            '<article class="product_page"><div class="row">'
+            f'<div class="col-sm-6"><div id="product_gallery"><img src="../../media/cache/{slug}.jpg" /></div></div>'
+            f'<div class="col-sm-6 product_main"><h1>{html.escape(b["title"])}</h1>'
+            f'<p class="price_color">£{b["price"]}</p>'
+            f'<p class="{"instock" if b["stock"] else "outofstock"} availability"><i class="icon-ok"></i>\n    {availability}\n</p>'
+            f'<p class="star-rating {b["rating"]}"></p></div></div>'
+            '<div id="product_description" class="sub-header"><h2>Product Description</h2></div>'
+            f'<p>{html.escape(b["description"])}</p>'
+            f'<table class="table table-striped">{table}</table></article>'
+        ))
+
+def _png(width: int, height: int, rgb: tuple[int, int, int]) -> bytes:
+    """A solid-colour RGB PNG with a lighter band, built without an imaging library."""
+    band = tuple(min(255, c + 80) for c in rgb)
+    rows = b"".join(
+        b"\x00" + bytes(band if height // 3 <= y < height // 2 else rgb) * width for y in range(height)
+    )
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+def cover(path: str) -> bytes:
+    n = int(hashlib.md5(path.encode()).hexdigest(), 16) % COVERS
+    return _png(200, 300, ((n * 53) % 256, (n * 97) % 256, (n * 151) % 256))
+
+def _page(title: str, content: str) -> bytes:
+    return (
+        '<!DOCTYPE html><html lang="en-us"><head><meta http-equiv="content-type" content="text/html; charset=UTF-8" />'
+        f"<title>{html.escape(title)} | Books to Scrape - Sandbox</title></head>"
+        f'<body><div class="container-fluid page"><div class="page_inner">{content}</div></div></body></html>'
+    ).encode("utf-8")
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    catalog: Catalog = None
+    latency = 0.0
+    jitter = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _route(self) -> bytes | None:
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/index.html"):
+            return self.catalog.home()
+        if path == "/robots.txt":
+            return b"User-agent: *\nAllow: /\n"
+        if path.startswith("/media/"):
+            return cover(path)
+        parts = path.strip("/").split("/")
+        # /catalogue/category/books/<slug>/index.html | page-N.html
+        if len(parts) == 5 and parts[:3] == ["catalogue", "category", "books"]:
+            page = 1 if parts[4] == "index.html" else int(parts[4][5:-5]) if re.fullmatch(r"page-\d+\.html", parts[4]) else 0
+            return self.catalog.listing(parts[3], page)
+        # /catalogue/<slug>/index.html
+        if len(parts) == 3 and parts[0] == "catalogue" and parts[2] == "index.html":
+            return self.catalog.detail(parts[1])
+        return None
+
+    def do_GET(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        body = self._route()
+        if body is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/media/"):
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            ctype = "image/png"
+        else:
+            etag = None
+            ctype = "text/plain" if self.path == "/robots.txt" else "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MirrorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def make_server(catalog: Catalog, host: str = "127.0.0.1", port: int = 8765,
+                latency_ms: float = 0.0, jitter_ms: float = 0.0) -> MirrorServer:
+    handler = type("Handler", (MirrorHandler,), {
+        "catalog": catalog, "latency": latency_ms / 1000, "jitter": jitter_ms / 1000,
+    })
+    return MirrorServer((host, port), handler)
+
+def serve_in_thread(server: MirrorServer) -> threading.Thread:
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    return t
+
+def add_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--books", type=int, default=1000, help="catalog size")
+    ap.add_argument("--categories", type=int, default=50, help="number of categories")
+    ap.add_argument("--seed", type=int, default=1, help="catalog seed")
+    ap.add_argument("--recorded", action="store_true", help="serve corpus pages as detail pages")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="uniform ± jitter on the latency")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(ap)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    args = ap.parse_args()
+
+    catalog = Catalog(args.books, args.categories, args.seed, args.recorded)
+    server = make_server(catalog, args.host, args.port, args.latency_ms, args.jitter_ms)
+    print(
+        f"Serving {len(catalog.books)} books in {len(catalog.categories)} categories on "
+        f"http://{args.host}:{args.port}/ (latency {args.latency_ms:g}±{args.jitter_ms:g} ms)",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Re-extract stored books from their raw HTML, without touching the network.
+
+    python -m scheduler.backfill --dry-run              # diff stored fields against a re-parse
+    python -m scheduler.backfill                        # write the fields that differ
+    python -m scheduler.backfill --workers 8 --category Poetry
+
+Pages are streamed out of the `pages` store (or the legacy inline
+`raw_html_gz`) and decompressed and parsed in a process pool, with the
+detail extractor the spider uses (DETAIL_EXTRACTOR, or --extractor).
+Derived fields and hashes are recomputed the way the pipeline does, and
+only the fields that changed are written back, in bulk batches. A
+backfill fixes the stored extraction: it records no `changes` and leaves
+`crawled_at` alone. Throughput is reported in pages/sec per core.
+"""
+
+import os
+import sys
+import gzip
+import time
+import argparse
+from collections import Counter
+from datetime import timezone
+from multiprocessing import Pool
+from pymongo import MongoClient, UpdateOne
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCRAPY_ROOT = os.path.join(REPO_ROOT, "app", "crawler")
+if SCRAPY_ROOT not in sys.path:
+    sys.path.insert(0, SCRAPY_ROOT)
+
+from scrapy.http import HtmlResponse  # noqa: E402
+from qtsbook.extract import EXTRACTORS  # noqa: E402
+from qtsbook.hashing import item_hashes  # noqa: E402
+from qtsbook.pipelines import bump_epoch, parse_price_num  # noqa: E402
+from qtsbook.rawstore import DICTS, PAGES, PageCodec  # noqa: E402
+
+# what a detail page yields (see extract._fields) plus what the pipeline derives from it
+EXTRACTED_FIELDS = (
+    "name", "description", "category", "image_url", "rating", "availability",
+    "price_excl_tax", "price_incl_tax", "tax", "num_reviews",
+)
+DERIVED_FIELDS = ("price_incl_tax_num", "price_excl_tax_num", "content_hash", "field_hashes")
+PROJECTION = {"url": 1, "raw_html_ref": 1, "raw_html_gz": 1, **{f: 1 for f in EXTRACTED_FIELDS + DERIVED_FIELDS}}
+
+# worker-side state, set by the pool initializer
+_CODEC = None
+_EXTRACT = None
+
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def _init_worker(dict_docs: list[dict], extractor: str):
+    global _CODEC, _EXTRACT
+    _CODEC = PageCodec()
+    if _CODEC.use_zstd:
+        for d in dict_docs:
+            _CODEC.add_dictionary(d)
+    _EXTRACT = EXTRACTORS[extractor]
+
+def derive(fields: dict) -> dict:
+    """Add what the pipeline derives from the extracted fields (prepare_item)."""
+    fields["price_incl_tax_num"] = parse_price_num(fields.get("price_incl_tax"))
+    fields["price_excl_tax_num"] = parse_price_num(fields.get("price_excl_tax"))
+    fields["content_hash"], fields["field_hashes"] = item_hashes(fields)
+    return fields
+
+def reparse(task: tuple) -> tuple:
+    """(book _id, url, category, page doc or gzip blob) -> (book _id, fields or None, error, CPU s)."""
+    book_id, url, category, page = task
+    t0 = time.process_time()
+    try:
+        raw = gzip.decompress(page) if isinstance(page, bytes) else _CODEC.decode(page)
+        fields = derive(_EXTRACT(HtmlResponse(url=url, body=raw), category))
+        fields.pop("url", None)
+        return book_id, fields, None, time.process_time() - t0
+    except Exception as e:
+        return book_id, None, f"{type(e).__name__}: {e}", time.process_time() - t0
+
+def iter_tasks(db, query: dict, batch_size: int, limit: int, stats: Counter):
+    """Stream (book, page) tasks; pages are fetched one `$in` per batch of books."""
+    query = {**query, "$or": [{"raw_html_ref": {"$exists": True}}, {"raw_html_gz": {"$exists": True}}]}
+    cursor = db["books"].find(query, {"url": 1, "category": 1, "raw_html_ref": 1, "raw_html_gz": 1})
+    cursor = cursor.batch_size(batch_size).limit(limit)
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield from _batch_tasks(db, batch, stats)
+            batch = []
+    yield from _batch_tasks(db, batch, stats)
+
+def _batch_tasks(db, books: list[dict], stats: Counter):
+    refs = {d["raw_html_ref"] for d in books if d.get("raw_html_ref")}
+    pages = {p["_id"]: p for p in db[PAGES].find({"_id": {"$in": list(refs)}})} if refs else {}
+    for d in books:
+        page = pages.get(d.get("raw_html_ref")) or d.get("raw_html_gz")
+        if page is None:
+            stats["missing_page"] += 1
+            continue
+        stats["raw_bytes"] += page["size"] if isinstance(page, dict) else len(page)
+        yield d["_id"], d["url"], d.get("category"), page
+
+def diff(stored: dict, fields: dict, only: set | None = None) -> dict:
+    """{field: (stored, re-parsed)} for the fields that differ; with `only`, the
+    other extracted fields keep their stored values and the hashes follow."""
+    if only is not None:
+        fields = derive({**{f: stored.get(f) for f in EXTRACTED_FIELDS}, **{f: fields.get(f) for f in only}})
+    d = {f: (stored.get(f), v) for f, v in fields.items() if stored.get(f) != v}
+    return d if set(d) - set(DERIVED_FIELDS) else {}
+
+def backfill(db, workers: int, batch_size: int, extractor: str, dry_run: bool, query: dict | None = None,
+             limit: int = 0, only: set | None = None, show: int = 0) -> dict:
+    stats = Counter(pages=0, changed=0, unchanged=0, missing_page=0, errors=0, raw_bytes=0)
+    changed_fields = Counter()
+    ops, pending = [], {}
+    cpu = 0.0
+    shown = 0
+
+    def flush():
+        # the diff needs the stored values; the task stream only carries the pages
+        stored = {d["_id"]: d for d in db["books"].find({"_id": {"$in": list(pending)}}, PROJECTION)}
+        nonlocal shown
+        for book_id, fields in pending.items():
+            doc = stored.get(book_id)
+            if doc is None:
+                continue
+            d = diff(doc, fields, only)
+            if not d:
+                stats["unchanged"] += 1
+                continue
+            stats["changed"] += 1
+            changed_fields.update(f for f in d if f != "field_hashes")
+            if dry_run and shown < show:
+                shown += 1
+                print(f"~ {doc['url']}")
+                for f, (old, new) in d.items():
+                    if f not in ("content_hash", "field_hashes"):
+                        print(f"    {f}: {old!r} -> {new!r}")
+            if not dry_run:
+                ops.append(UpdateOne({"_id": book_id}, {"$set": {f: new for f, (_, new) in d.items()}}))
+        if ops:
+            db["books"].bulk_write(ops, ordered=False)
+            ops.clear()
+        pending.clear()
+
+    dict_docs = list(db[DICTS].find())
+    t0 = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(dict_docs, extractor)) as pool:
+        tasks = iter_tasks(db, query or {}, batch_size, limit, stats)
+        for book_id, fields, error, secs in pool.imap_unordered(reparse, tasks, chunksize=16):
+            stats["pages"] += 1
+            cpu += secs
+            if error:
+                stats["errors"] += 1
+                print(f"  {book_id}: {error}")
+                continue
+            pending[book_id] = fields
+            if len(pending) >= batch_size:
+                flush()
+                print(f"  re-parsed {stats['pages']} pages…")
+        if pending:
+            flush()
+    wall = time.perf_counter() - t0
+    if stats["changed"] and not dry_run:
+        bump_epoch(db)  # the API's cached responses and search index predate these fields
+
+    return {
+        **stats,
+        "fields": dict(changed_fields.most_common()),
+        "wall_secs": wall,
+        "cpu_secs": cpu,
+        "pages_per_sec": stats["pages"] / wall if wall else 0.0,
+        # per core: against the pool's wall time and against the CPU the workers actually spent
+        "pages_per_sec_per_core": stats["pages"] / wall / workers if wall else 0.0,
+        "pages_per_cpu_sec": stats["pages"] / cpu if cpu else 0.0,
+    }
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="parser processes")
+    ap.add_argument("--batch", type=int, default=500, help="books per page fetch and per bulk write")
+    ap.add_argument("--extractor", choices=sorted(EXTRACTORS),
+                    default=os.getenv("QTS_DETAIL_EXTRACTOR", "parsel"), help="detail extractor")
+    ap.add_argument("--fields", help="comma-separated fields to backfill (default: all extracted fields)")
+    ap.add_argument("--category", help="only books of this category")
+    ap.add_argument("--limit", type=int, default=0, help="stop after this many books")
+    ap.add_argument("--dry-run", action="store_true", help="diff only, write nothing")
+    ap.add_argument("--show", type=int, default=20, help="diffs printed by --dry-run")
+    args = ap.parse_args()
+
+    only = None
+    if args.fields:
+        only = {f.strip() for f in args.fields.split(",") if f.strip()}
+        unknown = only - set(EXTRACTED_FIELDS)
+        if unknown:
+            ap.error(f"unknown fields: {', '.join(sorted(unknown))}")
+
+    client, db = _get_db_sync()
+    try:
+        r = backfill(
+            db, max(1, args.workers), max(1, args.batch), args.extractor, args.dry_run,
+            query={"category": args.category} if args.category else None,
+            limit=max(0, args.limit), only=only, show=args.show,
+        )
+    finally:
+        client.close()
+
+    verb = "would update" if args.dry_run else "updated"
+    print(
+        f"Re-parsed {r['pages']} pages ({r['raw_bytes'] / 1024 / 1024:.1f} MiB HTML) with {args.workers} workers "
+        f"in {r['wall_secs']:.1f}s: {r['pages_per_sec']:.0f} pages/s, "
+        f"{r['pages_per_sec_per_core']:.0f} pages/s per core ({r['pages_per_cpu_sec']:.0f} per CPU second)"
+    )
+    print(f"{verb} {r['changed']} books, {r['unchanged']} unchanged, "
+          f"{r['missing_page']} without a stored page, {r['errors']} parse errors")
+    for f, n in r["fields"].items():
+        print(f"  {f:<20} {n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Compare crawl profiles stored in `crawl_runs` and flag regressions.
+
+    python scheduler/crawl_profile.py                  # last 10 runs, side by side
+    python scheduler/crawl_profile.py --check          # exit 1 if the latest run regressed
+    python scheduler/crawl_profile.py --check --threshold 0.5 --baseline 5
+
+`--check` compares the latest run against the median of the `--baseline`
+runs before it (same spider and mode): a stage whose p90 grew, or an
+items/sec that fell, by more than `--threshold` is reported.
+"""
+
+import os
+import sys
+import argparse
+from statistics import median
+from datetime import timezone
+from pymongo import MongoClient
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+RUNS = "crawl_runs"
+STAGES = ("download_ms", "parse_ms", "pipeline_ms")
+
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def _p90(run: dict, stage: str) -> float | None:
+    return (run.get("histograms", {}).get(stage) or {}).get("p90")
+
+def _mongo_ms(run: dict) -> float:
+    return sum(h.get("sum") or 0.0 for h in run.get("mongo", {}).values())
+
+def _fmt(v, spec=".1f") -> str:
+    return "-" if v is None else format(v, spec)
+
+def print_runs(runs: list[dict]):
+    print(f"{'started':<20} {'mode':<5} {'items':>6} {'items/s':>8} "
+          f"{'dl p90':>8} {'parse p90':>9} {'pipe p90':>9} {'mongo ms':>9}")
+    for r in runs:
+        print(
+            f"{r['started_at']:%Y-%m-%d %H:%M:%S} {(r.get('mode') or '-'):<5} {r.get('items', 0):>6} "
+            f"{_fmt(r.get('items_per_sec')):>8} {_fmt(_p90(r, 'download_ms')):>8} "
+            f"{_fmt(_p90(r, 'parse_ms'), '.2f'):>9} {_fmt(_p90(r, 'pipeline_ms')):>9} {_mongo_ms(r):>9.0f}"
+        )
+
+def find_regressions(latest: dict, baseline: list[dict], threshold: float) -> list[str]:
+    problems = []
+    for stage in STAGES:
+        before = [v for v in (_p90(r, stage) for r in baseline) if v is not None]
+        now = _p90(latest, stage)
+        if before and now is not None and median(before) > 0 and now > median(before) * (1 + threshold):
+            problems.append(f"{stage} p90 {now:.2f} vs median {median(before):.2f}")
+    rates = [r["items_per_sec"] for r in baseline if r.get("items_per_sec")]
+    if rates and latest.get("items_per_sec", 0) < median(rates) * (1 - threshold):
+        problems.append(f"items/sec {latest.get('items_per_sec', 0):.2f} vs median {median(rates):.2f}")
+    return problems
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--limit", type=int, default=10, help="runs to list")
+    ap.add_argument("--check", action="store_true", help="compare the latest run with earlier ones")
+    ap.add_argument("--baseline", type=int, default=5, help="earlier runs to compare against")
+    ap.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown")
+    args = ap.parse_args()
+
+    client, db = _get_db_sync()
+    try:
+        runs = list(db[RUNS].find({"kind": "crawl"}).sort("started_at", -1).limit(args.limit))
+        if not runs:
+            print("No crawl profiles in crawl_runs yet.")
+            return
+        print_runs(list(reversed(runs)))
+
+        if args.check:
+            latest = runs[0]
+            baseline = list(db[RUNS].find({
+                "kind": "crawl", "spider": latest["spider"], "mode": latest.get("mode"),
+                "started_at": {"$lt": latest["started_at"]},
+            }).sort("started_at", -1).limit(args.baseline))
+            if not baseline:
+                print("No earlier runs to compare against.")
+                return
+            problems = find_regressions(latest, baseline, args.threshold)
+            if problems:
+                print(f"\nRegression in run started {latest['started_at']:%Y-%m-%d %H:%M:%S}:")
+                for p in problems:
+                    print(f"  {p}")
+                sys.exit(1)
+            print(f"\nNo regression against the previous {len(baseline)} runs.")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
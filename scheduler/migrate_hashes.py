@@ -0,0 +1,101 @@
+"""Rehash stored books (and generation snapshots) with the canonical blake2b scheme.
+
+    python -m scheduler.migrate_hashes             # rehash docs still on the old scheme
+    python -m scheduler.migrate_hashes --dry-run   # only count what would change
+    python -m scheduler.migrate_hashes --force     # rehash everything
+
+Books without `field_hashes` are otherwise diffed on their full document
+and miss the content_hash index once. Snapshots written before
+`description` was hashed take it from the current book.
+"""
+
+import os
+import sys
+import argparse
+from datetime import timezone
+from pymongo import MongoClient, UpdateOne
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCRAPY_ROOT = os.path.join(REPO_ROOT, "app", "crawler")
+if SCRAPY_ROOT not in sys.path:
+    sys.path.insert(0, SCRAPY_ROOT)
+
+from qtsbook.hashing import HASHED_FIELDS, is_current, item_hashes  # noqa: E402
+from qtsbook.pipelines import SNAPSHOTS, bump_epoch  # noqa: E402
+
+PROJECTION = {"content_hash": 1, "field_hashes": 1, **{f: 1 for f in HASHED_FIELDS}}
+
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def rehash(coll, batch_size: int, force: bool, dry_run: bool, query=None, fill=None) -> dict:
+    """Rehash the docs of `coll` that need it; `fill(doc)` may supply missing fields first."""
+    seen = updated = 0
+    ops = []
+    projection = PROJECTION | ({"url": 1} if fill else {})
+    for doc in coll.find(query or {}, projection).batch_size(batch_size):
+        seen += 1
+        if not force and is_current(doc):
+            continue
+        extra = fill(doc) if fill else {}
+        content_hash, field_hashes = item_hashes(doc | extra)
+        updated += 1
+        if dry_run:
+            continue
+        ops.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {**extra, "content_hash": content_hash, "field_hashes": field_hashes}},
+        ))
+        if len(ops) >= batch_size:
+            coll.bulk_write(ops, ordered=False)
+            ops = []
+            print(f"  {coll.name}: rehashed {updated} docs…")
+    if ops:
+        coll.bulk_write(ops, ordered=False)
+    return {"seen": seen, "updated": updated}
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--batch", type=int, default=1000, help="docs per bulk write")
+    ap.add_argument("--force", action="store_true", help="rehash docs already on the current scheme")
+    ap.add_argument("--dry-run", action="store_true", help="count, change nothing")
+    args = ap.parse_args()
+
+    client, db = _get_db_sync()
+    try:
+        books = rehash(db["books"], args.batch, args.force, args.dry_run)
+        if books["updated"] and not args.dry_run:
+            bump_epoch(db)  # cached ETags and responses carry the old hashes
+
+        descriptions = {}
+        def fill(snap):
+            if "description" in snap:
+                return {}
+            if not descriptions:
+                descriptions.update(
+                    (d["url"], d.get("description")) for d in db["books"].find({}, {"url": 1, "description": 1, "_id": 0})
+                )
+            return {"description": descriptions.get(snap["url"])}
+        # carried rows without fields get theirs from the previous generation at finalize
+        snaps = rehash(db[SNAPSHOTS], args.batch, args.force, args.dry_run,
+                       query={"content_hash": {"$ne": None}}, fill=fill)
+
+        verb = "would rehash" if args.dry_run else "rehashed"
+        print(f"books: {verb} {books['updated']} of {books['seen']}")
+        print(f"snapshots: {verb} {snaps['updated']} of {snaps['seen']}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Move inline `raw_html_gz` snapshots into the content-addressed `pages` store.
+
+    python -m scheduler.migrate_raw_html             # train dictionary (if none) + migrate
+    python -m scheduler.migrate_raw_html --retrain   # train a fresh dictionary first
+    python -m scheduler.migrate_raw_html --report    # only print current sizes
+"""
+
+import os
+import sys
+import gzip
+import argparse
+from datetime import timezone
+from pymongo import MongoClient, UpdateOne
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCRAPY_ROOT = os.path.join(REPO_ROOT, "app", "crawler")
+if SCRAPY_ROOT not in sys.path:
+    sys.path.insert(0, SCRAPY_ROOT)
+
+from qtsbook.pipelines import bump_epoch  # noqa: E402
+from qtsbook.rawstore import (  # noqa: E402
+    DICTS, PAGES, RawHtmlStore, latest_dictionary, page_digest, train_dictionary,
+)
+
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def _fmt_bytes(n: float) -> str:
+    if n < 1024:
+        return f"{n:.0f} B"
+    for unit in ("KiB", "MiB"):
+        n /= 1024
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+    return f"{n / 1024:.1f} GiB"
+
+def _sum(db, coll: str, pipeline: list) -> dict:
+    rows = list(db[coll].aggregate(pipeline))
+    return rows[0] if rows else {}
+
+def collect_sizes(db) -> dict:
+    inline = _sum(db, "books", [
+        {"$match": {"raw_html_gz": {"$exists": True}}},
+        {"$group": {"_id": None, "n": {"$sum": 1}, "bytes": {"$sum": {"$binarySize": "$raw_html_gz"}}}},
+    ])
+    refs = _sum(db, "books", [
+        {"$match": {"raw_html_ref": {"$exists": True}}},
+        {"$group": {"_id": None, "n": {"$sum": 1}}},
+    ])
+    pages = _sum(db, PAGES, [
+        {"$group": {"_id": None, "n": {"$sum": 1}, "raw": {"$sum": "$size"}, "stored": {"$sum": "$stored_size"}}},
+    ])
+    dicts = _sum(db, DICTS, [{"$group": {"_id": None, "n": {"$sum": 1}, "bytes": {"$sum": "$size"}}}])
+    return {
+        "inline_docs": inline.get("n", 0),
+        "inline_bytes": inline.get("bytes", 0),
+        "ref_docs": refs.get("n", 0),
+        "pages": pages.get("n", 0),
+        "pages_raw_bytes": pages.get("raw", 0),
+        "pages_stored_bytes": pages.get("stored", 0),
+        "dict_bytes": dicts.get("bytes", 0),
+    }
+
+def print_sizes(sizes: dict):
+    print(f"books with inline raw_html_gz: {sizes['inline_docs']} ({_fmt_bytes(sizes['inline_bytes'])})")
+    print(f"books with raw_html_ref:       {sizes['ref_docs']}")
+    print(
+        f"pages store:                   {sizes['pages']} unique pages, "
+        f"{_fmt_bytes(sizes['pages_raw_bytes'])} raw -> {_fmt_bytes(sizes['pages_stored_bytes'])} stored "
+        f"(+{_fmt_bytes(sizes['dict_bytes'])} dictionaries)"
+    )
+
+def train(db, samples: int) -> dict | None:
+    bodies = []
+    for doc in db["books"].aggregate([
+        {"$match": {"raw_html_gz": {"$exists": True}}},
+        {"$sample": {"size": samples}},
+        {"$project": {"raw_html_gz": 1}},
+    ]):
+        bodies.append(gzip.decompress(doc["raw_html_gz"]))
+    if len(bodies) < samples:
+        store = RawHtmlStore(db)
+        for doc in db[PAGES].aggregate([{"$sample": {"size": samples - len(bodies)}}, {"$project": {"_id": 1}}]):
+            bodies.append(store.get(doc["_id"]))
+    dict_doc = train_dictionary(bodies)
+    if dict_doc:
+        db[DICTS].update_one({"_id": dict_doc["_id"]}, {"$setOnInsert": dict_doc}, upsert=True)
+        print(f"Trained zstd dictionary {dict_doc['_id']} ({_fmt_bytes(dict_doc['size'])}) from {len(bodies)} pages")
+    return dict_doc
+
+def migrate(db, batch_size: int) -> dict:
+    store = RawHtmlStore(db)
+    moved = inline_bytes = 0
+    digests = set()
+
+    def flush(pages: dict, ops: list):
+        store.put_many(list(pages.values()))
+        if ops:
+            db["books"].bulk_write(ops, ordered=False)
+
+    pages, ops = {}, []
+    cursor = db["books"].find({"raw_html_gz": {"$exists": True}}, {"raw_html_gz": 1}).batch_size(batch_size)
+    for doc in cursor:
+        blob = doc["raw_html_gz"]
+        raw = gzip.decompress(blob)
+        digest = page_digest(raw)
+        if digest not in digests:
+            pages[digest] = store.codec.encode(raw, digest)
+            digests.add(digest)
+        ops.append(UpdateOne(
+            {"_id": doc["_id"]},
+            {"$set": {"raw_html_ref": digest}, "$unset": {"raw_html_gz": ""}},
+        ))
+        moved += 1
+        inline_bytes += len(blob)
+        if len(ops) >= batch_size:
+            flush(pages, ops)
+            pages, ops = {}, []
+            print(f"  migrated {moved} books…")
+    flush(pages, ops)
+    return {"moved": moved, "inline_bytes": inline_bytes, "unique_pages": len(digests)}
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--batch", type=int, default=200, help="books per bulk write")
+    ap.add_argument("--train-samples", type=int, default=500, help="pages sampled for the zstd dictionary")
+    ap.add_argument("--retrain", action="store_true", help="train a new dictionary even if one exists")
+    ap.add_argument("--report", action="store_true", help="only report sizes, change nothing")
+    args = ap.parse_args()
+
+    client, db = _get_db_sync()
+    try:
+        before = collect_sizes(db)
+        print("Before:")
+        print_sizes(before)
+        if args.report:
+            return
+
+        if args.retrain or latest_dictionary(db) is None:
+            train(db, args.train_samples)
+
+        result = migrate(db, args.batch)
+        if result["moved"]:
+            bump_epoch(db)  # the books were rewritten under the API's cached responses
+        after = collect_sizes(db)
+        print("After:")
+        print_sizes(after)
+
+        old = before["inline_bytes"] + before["pages_stored_bytes"] + before["dict_bytes"]
+        new = after["inline_bytes"] + after["pages_stored_bytes"] + after["dict_bytes"]
+        saved = old - new
+        pct = (saved / old * 100) if old else 0.0
+        print(
+            f"Migrated {result['moved']} books into {result['unique_pages']} unique pages; "
+            f"raw HTML storage {_fmt_bytes(old)} -> {_fmt_bytes(new)} "
+            f"(saved {_fmt_bytes(max(saved, 0))}, {pct:.1f}%)"
+        )
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from pathlib import Path
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
 from qtsbook.spiders.books_spider import BooksSpider
+from qtsbook.spiders.catalog_spider import CatalogSpider
 
 REPO_ROOT = Path(__file__).resolve().parent.parent
 SCRAPY_ROOT = REPO_ROOT / "app" / "crawler"
@@ -19,18 +20,24 @@ def main():
     settings = get_project_settings()
     settings.set("LOG_LEVEL", os.getenv("QTS_LOG_LEVEL", "INFO"), priority="cmdline")
 
+    # continue the newest unfinished job from its category checkpoints (crawl_jobs)
     resume = os.getenv("QTS_SCRAPY_RESUME", "false").lower() in {"1","true","yes","on"}
-    if resume:
-        jobdir = REPO_ROOT / "app" / ".job" / "books"
-        jobdir.mkdir(parents=True, exist_ok=True)
-        settings.set("JOBDIR", str(jobdir), priority="cmdline")
 
     os.environ.setdefault("QTS_MONGODB_URI", "mongodb://mongo:27017")
     os.environ.setdefault("QTS_MONGODB_DB", "qtsbook")
 
 
+    # "full" revisits every book; "fast" only fetches books whose listing changed
+    mode = os.getenv("QTS_CRAWL_MODE", "full").lower()
+
+    # QTS_CRAWL_SITES=all|<name>,<name>: crawl the site definitions in qtsbook/sites/ instead
+    sites = os.getenv("QTS_CRAWL_SITES", "").strip()
+
     process = CrawlerProcess(settings)
-    process.crawl(BooksSpider)
+    if sites:
+        process.crawl(CatalogSpider, sites=None if sites == "all" else sites)
+    else:
+        process.crawl(BooksSpider, mode=mode, resume=resume)
     process.start()
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""Sharded crawl: K worker processes split the categories through a shared frontier.
+
+    python scheduler/run_sharded.py                     # one worker per core
+    python scheduler/run_sharded.py --workers 4
+    python scheduler/run_sharded.py --resume <run_id>   # finish a run's leftover categories
+
+Every worker runs BooksSpider with `frontier=<run_id>`; the categories are
+leased from the `frontier` collection (see qtsbook/frontier.py). When all
+workers are done the per-worker Scrapy stats are merged into one run
+summary, printed and stored in `crawl_runs` next to the workers' merged
+latency histograms.
+"""
+
+import os
+import sys
+import time
+import uuid
+import queue
+import argparse
+import multiprocessing as mp
+from pathlib import Path
+from datetime import datetime, timezone
+from pymongo import MongoClient
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SCRAPY_ROOT = REPO_ROOT / "app" / "crawler"
+if str(SCRAPY_ROOT) not in sys.path:
+    sys.path.insert(0, str(SCRAPY_ROOT))
+
+from qtsbook.extensions import RUNS, merge_profiles  # noqa: E402
+from qtsbook.frontier import Frontier  # noqa: E402
+from qtsbook.pipelines import bump_epoch, finalize_generation  # noqa: E402
+
+def _worker(run_id: str, worker: str, mode: str, results):
+    os.chdir(SCRAPY_ROOT)
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from qtsbook.spiders.books_spider import BooksSpider
+
+    settings = get_project_settings()
+    settings.set("LOG_LEVEL", os.getenv("QTS_LOG_LEVEL", "INFO"), priority="cmdline")
+    settings.set("LOG_FORMAT", f"%(asctime)s [{worker}] [%(name)s] %(levelname)s: %(message)s", priority="cmdline")
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(BooksSpider)
+    process.crawl(crawler, mode=mode, frontier=run_id, worker=worker)
+    process.start()
+    results.put((worker, crawler.stats.get_stats()))
+
+def _project_settings():
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "qtsbook.settings")
+    from scrapy.utils.project import get_project_settings
+    return get_project_settings()
+
+def merge_stats(per_worker: dict[str, dict]) -> dict:
+    """Sum counters across workers; maxima stay maxima, ratios are recomputed."""
+    total: dict = {}
+    for stats in per_worker.values():
+        for k, v in stats.items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)) or k.endswith("ratio"):
+                continue
+            if k.endswith("_max") or k.endswith("/max") or k == "elapsed_time_seconds":
+                total[k] = max(total.get(k, v), v)
+            else:
+                total[k] = total.get(k, 0) + v
+    hits, misses = total.get("httpcache/hit", 0), total.get("httpcache/miss", 0)
+    if hits + misses:
+        total["httpcache/hit_ratio"] = round(hits / (hits + misses), 4)
+    return total
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(REPO_ROOT / ".env")
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", type=int, default=int(os.getenv("QTS_SHARD_WORKERS", "0")) or os.cpu_count() or 2)
+    ap.add_argument("--mode", default=os.getenv("QTS_CRAWL_MODE", "full").lower(), choices=["full", "fast"])
+    ap.add_argument("--resume", metavar="RUN_ID", help="continue an earlier run instead of starting a new one")
+    args = ap.parse_args()
+
+    os.environ.setdefault("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    os.environ.setdefault("QTS_MONGODB_DB", "qtsbook")
+
+    run_id = args.resume or f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+    started_at = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    print(f"[sharded] run {run_id}: {args.workers} workers, mode={args.mode}")
+
+    # spawn: every worker gets a fresh interpreter with its own reactor
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    procs = {}
+    for i in range(args.workers):
+        name = f"w{i}"
+        procs[name] = ctx.Process(target=_worker, args=(run_id, name, args.mode, results), name=name)
+        procs[name].start()
+
+    per_worker: dict[str, dict] = {}
+    # drain while waiting: a child blocks on exit until its queued stats are read
+    while len(per_worker) < len(procs) and any(p.is_alive() for p in procs.values()):
+        try:
+            name, stats = results.get(timeout=1)
+            per_worker[name] = stats
+        except queue.Empty:
+            pass
+    while True:
+        try:
+            name, stats = results.get_nowait()
+            per_worker[name] = stats
+        except queue.Empty:
+            break
+    for p in procs.values():
+        p.join()
+    wall = time.perf_counter() - t0
+
+    crashed = sorted(n for n, p in procs.items() if p.exitcode != 0 or n not in per_worker)
+    total = merge_stats(per_worker)
+    items = total.get("item_scraped_count", 0)
+
+    client, db = _get_db_sync()
+    try:
+        frontier = Frontier(db, run_id, "orchestrator").counts()
+        # each worker's CrawlProfiler stored its own profile under this run_id
+        profile = merge_profiles(list(db[RUNS].find({"kind": "crawl", "run_id": run_id})))
+        complete = not (frontier.get("pending") or frontier.get("leased") or frontier.get("failed"))
+        generation = None
+        settings = _project_settings()
+        if settings.getbool("MONGO_GENERATIONS") and complete:
+            # the workers only snapshot; the run is diffed once every category is in
+            generation = finalize_generation(db, run_id, keep=settings.getint("MONGO_GENERATIONS_KEEP", 3))
+            bump_epoch(db)
+        summary = {
+            "_id": run_id,
+            "kind": "sharded",
+            "mode": args.mode,
+            "workers": args.workers,
+            "crashed_workers": crashed,
+            "started_at": started_at,
+            "finished_at": datetime.now(timezone.utc),
+            "wall_secs": round(wall, 2),
+            "items_per_sec": round(items / wall, 2) if wall else 0.0,
+            "frontier": frontier,
+            "generation": generation,
+            "stats": total,
+            **profile,
+            "per_worker": {
+                n: {k: st.get(k) for k in ("item_scraped_count", "response_received_count",
+                                           "shard/categories_acked", "shard/categories_reclaimed",
+                                           "elapsed_time_seconds", "finish_reason")}
+                for n, st in sorted(per_worker.items())
+            },
+        }
+        db[RUNS].replace_one({"_id": run_id}, summary, upsert=True)
+    finally:
+        client.close()
+
+    print(f"[sharded] run {run_id} finished in {wall:.1f}s: {items} items ({summary['items_per_sec']}/s), "
+          f"{total.get('response_received_count', 0)} responses")
+    print(f"[sharded] categories: {frontier}")
+    if generation:
+        print(f"[sharded] generation: {generation['new']} new, {generation['update']} updated, "
+              f"{generation['removed']} removed")
+    for n, st in summary["per_worker"].items():
+        print(f"[sharded]   {n}: {st['item_scraped_count'] or 0} items, "
+              f"{st['shard/categories_acked'] or 0} categories, {st['finish_reason']}")
+    if crashed:
+        print(f"[sharded] crashed workers: {', '.join(crashed)}")
+    if not complete:
+        print(f"[sharded] incomplete; rerun with --resume {run_id}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Adaptive recrawl: revisit books and categories as often as they change.
+
+    python -m scheduler.schedule_adaptive              # replan + targeted crawl every tick
+    python -m scheduler.schedule_adaptive --once       # one tick, then exit
+    python -m scheduler.schedule_adaptive --plan-only  # replan and print the estimates
+
+Every tick the change rates are re-estimated from `changes` and
+`book_history` (see qtsbook/recrawl.py) and the units that are due, up to
+the tick's share of the request budget, are crawled with
+`scrapy crawl books -a mode=targeted -a batch=<id>`.
+
+    QTS_RECRAWL_BUDGET          requests per window (default 1000)
+    QTS_RECRAWL_WINDOW_HOURS    budget window (default 24)
+    QTS_RECRAWL_TICK_MINUTES    how often to replan and crawl (default 60)
+    QTS_RECRAWL_MIN_HOURS       shortest revisit interval (default 6)
+    QTS_RECRAWL_MAX_HOURS       longest revisit interval (default 336)
+    QTS_RECRAWL_HISTORY_DAYS    change history considered (default 30)
+    QTS_RECRAWL_PRIOR_DAYS      weight of the category prior, in days (default 7)
+"""
+
+import os
+import sys
+import math
+import asyncio
+import argparse
+import subprocess
+from zoneinfo import ZoneInfo
+from datetime import datetime, timezone
+from pymongo import MongoClient
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCRAPY_ROOT = os.path.join(REPO_ROOT, "app", "crawler")
+if SCRAPY_ROOT not in sys.path:
+    sys.path.insert(0, SCRAPY_ROOT)
+
+from qtsbook.recrawl import PLAN, mark_crawled, plan, select_due  # noqa: E402
+
+TZ = ZoneInfo(os.getenv("QTS_TIMEZONE", "Asia/Dhaka"))
+
+
+def _get_db_sync():
+    uri = os.getenv("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    db_name = os.getenv("QTS_MONGODB_DB", "qtsbook")
+    client = MongoClient(uri, tz_aware=True, tzinfo=timezone.utc)
+    return client, client[db_name]
+
+def _config() -> dict:
+    return {
+        "budget": int(os.getenv("QTS_RECRAWL_BUDGET", "1000")),
+        "window_hours": float(os.getenv("QTS_RECRAWL_WINDOW_HOURS", "24")),
+        "tick_minutes": int(os.getenv("QTS_RECRAWL_TICK_MINUTES", "60")),
+        "min_hours": float(os.getenv("QTS_RECRAWL_MIN_HOURS", "6")),
+        "max_hours": float(os.getenv("QTS_RECRAWL_MAX_HOURS", "336")),
+        "history_days": int(os.getenv("QTS_RECRAWL_HISTORY_DAYS", "30")),
+        "prior_days": float(os.getenv("QTS_RECRAWL_PRIOR_DAYS", "7")),
+    }
+
+def replan(db, cfg: dict, now: datetime) -> dict:
+    return plan(
+        db, now, cfg["budget"], window_hours=cfg["window_hours"], min_hours=cfg["min_hours"],
+        max_hours=cfg["max_hours"], history_days=cfg["history_days"], prior_days=cfg["prior_days"],
+    )
+
+def run_targeted_blocking(batch: str):
+    env = os.environ.copy()
+    env.setdefault("QTS_MONGODB_URI", "mongodb://mongo:27017")
+    env.setdefault("QTS_MONGODB_DB", "qtsbook")
+    env.setdefault("QTS_LOG_LEVEL", "INFO")
+
+    subprocess.run(
+        ["scrapy", "crawl", "books", "-L", env["QTS_LOG_LEVEL"], "-a", "mode=targeted", "-a", f"batch={batch}"],
+        cwd=SCRAPY_ROOT,
+        check=True,
+        env=env,
+    )
+
+def tick_blocking():
+    cfg = _config()
+    client, db = _get_db_sync()
+    try:
+        now = datetime.now(timezone.utc)
+        summary = replan(db, cfg, now)
+        # this tick's share of the window's budget
+        cap = max(1, math.ceil(cfg["budget"] * cfg["tick_minutes"] / (cfg["window_hours"] * 60)))
+        batch = f"{now:%Y%m%dT%H%M%S}"
+        picked = select_due(db, now, cap, batch)
+        print(
+            f"[adaptive] {summary['books']} books, {summary['categories']} categories; "
+            f"plan uses {summary['planned_requests']}/{cfg['budget']} requests per {cfg['window_hours']:g}h; "
+            f"{len(picked)} due units (~{sum(d['cost'] for d in picked)} requests, cap {cap})"
+        )
+        if not picked:
+            return
+        run_targeted_blocking(batch)
+        mark_crawled(db, batch, datetime.now(timezone.utc))
+    finally:
+        client.close()
+
+async def tick():
+    await asyncio.to_thread(tick_blocking)
+
+def print_plan(db, top: int):
+    print(f"{'kind':<8} {'rate/day':>9} {'changes':>7} {'every h':>8} {'next due (UTC)':<17} key")
+    for d in db[PLAN].find().sort("rate_per_day", -1).limit(top):
+        print(f"{d['kind']:<8} {d['rate_per_day']:>9.4f} {d['changes']:>7} {d['interval_hours']:>8.1f} "
+              f"{d['next_due']:%Y-%m-%d %H:%M} {d['key']}")
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(os.path.join(REPO_ROOT, ".env"))
+    except Exception:
+        pass
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--once", action="store_true", help="run one tick and exit")
+    ap.add_argument("--plan-only", action="store_true", help="replan and print, no crawl")
+    ap.add_argument("--top", type=int, default=20, help="units printed by --plan-only")
+    args = ap.parse_args()
+
+    if args.plan_only:
+        cfg = _config()
+        client, db = _get_db_sync()
+        try:
+            summary = replan(db, cfg, datetime.now(timezone.utc))
+            print(f"[adaptive] {summary}")
+            print_plan(db, args.top)
+        finally:
+            client.close()
+        return
+    if args.once:
+        tick_blocking()
+        return
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    minutes = _config()["tick_minutes"]
+    scheduler = AsyncIOScheduler(timezone=TZ, event_loop=loop)
+    scheduler.add_job(tick, "interval", minutes=minutes,
+                      id="adaptive_recrawl", max_instances=1, next_run_time=datetime.now(TZ))
+
+    print(f"[{datetime.now(TZ).isoformat()}] Adaptive scheduler started (every {minutes} min). Ctrl+C to stop.")
+    scheduler.start()
+    try:
+        loop.run_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
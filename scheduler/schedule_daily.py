@@ -26,9 +26,10 @@ def run_crawl_blocking():
     env.setdefault("QTS_MONGODB_URI", "mongodb://mongo:27017")
     env.setdefault("QTS_MONGODB_DB", "qtsbook")
     env.setdefault("QTS_LOG_LEVEL", "INFO")
+    env.setdefault("QTS_CRAWL_MODE", "full")
 
     subprocess.run(
-        ["scrapy", "crawl", "books", "-L", env["QTS_LOG_LEVEL"]],
+        ["scrapy", "crawl", "books", "-L", env["QTS_LOG_LEVEL"], "-a", f"mode={env['QTS_CRAWL_MODE']}"],
         cwd=SCRAPY_ROOT,
         check=True,
         env=env,
@@ -72,6 +73,7 @@ def _format_summary(summary: dict) -> str:
         f"Total: {summary['total']}",
         f"New: {summary['new']}",
         f"Updated: {summary['updated']}",
+        f"Removed: {summary['removed']}",
         f"Significant: {summary['significant']}",
     ]
     if summary["significant_sample"]:
@@ -130,7 +132,8 @@ def build_daily_report_blocking():
             f"JSON: {report['json_path']}\nCSV: {report['csv_path']}\n\n"
             f"Since: {summary['since']}\n"
             f"Total: {summary['total']}\nNew: {summary['new']}\n"
-            f"Updated: {summary['updated']}\nSignificant: {summary['significant']}\n"
+            f"Updated: {summary['updated']}\nRemoved: {summary['removed']}\n"
+            f"Significant: {summary['significant']}\n"
         )
         print(f"[scheduler] {text.replace(os.linesep, ' | ')}")
 
@@ -1,3 +1,4 @@
+import operator
 import pytest
 from fastapi.testclient import TestClient
 from bson import ObjectId
@@ -8,24 +9,30 @@ import app.db.mongo as mongo_mod
 
 # ---------- tiny in-memory Mongo-like fake ----------
 
+_CMP = {"$gte": operator.ge, "$lte": operator.le, "$gt": operator.gt, "$lt": operator.lt}
+
 def _match(doc, filt: dict) -> bool:
     for k, v in (filt or {}).items():
-        if k == "changed_at":
-            since = v.get("$gte")
-            until = v.get("$lte")
-            d = doc.get("changed_at")
-            if since and (d is None or d < since):
+        if k == "$or":
+            if not any(_match(doc, f) for f in v):
                 return False
-            if until and (d is None or d > until):
+            continue
+        if k == "$and":
+            if not all(_match(doc, f) for f in v):
                 return False
             continue
         if isinstance(v, dict):
-            if "$gte" in v or "$lte" in v:
+            if v.keys() & (_CMP.keys() | {"$ne", "$in"}):
                 x = doc.get(k)
-                if "$gte" in v and (x is None or x < v["$gte"]):
-                    return False
-                if "$lte" in v and (x is None or x > v["$lte"]):
-                    return False
+                for op, arg in v.items():
+                    if op == "$ne":
+                        if x == arg:
+                            return False
+                    elif op == "$in":
+                        if x not in arg:
+                            return False
+                    elif x is None or not _CMP[op](x, arg):
+                        return False
             elif "$regex" in v:
                 import re
                 flags = re.I if v.get("$options") == "i" else 0
@@ -42,9 +49,11 @@ def _match(doc, filt: dict) -> bool:
 class FakeCursor:
     def __init__(self, data):
         self.data = list(data)
-    def sort(self, field, direction):
-        reverse = direction == -1
-        self.data.sort(key=lambda d: d.get(field), reverse=reverse)
+    def sort(self, field, direction=None):
+        # sort(field, dir) or sort([(field, dir), ...]); missing/None sorts first, as in Mongo
+        keys = field if isinstance(field, list) else [(field, direction)]
+        for f, d in reversed(keys):
+            self.data.sort(key=lambda doc: (doc.get(f) is not None, doc.get(f)), reverse=d == -1)
         return self
     def skip(self, n):
         self.data = self.data[n:]
@@ -55,7 +64,7 @@ class FakeCursor:
     def __aiter__(self):
         async def gen():
             for d in self.data:
-                yield d
+                yield dict(d)  # like a real cursor: callers may mutate what they get
         return gen()
 
 class FakeCollection:
@@ -63,8 +72,13 @@ class FakeCollection:
         self._docs = docs
     async def count_documents(self, filt):
         return sum(1 for d in self._docs if _match(d, filt or {}))
-    def find(self, filt=None):
-        return FakeCursor(d for d in self._docs if _match(d, (filt or {})))
+    async def estimated_document_count(self):
+        return len(self._docs)
+    def find(self, filt=None, projection=None):
+        docs = (d for d in self._docs if _match(d, (filt or {})))
+        if projection:
+            docs = ({k: d[k] for k in ("_id", *projection) if k in d} for d in docs)
+        return FakeCursor(docs)
     async def find_one(self, filt, projection=None):
         for d in self._docs:
             ok = True
@@ -72,9 +86,7 @@ class FakeCollection:
                 ok = ok and (d.get(k) == v)
             if ok:
                 if projection:
-                    nd = {k: d.get(k) for k, inc in projection.items() if inc == 1}
-                    nd["_id"] = d["_id"]
-                    return nd
+                    return {k: d[k] for k in ("_id", *projection) if k in d}
                 return d
         return None
     def aggregate(self, pipeline):
@@ -92,13 +104,42 @@ class FakeCollection:
                     yield r
         return _Agg()
 
+class FakeHistory(FakeCollection):
+    """book_history: aggregate understands $match / $sort / $group on $dateTrunc (hour, day)."""
+    def aggregate(self, pipeline):
+        match, _, group, _ = pipeline
+        spec = group["$group"]
+        unit = spec["_id"]["$dateTrunc"]["unit"]
+        buckets = {}
+        for d in sorted((d for d in self._docs if _match(d, match["$match"])), key=lambda d: d["ts"]):
+            key = d["ts"].replace(minute=0, second=0, microsecond=0)
+            if unit == "day":
+                key = key.replace(hour=0)
+            buckets.setdefault(key, []).append(d)
+        rows = []
+        for key, docs in sorted(buckets.items()):
+            row = {"_id": key}
+            for out, acc in spec.items():
+                if out == "_id":
+                    continue
+                op, field = next(iter(acc.items()))
+                vals = [d.get(field[1:]) for d in docs] if isinstance(field, str) else [field] * len(docs)
+                row[out] = {"$min": min, "$max": max, "$last": lambda v: v[-1], "$sum": sum}[op](vals)
+            rows.append(row)
+        class _Agg:
+            async def __aiter__(self_non):
+                for r in rows:
+                    yield r
+        return _Agg()
+
 class FakeDB(dict):
     pass
 
 @pytest.fixture()
 def client(monkeypatch):
-    # seed docs
+    # seed docs; BSON dates are millisecond-precise
     now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
     books = [
         {
             "_id": ObjectId(),
@@ -118,6 +159,7 @@ def client(monkeypatch):
             "crawled_at": now - timedelta(hours=3),
             "source": "test",
             "content_hash": "h1",
+            "raw_html_gz": b"\x1f\x8b" + b"\0" * 64,
         },
         {
             "_id": ObjectId(),
@@ -138,6 +180,19 @@ def client(monkeypatch):
             "source": "test",
             "content_hash": "h2",
         },
+        {
+            "_id": ObjectId(),
+            "url": "https://example.com/c",
+            "name": "Charlie Verse",
+            "description": "Unpriced",
+            "category": "Poetry",
+            "rating": 3,
+            "price_incl_tax_num": None,
+            "num_reviews": 0,
+            "crawled_at": now - timedelta(hours=2),
+            "source": "test",
+            "content_hash": "h3",
+        },
     ]
     changes = [
         {
@@ -162,11 +217,68 @@ def client(monkeypatch):
             "prev_hash": "h_old",
             "new_hash": "h2",
         },
+        {
+            "_id": ObjectId(),
+            "url": "https://example.com/c",
+            "changed_at": now - timedelta(hours=1),
+            "change_kind": "removed",
+            "significant": True,
+            "fields_changed": {"name": {"prev": "Charlie Gone", "new": None}},
+            "price_delta": None,
+            "prev_hash": "h3",
+            "new_hash": None,
+        },
+    ]
+
+    day = (now - timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+    history = [
+        {"_id": ObjectId(), "ts": day, "book": "https://example.com/a",
+         "price": 14.0, "in_stock": True, "stock": 3, "rating": 4},
+        {"_id": ObjectId(), "ts": day + timedelta(hours=6), "book": "https://example.com/a",
+         "price": 12.0, "in_stock": True, "stock": 2, "rating": 4},
+        {"_id": ObjectId(), "ts": now - timedelta(minutes=5), "book": "https://example.com/a",
+         "price": 12.0, "in_stock": False, "stock": 0, "rating": 4},
+        {"_id": ObjectId(), "ts": day, "book": "https://example.com/b",
+         "price": 25.0, "in_stock": True, "stock": 7, "rating": 5},
     ]
 
     fdb = FakeDB()
     fdb["books"] = FakeCollection(books)
     fdb["changes"] = FakeCollection(changes)
+    fdb["book_history"] = FakeHistory(history)
+    fdb["recrawl_plan"] = FakeCollection([
+        {"_id": f"book:{b['url']}", "kind": "book", "key": b["url"], "category": b["category"],
+         "rate_per_day": rate, "changes": changes, "observed_days": 10.0, "cost": 1, "interval_hours": hours,
+         "last_crawled": b["crawled_at"], "next_due": b["crawled_at"] + timedelta(hours=hours)}
+        for b, rate, changes, hours in ((books[0], 0.05, 0, 96.0), (books[1], 0.9, 8, 1.0))
+    ])
+    fdb["crawl_jobs"] = FakeCollection([
+        {"_id": "20240101T000000-full", "mode": "full", "status": "finished", "sessions": 1,
+         "started_at": now - timedelta(days=1), "updated_at": now - timedelta(days=1), "percent": 100.0,
+         "items": 1000, "categories_total": 50, "categories_complete": 50, "eta_at": None},
+        {"_id": "20240102T000000-full", "mode": "full", "status": "running", "sessions": 2,
+         "started_at": now - timedelta(minutes=10), "updated_at": now - timedelta(seconds=2), "percent": 40.0,
+         "items": 400, "categories_total": 50, "categories_complete": 19, "eta_at": now + timedelta(minutes=15)},
+    ])
+
+    def _event(run, secs_ago, type, level, msg, **data):
+        sev = {"debug": 10, "info": 20, "warning": 30, "error": 40}[level]
+        return {"_id": ObjectId(), "ts": now - timedelta(seconds=secs_ago), "run": run, "spider": "books",
+                "type": type, "level": level, "severity": sev, "msg": msg, "data": data}
+    fdb["crawl_events"] = FakeCollection([
+        _event("run-old", 7200, "crawl.started", "info", "books started"),
+        _event("run-old", 7000, "crawl.finished", "info", "books finished", reason="finished"),
+        _event("run-new", 60, "crawl.started", "info", "books started"),
+        _event("run-new", 50, "item.scraped", "info", "https://example.com/a", url="https://example.com/a"),
+        _event("run-new", 40, "http.error", "warning", "HTTP 404 https://example.com/x", status=404),
+        _event("run-new", 30, "item.error", "error", "https://example.com/b: boom", traceback="Traceback ..."),
+    ])
+    fdb["meta"] = FakeCollection([{"_id": "crawl_epoch", "epoch": 1}])
+    fdb["images"] = FakeCollection([
+        {"_id": "ab" * 32, "data": b"\x89PNG-cover", "content_type": "image/png", "size": 11,
+         "thumb": {"data": b"\xff\xd8-thumb", "content_type": "image/jpeg", "width": 150, "height": 225}},
+        {"_id": "cd" * 32, "data": b"GIF89a", "content_type": "image/gif", "size": 6},
+    ])
 
     def _fake_get_db():
         return fdb
@@ -178,6 +290,16 @@ def client(monkeypatch):
     import app.api.routes_changes as routes_changes
     monkeypatch.setattr(routes_books, "get_db", _fake_get_db, raising=False)
     monkeypatch.setattr(routes_changes, "get_db", _fake_get_db, raising=False)
+    import app.api.routes_dashboard as routes_dashboard
+    monkeypatch.setattr(routes_dashboard, "get_db", _fake_get_db, raising=False)
+    import app.api.routes_images as routes_images
+    monkeypatch.setattr(routes_images, "get_db", _fake_get_db, raising=False)
+    import app.api.cache as cache
+    monkeypatch.setattr(cache, "get_db", _fake_get_db, raising=False)
+    cache.response_cache.clear()  # every test seeds new ids
+    import app.api.search as search
+    monkeypatch.setattr(search, "get_db", _fake_get_db, raising=False)
+    search.indexer.clear()
 
     # optional routers: patch only if present
     try:
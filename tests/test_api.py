@@ -1,5 +1,7 @@
 import os
 
+from bson import ObjectId
+
 API_KEY = os.getenv("QTS_API_KEY", "test-key") # default for tests
 
 def _h():
@@ -28,6 +30,108 @@ def test_books_filters_and_sort(client):
     assert r.status_code == 200
     assert any("Bravo" in x["name"] for x in r.json()["items"])
 
+def test_books_search(client):
+    def names(**params):
+        return [i["name"] for i in client.get("/books", params=params, headers=_h()).json()["items"]]
+    assert names(q="poetry") == ["Charlie Verse"]  # category
+    assert names(q="great") == ["Alpha Book"]  # description
+    assert names(q="bravo stor") == ["Bravo Stories"]  # the last word is a prefix
+    assert names(q="charile") == ["Charlie Verse"]  # one transposition
+    assert names(q="alpha second") == []  # every word has to match
+    assert names(q=".*") == []  # user input is no regex
+    # a name match outranks a description match
+    assert names(q="st", sort_by="relevance") == ["Bravo Stories", "Alpha Book"]
+    assert names(q="st", sort_by="price", order="asc") == ["Alpha Book", "Bravo Stories"]
+    assert names(q="st", sort_by="relevance", category="Travel") == ["Alpha Book"]
+    assert client.get("/books?sort_by=relevance", headers=_h()).status_code == 400
+    assert client.get("/books?q=st&sort_by=relevance&cursor=", headers=_h()).status_code == 400
+
+def test_books_search_hit_cap(client, monkeypatch):
+    from app.api import search
+    monkeypatch.setattr(search, "MAX_HITS", 1)
+    # every sort reads only the best hit, and says that more matched
+    for sort_by in ("relevance", "price"):
+        body = client.get("/books", params={"q": "st", "sort_by": sort_by}, headers=_h()).json()
+        assert [i["name"] for i in body["items"]] == ["Bravo Stories"]
+        assert body["total"] == 1 and body["truncated"] is True
+    body = client.get("/books", params={"q": "bravo", "cursor": ""}, headers=_h()).json()
+    assert body["truncated"] is False
+
+def test_books_search_after_crawl(client, monkeypatch):
+    import app.api.cache as cache
+    monkeypatch.setattr(cache, "EPOCH_CHECK_SECS", 0)
+    def names():
+        return [i["name"] for i in client.get("/books", params={"q": "bravo"}, headers=_h()).json()["items"]]
+    assert names() == ["Bravo Stories"]
+    # a crawl adds a book and bumps the epoch: the first search after it already sees the book
+    books = cache.get_db()["books"]._docs
+    books.append({**books[1], "_id": ObjectId(), "url": "https://example.com/new", "name": "Bravo Returns"})
+    cache.get_db()["meta"]._docs[0]["epoch"] += 1
+    assert sorted(names()) == ["Bravo Returns", "Bravo Stories"]
+
+def _walk(client, path, **params):
+    """Follow next_cursor to the end, then prev_cursor back; returns both sequences of names/urls."""
+    key = "name" if path == "/books" else "url"
+    fwd, pages, token = [], [], ""
+    while token is not None:
+        body = client.get(path, params={**params, "cursor": token}, headers=_h()).json()
+        fwd += [i[key] for i in body["items"]]
+        pages.append(body)
+        token = body["next_cursor"]
+    back, token = [], pages[-1]["prev_cursor"]
+    while token is not None:
+        body = client.get(path, params={**params, "cursor": token}, headers=_h()).json()
+        back = [i[key] for i in body["items"]] + back
+        token = body["prev_cursor"]
+    return fwd, back, pages
+
+def test_books_cursor_pagination(client):
+    # price asc: the unpriced book sorts first, like Mongo's nulls
+    fwd, back, pages = _walk(client, "/books", sort_by="price", order="asc", page_size=1)
+    assert fwd == ["Charlie Verse", "Alpha Book", "Bravo Stories"]
+    assert back == fwd[:-1]
+    assert not pages[0]["has_prev"] and not pages[-1]["has_next"]
+    # unfiltered: an estimated total for free
+    assert pages[0]["total"] == 3 and pages[0]["total_estimated"] is True
+
+    fwd, _, _ = _walk(client, "/books", sort_by="price", order="desc", page_size=2)
+    assert fwd == ["Bravo Stories", "Alpha Book", "Charlie Verse"]
+
+    r = client.get("/books", params={"cursor": "", "category": "Travel"}, headers=_h()).json()
+    assert r["total"] is None
+    r = client.get("/books", params={"cursor": "", "category": "Travel", "include_total": "true"}, headers=_h()).json()
+    assert r["total"] == 1 and r["total_estimated"] is False
+
+    token = pages[0]["next_cursor"]
+    assert client.get("/books", params={"cursor": token, "sort_by": "name"}, headers=_h()).status_code == 400
+    assert client.get("/books", params={"cursor": "garbage!"}, headers=_h()).status_code == 400
+
+def test_books_sparse_fields(client):
+    full = client.get("/books?sort_by=name&order=asc", headers=_h()).json()["items"]
+    assert "raw_html_gz" not in full[0] and full[0]["description"] == "A great start"
+
+    items = client.get("/books?sort_by=name&order=asc&view=summary", headers=_h()).json()["items"]
+    assert items[0]["name"] == "Alpha Book" and "description" not in items[0] and "tax" not in items[0]
+
+    # cursor mode reads the sort key for the cursor but returns only what was asked for
+    r = client.get("/books", params={"cursor": "", "sort_by": "price", "page_size": 1, "fields": "name,price_incl_tax"}, headers=_h())
+    assert r.status_code == 200
+    assert set(r.json()["items"][0]) == {"_id", "name", "price_incl_tax"}
+    assert r.json()["next_cursor"]
+
+    one = client.get(f"/books/{full[0]['_id']}?fields=id,description", headers=_h()).json()
+    assert one == {"_id": full[0]["_id"], "description": "A great start"}
+
+    assert client.get("/books?fields=name,raw_html_gz", headers=_h()).status_code == 400
+
+def test_changes_cursor_pagination(client):
+    fwd, back, pages = _walk(client, "/changes", page_size=2)
+    assert fwd == ["https://example.com/b", "https://example.com/c", "https://example.com/a"]
+    assert back == fwd[:2]
+    assert pages[0]["total_estimated"] is True
+    fwd, _, _ = _walk(client, "/changes", page_size=1, significant="true")
+    assert fwd == ["https://example.com/c", "https://example.com/a"]
+
 def test_changes_filters(client):
     # last 3 hours, significant only
     r = client.get("/changes?since_hours=3&significant=true&page=1&page_size=50", headers=_h())
@@ -41,6 +145,124 @@ def test_changes_filters(client):
     items = r.json()["items"]
     assert all(x["change_kind"] == "update" for x in items)
 
+def test_changes_removed_kind(client):
+    r = client.get("/changes?kind=removed&page=1&page_size=50", headers=_h())
+    assert r.status_code == 200
+    items = r.json()["items"]
+    assert [x["url"] for x in items] == ["https://example.com/c"]
+    assert items[0]["new_hash"] is None
+
+def test_book_history_downsampled(client):
+    items = client.get("/books?sort_by=name&order=asc", headers=_h()).json()["items"]
+    alpha = items[0]["_id"]
+
+    r = client.get(f"/books/{alpha}/history?bucket=day", headers=_h())
+    assert r.status_code == 200
+    body = r.json()
+    assert body["url"] == "https://example.com/a" and body["bucket"] == "day"
+    first = body["points"][0]
+    assert (first["price_min"], first["price_max"], first["price_last"]) == (12.0, 14.0, 12.0)
+    assert first["points"] == 2 and first["stock_min"] == 2
+    assert sum(p["points"] for p in body["points"]) == 3
+    assert body["points"][-1]["in_stock_last"] is False
+
+    raw = client.get(f"/books/{alpha}/history?bucket=raw", headers=_h()).json()
+    assert [p["price_last"] for p in raw["points"]] == [14.0, 12.0, 12.0]
+
+    assert client.get("/books/not-an-id/history", headers=_h()).status_code == 400
+
+def test_dashboard_recrawl_plan(client, monkeypatch):
+    monkeypatch.setenv("QTS_ADMIN_USER", "admin")
+    monkeypatch.setenv("QTS_ADMIN_PASS", "pw")
+    r = client.get("/dashboard/recrawl?sort=rate", auth=("admin", "pw"))
+    assert r.status_code == 200
+    html = r.text
+    # most volatile first; the book crawled an hour ago with a 1h interval is due
+    assert html.index("https://example.com/b") < html.index("https://example.com/a")
+    assert "<strong>1</strong> due now" in html
+
+def test_dashboard_progress(client, monkeypatch):
+    monkeypatch.setenv("QTS_ADMIN_USER", "admin")
+    monkeypatch.setenv("QTS_ADMIN_PASS", "pw")
+    r = client.get("/dashboard/progress.json", auth=("admin", "pw"))
+    assert r.status_code == 200
+    p = r.json()["progress"]
+    # the newest job, not the finished one
+    assert p["job"] == "20240102T000000-full" and p["percent"] == 40.0
+    assert 14 * 60 < p["eta_secs"] <= 15 * 60
+    assert p["categories_complete"] == 19 and not p["stalled"]
+
+def test_dashboard_events_filtered(client, monkeypatch):
+    monkeypatch.setenv("QTS_ADMIN_USER", "admin")
+    monkeypatch.setenv("QTS_ADMIN_PASS", "pw")
+    auth = ("admin", "pw")
+    r = client.get("/dashboard/events.json", auth=auth)
+    assert r.status_code == 200
+    body = r.json()
+    # the newest run by default, oldest event first
+    assert body["run"] == "run-new"
+    assert [e["type"] for e in body["events"]] == ["crawl.started", "item.scraped", "http.error", "item.error"]
+    r = client.get("/dashboard/events.json?level=warning", auth=auth)
+    assert [e["level"] for e in r.json()["events"]] == ["warning", "error"]
+    r = client.get("/dashboard/events.json?run=run-old&type=crawl.finished", auth=auth)
+    assert [e["data"]["reason"] for e in r.json()["events"]] == ["finished"]
+    page = client.get("/dashboard/logs?level=error", auth=auth)
+    assert page.status_code == 200 and "boom" in page.text and "HTTP 404" not in page.text
+
+def test_images_served_immutable(client):
+    digest = "ab" * 32
+    r = client.get(f"/images/{digest}")
+    assert r.status_code == 200 and r.content == b"\x89PNG-cover"
+    assert r.headers["content-type"] == "image/png"
+    assert "immutable" in r.headers["cache-control"] and r.headers["etag"] == f'"{digest}"'
+    assert client.get(f"/images/{digest}", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    t = client.get(f"/images/{digest}?size=thumb")
+    assert t.status_code == 200 and t.headers["content-type"] == "image/jpeg"
+    assert client.get(f"/images/{'cd' * 32}?size=thumb").status_code == 404  # stored without a thumbnail
+    assert client.get(f"/images/{'ef' * 32}").status_code == 404
+    assert client.get("/images/not-a-digest").status_code == 422
+
+def test_response_cache_epoch(client, monkeypatch):
+    import app.api.cache as cache
+    monkeypatch.setattr(cache, "EPOCH_CHECK_SECS", 0)
+    monkeypatch.setenv("QTS_ADMIN_USER", "admin")
+    monkeypatch.setenv("QTS_ADMIN_PASS", "pw")
+    before = dict(cache.response_cache.stats)  # counters outlive the per-test clear
+    r = client.get("/books?page_size=10", headers=_h())
+    assert r.headers["x-cache"] == "MISS"
+    # same query once defaults are filled in
+    r = client.get("/books?page=1&page_size=10", headers=_h())
+    assert r.headers["x-cache"] == "HIT" and r.json()["total"] == 3
+    # since_hours windows of one bucket share an entry
+    assert client.get("/changes?since_hours=24", headers=_h()).headers["x-cache"] == "MISS"
+    assert client.get("/changes?since_hours=24", headers=_h()).headers["x-cache"] == "HIT"
+
+    # a finished crawl bumps the epoch and drops everything
+    cache.get_db()["meta"]._docs[0]["epoch"] = 2
+    assert client.get("/books?page_size=10", headers=_h()).headers["x-cache"] == "MISS"
+    stats = client.get("/dashboard/cache.json", auth=("admin", "pw")).json()
+    assert stats["epoch"] == 2 and stats["entries"] == 1
+    assert {k: stats[k] - before[k] for k in ("hits", "misses", "invalidations")} == {
+        "hits": 2, "misses": 3, "invalidations": 1,
+    }
+
+def test_conditional_get(client):
+    alpha = client.get("/books?sort_by=name&order=asc", headers=_h()).json()["items"][0]["_id"]
+    r = client.get(f"/books/{alpha}", headers=_h())
+    etag, modified = r.headers["etag"], r.headers["last-modified"]
+    assert r.headers["cache-control"] == "private, no-cache"
+    r = client.get(f"/books/{alpha}", headers={**_h(), "If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b"" and r.headers["etag"] == etag
+    assert client.get(f"/books/{alpha}", headers={**_h(), "If-Modified-Since": modified}).status_code == 304
+    # another representation, another tag
+    r = client.get(f"/books/{alpha}?fields=name", headers={**_h(), "If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+
+    for path in ("/books?page_size=10", "/changes?kind=update"):
+        etag = client.get(path, headers=_h()).headers["etag"]
+        assert client.get(path, headers={**_h(), "If-None-Match": f'W/{etag}, "other"'}).status_code == 304
+        assert client.get(path + "&page=2", headers={**_h(), "If-None-Match": etag}).status_code == 200
+
 def test_reports_today_404(client):
     # No reports created in tests → expect 404
     r = client.get("/reports/today?format=json", headers=_h())
@@ -0,0 +1,240 @@
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT / "app" / "crawler"))
+
+checkpoints = pytest.importorskip("qtsbook.checkpoints")
+from scrapy import Request  # noqa: E402
+from scrapy.http import HtmlResponse, Response  # noqa: E402
+from scrapy.settings import Settings  # noqa: E402
+from scrapy.utils.test import get_crawler  # noqa: E402
+
+from conftest import _match  # noqa: E402
+from qtsbook import extract, hashing, rawstore, sitedefs  # noqa: E402
+from qtsbook.extensions import Histogram  # noqa: E402
+from qtsbook.frontier import Frontier  # noqa: E402
+from qtsbook.httpcache import TTLCacheStorage  # noqa: E402
+
+def test_checkpoint_jobs_started_together_get_their_own_id():
+    db = MagicMock()
+    ids = {checkpoints.Checkpoints.open(db, "full", resume=False).job_id for _ in range(3)}
+    assert len(ids) == 3 and all(i.split("-")[1] == "full" for i in ids)
+
+def test_validators_saved_in_batches(monkeypatch):
+    middlewares = pytest.importorskip("qtsbook.middlewares")
+
+    client = MagicMock()
+    monkeypatch.setattr(middlewares, "MongoClient", lambda *a, **kw: client)
+    coll = client.__getitem__.return_value.__getitem__.return_value
+    coll.find.return_value = []
+    mw = middlewares.ConditionalRequestMiddleware(
+        Settings({"CONDITIONAL_FLUSH_SIZE": 2, "CONDITIONAL_FLUSH_INTERVAL_SECS": 0}), MagicMock(),
+    )
+    spider = MagicMock()
+    mw.spider_opened(spider)
+
+    def fetch(n):
+        url = f"https://example.com/{n}"
+        mw.process_response(Request(url, meta={"page_type": "detail"}),
+                            Response(url, headers={"ETag": f'"{n}"'}), spider)
+
+    fetch(1)
+    assert coll.bulk_write.call_count == 0
+    fetch(2)  # a full batch is written while the crawl runs
+    (ops,), _ = coll.bulk_write.call_args
+    assert len(ops) == 2 and mw._dirty == {}
+    fetch(3)
+    mw.spider_closed(spider)  # the rest on close
+    assert coll.bulk_write.call_count == 2 and len(coll.bulk_write.call_args.args[0]) == 1
+
+def test_page_codec_round_trip():
+    raw = b"<html><body>" + b"<p>A book</p>" * 200 + b"</body></html>"
+    codec = rawstore.PageCodec()
+    page = codec.encode(raw)
+    assert page["_id"] == rawstore.page_digest(raw) and page["size"] == len(raw)
+    assert page["stored_size"] < len(raw) and codec.decode(page) == raw
+
+def test_page_codec_round_trip_with_dictionary():
+    pytest.importorskip("zstandard")
+    samples = [b"<html><h1>Book %d</h1><p>%s</p></html>" % (i, b"lorem ipsum " * (i % 7)) for i in range(200)]
+    dict_doc = rawstore.train_dictionary(samples, size=4096)
+    page = rawstore.PageCodec(dict_doc).encode(samples[3])
+    assert page["codec"] == "zstd" and page["dict_id"] == dict_doc["_id"]
+    # readers look the dictionary up by the id stored on the page
+    reader = rawstore.PageCodec()
+    reader.add_dictionary(dict_doc)
+    assert reader.decode(page) == samples[3]
+
+def test_http_cache_expires_per_page_type(tmp_path):
+    storage = TTLCacheStorage(Settings({
+        "HTTPCACHE_DIR": str(tmp_path), "HTTPCACHE_EXPIRATION_SECS": 0,
+        "HTTPCACHE_TTL_LISTING": 60, "HTTPCACHE_TTL_DETAIL": 3600,
+    }))
+    spider = SimpleNamespace(name="books", crawler=get_crawler())
+    storage.open_spider(spider)
+    requests = {t: Request(f"https://example.com/{t}", meta={"page_type": t}) for t in ("listing", "detail", None)}
+    for request in requests.values():
+        storage.store_response(spider, request, Response(request.url, body=b"page"))
+        # ten minutes old: past the listing TTL only
+        meta = Path(storage._get_request_path(spider, request)) / "pickled_meta"
+        os.utime(meta, (time.time() - 600, time.time() - 600))
+    assert storage.retrieve_response(spider, requests["listing"]) is None
+    assert storage.retrieve_response(spider, requests["detail"]).body == b"page"
+    assert storage.retrieve_response(spider, requests[None]).body == b"page"  # HTTPCACHE_EXPIRATION_SECS=0: never
+
+@pytest.mark.parametrize("page", sorted((REPO_ROOT / "benchmarks" / "corpus").glob("*.html")), ids=lambda p: p.stem)
+def test_extractors_agree_on_corpus(page):
+    def fields(name):
+        response = HtmlResponse(url=f"https://books.toscrape.com/catalogue/{page.stem}/index.html",
+                                body=page.read_bytes(), encoding="utf-8")
+        return extract.EXTRACTORS[name](response, "Books")
+    parsel = fields("parsel")
+    assert parsel["name"] and parsel["price_incl_tax"] and parsel["rating"] in range(6)
+    assert fields("lxml") == parsel == fields("xpath")
+
+class _FrontierColl:
+    """Just the queries Frontier makes, over a list."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _update(self, doc, update):
+        doc.update(update.get("$set", {}))
+        for k, n in update.get("$inc", {}).items():
+            doc[k] = doc.get(k, 0) + n
+
+    def update_many(self, filt, update):
+        hits = [d for d in self.docs if _match(d, filt)]
+        for d in hits:
+            self._update(d, update)
+        return SimpleNamespace(modified_count=len(hits))
+
+    def find_one_and_update(self, filt, update, sort, return_document):
+        hits = sorted((d for d in self.docs if _match(d, filt)), key=lambda d: d[sort[0][0]])
+        if not hits:
+            return None
+        self._update(hits[0], update)
+        return dict(hits[0])
+
+    def count_documents(self, filt):
+        return sum(1 for d in self.docs if _match(d, filt))
+
+def test_frontier_lease_ack_and_requeue():
+    t0 = datetime.now(timezone.utc)
+    coll = _FrontierColl([
+        {"run_id": "r", "url": f"/c{i}", "state": "pending", "attempts": 0, "created_at": t0 + timedelta(seconds=i)}
+        for i in range(2)
+    ])
+    db = {"frontier": coll}
+    a = Frontier(db, "r", "a")
+    first = a.lease()
+    assert first["url"] == "/c0" and first["owner"] == "a" and first["attempts"] == 1
+    assert a.ack(["/c0"]) == 1 and a.open_count() == 1
+
+    # a worker whose leases run out (it stopped heartbeating) loses them to the next one that asks
+    dead = Frontier(db, "r", "dead", lease_secs=-1)
+    assert dead.lease()["url"] == "/c1"
+    b = Frontier(db, "r", "b")
+    again = b.lease()
+    assert again["url"] == "/c1" and again["owner"] == "b" and again["attempts"] == 2
+    assert dead.ack(["/c1"]) == 0  # lost: not the dead worker's to ack
+    assert b.ack(["/c1"]) == 1 and b.lease() is None and b.open_count() == 0
+
+def test_frontier_gives_up_after_max_attempts():
+    coll = _FrontierColl([{"run_id": "r", "url": "/c", "state": "pending", "attempts": 0,
+                           "created_at": datetime.now(timezone.utc)}])
+    worker = Frontier({"frontier": coll}, "r", "w", lease_secs=-1, max_attempts=2)
+    assert worker.lease() and worker.lease()
+    assert worker.lease() is None and coll.docs[0]["state"] == "failed"
+
+def test_histogram_quantiles_and_merge():
+    h = Histogram([1, 2, 5, 10])
+    for v in (0.5, 1.5, 1.5, 4, 8, 20):
+        h.add(v)
+    assert h.counts == [1, 2, 1, 1, 1] and h.n == 6
+    assert h.quantile(0) == 0.5 and h.quantile(1) == 20  # clamped to what was observed
+    assert 1 <= h.quantile(0.5) <= 2
+    assert Histogram().quantile(0.5) is None
+
+    other = Histogram([1, 2, 5, 10])
+    other.add(0.1)
+    h.merge(other)
+    assert h.counts == [2, 2, 1, 1, 1] and h.n == 7 and h.min == 0.1 and h.max == 20
+    assert Histogram.from_doc(h.to_doc()).quantile(0.9) == h.quantile(0.9)
+    with pytest.raises(ValueError):
+        h.merge(Histogram([1, 2]))
+
+BOOK = {"name": "Sharp Objects", "description": "A thriller", "category": "Mystery", "price_incl_tax": "£47.82",
+        "availability": "In stock (20 available)", "rating": 4, "num_reviews": 0}
+
+def test_item_hashes_are_stable_and_canonical():
+    content_hash, field_hashes = hashing.item_hashes(BOOK)
+    assert content_hash.startswith(hashing.HASH_PREFIX) and set(field_hashes) == set(hashing.HASHED_FIELDS)
+    # key order and fields outside the hash don't matter
+    assert hashing.item_hashes({"url": "x", **dict(reversed(list(BOOK.items())))}) == (content_hash, field_hashes)
+    assert hashing.item_hashes({**BOOK, "rating": "4"})[0] != content_hash  # 4 is not "4"
+    assert hashing.field_digest("name", "ab") != hashing.field_digest("description", "ab")
+
+def test_diff_fields_per_field():
+    prev = dict(zip(("content_hash", "field_hashes"), hashing.item_hashes(BOOK)))
+    item = {**BOOK, "price_incl_tax": "£45.00", "rating": 5}
+    item["content_hash"], item["field_hashes"] = hashing.item_hashes(item)
+    assert hashing.diff_fields(prev, item) == ["price_incl_tax", "price_incl_tax_num", "rating"]
+    assert hashing.diff_fields(prev, {**BOOK, **prev}) == []
+    # a doc from the old SHA1 scheme is diffed on its full document
+    assert hashing.diff_fields({"content_hash": "0" * 40}, item) is None
+
+def test_backfill_diff_only_some_fields():
+    backfill = pytest.importorskip("scheduler.backfill")
+    stored = backfill.derive({f: BOOK.get(f) for f in backfill.EXTRACTED_FIELDS})
+    reparsed = backfill.derive({**stored, "name": "Sharp Objects (Reissue)", "rating": 5})
+    assert set(backfill.diff(stored, dict(reparsed))) == {"name", "rating", "content_hash", "field_hashes"}
+    # with `only`, the other fields keep their stored values, and the hashes follow
+    d = backfill.diff(stored, dict(reparsed), only={"rating"})
+    assert set(d) == {"rating", "content_hash", "field_hashes"} and d["rating"] == (4, 5)
+    assert backfill.diff(stored, dict(reparsed), only={"description"}) == {}
+
+SITE = {
+    "name": "shop",
+    "start_urls": ["https://shop.example/"],
+    "listing": {"items": "a.book::attr(href)"},
+    "detail": {"fields": {
+        "name": "h1::text",
+        "rating": {"css": "p.star-rating::attr(class)", "type": "rating"},
+        "num_reviews": {"css": "td.reviews::text", "type": "int"},
+        "image_url": {"css": "img::attr(src)", "type": "url"},
+        "description": {"xpath": "//p[@class='d']//text()", "all": True, "default": "none"},
+    }},
+}
+
+def test_site_definition_extracts_typed_fields():
+    site = sitedefs.SiteDefinition(SITE)
+    assert site.source == "shop" and site.allowed_domains == ["shop.example"]
+    body = (b"<h1>A Book</h1><p class='star-rating Three'></p><td class='reviews'> 12 </td>"
+            b"<img src='/covers/a.jpg'>")
+    response = HtmlResponse(url="https://shop.example/books/a", body=body, encoding="utf-8")
+    assert site.extract(response, "Poetry") == {
+        "url": "https://shop.example/books/a", "category": "Poetry", "name": "A Book", "rating": 3,
+        "num_reviews": 12, "image_url": "https://shop.example/covers/a.jpg", "description": "none",
+    }
+
+@pytest.mark.parametrize("change, error", [
+    ({"name": "my shop"}, "simple identifier"),
+    ({"start_urls": []}, "start_urls"),
+    ({"listing": {}}, "listing.items"),
+    ({"detail": {"fields": {"name": "h1::text", "isbn": "td::text"}}}, "unknown fields isbn"),
+    ({"detail": {"fields": {"rating": "p::text"}}}, "detail.fields.name"),
+    ({"detail": {"fields": {"name": {"css": "h1", "xpath": "//h1"}}}}, "exactly one of css / xpath"),
+    ({"detail": {"fields": {"name": {"css": "h1", "type": "date"}}}}, "unknown type"),
+])
+def test_site_definition_errors(change, error):
+    with pytest.raises(sitedefs.SiteDefinitionError, match=error):
+        sitedefs.SiteDefinition({**SITE, **change}, where="shop.yaml")
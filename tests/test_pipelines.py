@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import ANY, AsyncMock, MagicMock
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app" / "crawler"))
+
+pipelines = pytest.importorskip("qtsbook.pipelines")
+from scrapy.settings import Settings  # noqa: E402
+
+def _pipeline(monkeypatch, **settings):
+    client = MagicMock()
+    monkeypatch.setattr(pipelines, "MongoClient", lambda *a, **kw: client)
+    finalized = []
+    monkeypatch.setattr(pipelines, "finalize_generation",
+                        lambda db, run_id, keep=3: finalized.append(run_id) or {"new": 0, "update": 0, "removed": 0})
+    s = Settings({"MONGODB_URI": "mongodb://test", "MONGODB_DB": "qtsbook", "MONGO_GENERATIONS": True,
+                  "BOOK_HISTORY_ENABLED": False, "MONGO_HASH_INDEX": False, **settings})
+    return pipelines.MongoPipeline(settings=s), client, finalized
+
+def _spider(**attrs):
+    return SimpleNamespace(**{"mode": "full", "run_id": None, "logger": logging.getLogger("test"), **attrs})
+
+def test_targeted_batch_records_no_removals(monkeypatch):
+    pipe, _, finalized = _pipeline(monkeypatch)
+    spider = _spider(mode="targeted")
+    pipe.open_spider(spider)
+    pipe.spider_closed(spider, "finished")
+    # diffed per item: no generation is finalized, which is what writes the removals
+    assert pipe.generation is None and finalized == []
+
+    pipe, _, finalized = _pipeline(monkeypatch)
+    spider = _spider()
+    pipe.open_spider(spider)
+    pipe.spider_closed(spider, "finished")
+    assert finalized == [pipe.generation]
+
+def test_resumed_job_finalizes_its_generation_once_complete(monkeypatch):
+    job = {"_id": "20240101T000000-full", "status": "interrupted", "generation": "gen-1"}
+    monkeypatch.setattr(pipelines.Checkpoints, "resumable", staticmethod(lambda db, mode: job))
+    checkpointed = {"uses_checkpoints": lambda settings: True, "resume": True, "generation": None}
+
+    pipe, _, finalized = _pipeline(monkeypatch)
+    spider = _spider(**checkpointed)
+    pipe.open_spider(spider)
+    # the resumed session snapshots into the interrupted session's generation
+    assert pipe.generation == spider.generation == "gen-1"
+    spider.checkpoints = SimpleNamespace(job_id=job["_id"], complete=lambda reason: False)
+    pipe.spider_closed(spider, "finished")
+    assert finalized == []  # complete categories were skipped: their books are not removed
+    spider.checkpoints = SimpleNamespace(job_id=job["_id"], complete=lambda reason: True)
+    pipe.spider_closed(spider, "finished")
+    assert finalized == ["gen-1"]
+
+    # a job started without generations has unsnapshotted sessions behind it
+    job.pop("generation")
+    pipe, _, finalized = _pipeline(monkeypatch)
+    spider = _spider(**checkpointed)
+    pipe.open_spider(spider)
+    spider.checkpoints = SimpleNamespace(job_id=job["_id"], complete=lambda reason: True)
+    pipe.spider_closed(spider, "finished")
+    assert finalized == []
+
+def test_failed_item_is_carried_not_removed(monkeypatch):
+    pipe, _, _ = _pipeline(monkeypatch)
+    spider = _spider()
+    pipe.open_spider(spider)
+    pipe.item_failed({"url": "https://example.com/a", "name": "A"}, None, spider, exception=ValueError("parse"))
+    # carried: finalize fills it in from the previous generation, so the book is not diffed as removed
+    assert pipe._snapshots == [pipelines.snapshot_op(pipe.generation, {"url": "https://example.com/a"}, carried=True)]
+
+    pipe, _, _ = _pipeline(monkeypatch, MONGO_GENERATIONS=False)
+    pipe.open_spider(spider)
+    pipe.item_failed({"url": "https://example.com/a"}, None, spider)
+    assert pipe._snapshots == []
+
+def test_async_pipeline_records_like_the_blocking_one():
+    item = {"url": "https://example.com/a", "name": "A", "price_incl_tax": "£1.00"}
+    prepared = pipelines.prepare_item(dict(item))
+    pipe = pipelines.AsyncMongoPipeline()
+    pipe.db, pipe.books = MagicMock(), AsyncMock()
+    pipe._inflight = asyncio.Semaphore(1)
+    pipe._hashes = {item["url"]: prepared["content_hash"]}
+    pipe.generation = "gen-1"
+
+    asyncio.run(pipe.process_item(dict(prepared), _spider()))
+    # unchanged by the hash index: snapshotted, touched, not rewritten or diffed
+    assert pipe.index_hits == 1 and pipe.touched == 1
+    assert pipe.books.update_one.await_args.args[1] == {"$set": {"crawled_at": ANY}}
+    assert pipe._snapshots == [pipelines.snapshot_op("gen-1", prepared)]
+
+    asyncio.run(pipe.process_item({"url": item["url"], "not_modified": True}, _spider()))
+    assert pipe.not_modified == 1 and len(pipe._snapshots) == 2
+
+class _Generations:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, filt, projection=None):
+        docs = [d for d in self.docs if d["status"] == filt["status"] and d["_id"] != filt["_id"]["$ne"]]
+        return SimpleNamespace(sort=lambda field, direction: sorted(docs, key=lambda d: d[field], reverse=direction < 0))
+
+def test_generations_are_diffed_per_source():
+    baseline = {"_id": "baseline", "status": "complete", "finished_at": 1}
+    both = {"_id": "g1", "status": "complete", "finished_at": 2, "sources": ["books.toscrape.com", "local_mirror"]}
+    mirror = {"_id": "g2", "status": "complete", "finished_at": 3, "sources": ["local_mirror"]}
+    gens = _Generations([baseline, both, mirror, {"_id": "g3", "status": "open", "finished_at": 4}])
+
+    # a books run skips the mirror-only run before it
+    assert pipelines.previous_generations(gens, "g3", ["books.toscrape.com"]) == [(both, {"books.toscrape.com"})]
+    # a source no generation crawled yet falls back to the baseline, which covers every source
+    assert pipelines.previous_generations(gens, "g3", ["local_mirror", "new_site"]) == [
+        (mirror, {"local_mirror"}), (baseline, {"new_site"}),
+    ]
+    assert pipelines._snapshot_match(mirror, {"local_mirror"}) == {"run_id": "g2", "source": {"$in": ["local_mirror"]}}
+    # baseline snapshots may predate the `source` field
+    assert pipelines._snapshot_match(baseline, {"new_site"}) == {"run_id": "baseline", "source": {"$in": ["new_site", None]}}
+
+def test_generation_covers_the_spider_sources(monkeypatch):
+    pipe, client, _ = _pipeline(monkeypatch)
+    pipe.open_spider(_spider(sources=["local_mirror"]))
+    gens = client.__getitem__.return_value.__getitem__.return_value
+    assert gens.update_one.call_args.args[1]["$setOnInsert"]["sources"] == ["local_mirror"]
+
+def _book(n, **fields):
+    return {"url": f"https://example.com/{n}", "name": f"Book {n}", "price_incl_tax": "£10.00", "rating": 3, **fields}
+
+def test_batch_flushes_by_size(monkeypatch):
+    pipe, client, _ = _pipeline(monkeypatch, MONGO_GENERATIONS=False, MONGO_BATCH_SIZE=2, MONGO_BATCH_INTERVAL_MS=0)
+    books = client["qtsbook"]["books"]
+    spider = _spider()
+    pipe.open_spider(spider)
+    pipe.process_item(_book(1), spider)
+    assert books.bulk_write.call_count == 0 and len(pipe._batch) == 1
+    pipe.process_item(_book(2), spider)
+    assert books.bulk_write.call_count == 1 and pipe._batch == []
+    assert len(books.bulk_write.call_args.args[0]) == 2
+    books.update_one.assert_not_called()
+
+def test_batch_flushes_on_interval(monkeypatch):
+    pipe, client, _ = _pipeline(monkeypatch, MONGO_GENERATIONS=False, MONGO_BATCH_SIZE=100, MONGO_BATCH_INTERVAL_MS=0)
+    books = client["qtsbook"]["books"]
+    spider = _spider()
+    pipe.open_spider(spider)
+    pipe.process_item(_book(1), spider)
+    # the LoopingCall's tick: a partial batch doesn't wait for the size
+    pipe._flush_tick(spider)
+    assert books.bulk_write.call_count == 1 and len(books.bulk_write.call_args.args[0]) == 1
+    pipe._flush_tick(spider)
+    assert books.bulk_write.call_count == 1  # nothing left to write
+
+def test_hash_index_skips_unchanged_books(monkeypatch):
+    pipe, client, _ = _pipeline(monkeypatch, MONGO_GENERATIONS=False, MONGO_HASH_INDEX=True)
+    books = client["qtsbook"]["books"]
+    unchanged, changed = _book(1), _book(2)
+    content_hash, _ = pipelines.item_hashes(unchanged)
+    books.find.return_value = [{"url": unchanged["url"], "content_hash": content_hash},
+                               {"url": changed["url"], "content_hash": "b2:stale"}]
+    spider = _spider()
+    pipe.open_spider(spider)
+    books.find.return_value = []
+    pipe.process_item(dict(unchanged), spider)
+    assert pipe.index_hits == 1 and pipe._touch == [unchanged["url"]]
+    books.update_one.assert_not_called()
+    pipe.process_item(dict(changed), spider)
+    assert pipe.index_misses == 1
+    assert [c.args[0] for c in books.update_one.call_args_list] == [{"url": changed["url"]}]
+    # seen again in the same crawl, the book now matches the index
+    pipe.process_item(dict(changed), spider)
+    assert pipe.index_hits == 2 and books.update_one.call_count == 1